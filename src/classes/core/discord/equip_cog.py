@@ -41,6 +41,9 @@ from utils.parse import create_equip_link, int_to_price
 
 logger = logger.bind(tags=["discord_bot"])
 
+# More than enough to fill the 15 pages shown by !equip
+EQUIP_FETCH_LIMIT = 1000
+
 
 @dataclass
 class EquipCog(commands.Cog):
@@ -319,7 +322,16 @@ Everything after the equip name ("peerless staff") is optional
             warning_params = None
             params_ = params.copy()
             opts_ = copy.deepcopy(opts)
-            items = await fetch_equips(self.bot.api_url, params_)
+            # Keep the most recent sales when showing a user's history, else the most expensive
+            is_user_lookup = bool(params.get("seller") or params.get("buyer"))
+            sort = "time" if is_user_lookup else "price"
+            # (User lookups fetch everything, since the sales table totals their full history)
+            max_items = None if is_user_lookup else EQUIP_FETCH_LIMIT
+            fetch = partial(
+                fetch_equips, self.bot.api_url, sort=sort, max_items=max_items
+            )
+
+            items = await fetch(params_)
 
             # If no results, try unabbreviating PHOH, PTWD, etc
             if len(items) == 0:
@@ -328,7 +340,7 @@ Everything after the equip name ("peerless staff") is optional
                     for c in candidates:
                         params__ = params.copy()
                         params__["name"] = c
-                        items.extend(await fetch_equips(self.bot.api_url, params__))
+                        items.extend(await fetch(params__))
 
                     warning_params = f"(Also searched for {', '.join(candidates)})"
 
@@ -336,14 +348,14 @@ Everything after the equip name ("peerless staff") is optional
             if len(items) == 0 and params.get("seller"):
                 params_["seller_partial"] = params.get("seller")
                 del params_["seller"]
-                items = await fetch_equips(self.bot.api_url, params_)
+                items = await fetch(params_)
                 warning_params = f'Hint: Try using quotes if you are looking for a name containing a space (eg `seller"amy bot"`)'
 
             # If no results, allow partial buyer
             if len(items) == 0 and params.get("buyer"):
                 params_["buyer_partial"] = params.get("buyer")
                 del params_["buyer"]
-                items = await fetch_equips(self.bot.api_url, params_)
+                items = await fetch(params_)
                 warning_params = f'Hint: Try using quotes if you are looking for a name containing a space (eg `buyer"amy bot"`)'
 
             # Still no results, return error
@@ -616,24 +628,26 @@ Everything after the equip name ("peerless staff") is optional
 async def fetch_equips(
     api_url: URL,
     params: types._Equip.FetchParams,
+    sort: Literal["price", "time"] = "price",
+    max_items: int | None = EQUIP_FETCH_LIMIT,
 ) -> list[types._Equip.CogEquip]:
-    """Hit search endpoints for equip data
+    """Hit search endpoint for equip data from both Super and Kedama auctions
 
-    Rearranges keys in the response to satisfy CogEquip
-    (because the endpoints return slightly different dtos)
+    Args:
+        sort: Which equips to keep (highest price or most recent) if there are more than max_items
+        max_items: Stop fetching pages after this many equips (None for all)
     """
 
-    ep_super = api_url / "super" / "search_equips"
-    ep_kedama = api_url / "kedama" / "search_equips"
+    ep = api_url / "equips" / "search"
 
     # Search for equip that contains all words
     # so order doesn't matter and partial words are okay
     # eg "lege oak heimd" should match "Legendary Oak Staff of Heimdall"
     name_fragments = re.sub(r"\s", ",", params.get("name", "").strip())
-    ep_super %= dict(name=name_fragments)
-    ep_kedama %= dict(name=name_fragments)
+    ep %= dict(name=name_fragments)
 
     keys: list[str] = [
+        "source",
         "min_date",
         "min_price",
         "max_price",
@@ -645,32 +659,27 @@ async def fetch_equips(
     ]
     for k in keys:
         if (v := params.get(k)) is not None:
-            ep_super %= {k: str(v).strip()}
-            ep_kedama %= {k: str(v).strip()}
+            ep %= {k: str(v).strip()}
 
     if not params.get("is_incomplete"):
         # Ignore on-going auctions
-        ep_super %= dict(complete="true")
-
-    super_data = await do_get(ep_super, content_type="json")
-    kedama_data = await do_get(ep_kedama, content_type="json")
-
-    # Normalize
-    for x in super_data:
-        x["auction"]["title_short"] = "S" + x["auction"]["title"].zfill(3)
-        x["auction"]["time"] = x["auction"]["end_time"]
-        del x["auction"]["end_time"]
-        x["min_bid"] = x["next_bid"]
-        del x["next_bid"]
-    for x in kedama_data:
-        x["auction"]["title_short"] = "K" + x["auction"]["title_short"].zfill(3)
-        x["auction"]["time"] = x["auction"]["start_time"]
-        del x["auction"]["start_time"]
-        x["min_bid"] = x["start_bid"]
-        del x["start_bid"]
-
-    resp = super_data + kedama_data
-    return resp
+        ep %= dict(complete="true")
+
+    page_size = min(max_items or EQUIP_FETCH_LIMIT, EQUIP_FETCH_LIMIT)
+    ep %= dict(sort=sort, limit=page_size)
+
+    result = []
+    cursor = None
+    while True:
+        url = ep % dict(cursor=cursor) if cursor else ep
+        page = await do_get(url, content_type="json", conditional=True)
+        result.extend(page["items"])
+
+        cursor = page["next_cursor"]
+        if cursor is None or (max_items is not None and len(result) >= max_items):
+            break
+
+    return result[:max_items]
 
 
 def _fmt_price(item: types._Equip.CogEquip) -> str:
@@ -1,13 +1,13 @@
-from dataclasses import dataclass
+import asyncio
 import json
 import re
+from dataclasses import dataclass
+from datetime import datetime
 
 from discord.ext import commands
 from discord.ext.commands import Context
-from datetime import datetime
 
 from classes.core import discord
-from classes.core.discord.types import _Lottery as types
 from classes.core.discord.checks import check_perms
 from classes.core.discord.discord_watchers import (
     DeleteWatcher,
@@ -16,9 +16,23 @@ from classes.core.discord.discord_watchers import (
 )
 from classes.core.discord.keywords import YearKey
 from classes.core.discord.table import Col, Table
+from classes.core.discord.types import _Lottery as types
 from utils.discord import alias_by_prefix, paginate
 from utils.http import do_get
 
+# Most recent wins listed by !lwinner
+MAX_WIN_ROWS = 500
+
+# Lottery place --> category in the !lwinner stats (in display order)
+STAT_CATEGORIES = {
+    "1": "Equips",
+    "1b": "Core Wins",
+    "4": "Chaos Tokens",
+    "5": "Chaos Tokens",
+    "2": "GLTs",
+    "3": "Candies",
+}
+
 
 @dataclass
 class LotteryCog(commands.Cog):
@@ -96,7 +110,7 @@ Everything after the equip name ("peerless staff") is optional
         if params.get("min_date"):
             ep %= dict(min_date=str(params.get("min_date")))
 
-        data = await do_get(ep, content_type="json")
+        data = await do_get(ep, content_type="json", conditional=True)
         if len(data) == 0:
             msg = "No data found.\n```yaml\nSearch parameters:"
             debug = params.copy()
@@ -205,13 +219,25 @@ Everything after the username ("프레이") is optional
     async def _lottery_win(self, params: types.FetchParams):
         async def main():
             # Fetch data
-            ep = self.bot.api_url / "lottery" / "search"
-            ep %= dict(user=params["name"])  # type: ignore
+            stats_ep = self.bot.api_url / "lottery" / "user_stats"
+            stats_ep %= dict(user=params["name"])  # type: ignore
+
+            # Only the most recent wins are listed, so heavy winners don't take longer
+            search_ep = self.bot.api_url / "lottery" / "search"
+            search_ep %= dict(user=params["name"])  # type: ignore
+            search_ep %= dict(limit=str(MAX_WIN_ROWS))
+
             if params.get("min_date"):
-                ep %= dict(min_date=str(params.get("min_date")))
-            data = await do_get(ep, content_type="json")
+                stats_ep %= dict(min_date=str(params.get("min_date")))
+                search_ep %= dict(min_date=str(params.get("min_date")))
 
-            if len(data) == 0:
+            stats, page = await asyncio.gather(
+                do_get(stats_ep, content_type="json", conditional=True),
+                do_get(search_ep, content_type="json", conditional=True),
+            )
+            data = page["items"]
+
+            if stats["user"] is None or len(data) == 0:
                 msg = "No data found.\n```yaml\nSearch parameters:"
                 debug = params.copy()
                 debug["user"] = params["name"]  # type: ignore
@@ -223,63 +249,25 @@ Everything after the username ("프레이") is optional
 
                 pages = paginate(msg)
                 return pages
-            data.sort(key=lambda x: x["date"], reverse=True)
-
-            # Extract username
-            for item, winner in data[0]["prizes"]:
-                winner = winner or ""
-                if winner.lower() == params["name"].lower():  # type: ignore
-                    user = winner
-                    break
-            else:
-                raise Exception(
-                    f"{params.get('name')} did not win any prizes in lottery {data[0]}"
-                )
+
+            user = stats["user"]
 
             # Print
             item_tbl = create_item_table(data, user).print()
-            stats_tbl = create_stats_table(data, user).print()
+            stats_tbl = create_stats_table(stats["places"]).print()
             msg = f"```css\n@{user}\n\n{stats_tbl}\n\n{item_tbl}\n```"
+            if page["total"] > len(data):
+                msg += f"Showing the latest {len(data)} of {page['total']} wins."
             pages = paginate(msg)
             return pages
 
-        def create_stats_table(data: list[dict], user: str):
+        def create_stats_table(places: list[dict]):
             # Tally winnings
-            stats = {
-                "Equips": dict(count=0, wins=0),
-                "Core Wins": dict(count=0, wins=0),
-                "Chaos Tokens": dict(count=0, wins=0),
-                "GLTs": dict(count=0, wins=0),
-                "Candies": dict(count=0, wins=0),
-            }
-
-            # Keys from the dict above but matching the lottery prize order
-            stat_keys = [
-                "Equips",
-                "Core Wins",
-                "GLTs",
-                "Candies",
-                "Chaos Tokens",
-                "Chaos Tokens",
-            ]
-
-            for lottery in data:
-                for idx, (item, winner) in enumerate(lottery["prizes"]):
-                    winner = winner or ""
-                    if winner == user:
-                        stats[stat_keys[idx]]["wins"] += 1
-
-                        if idx in [0, 1]:
-                            stats[stat_keys[idx]]["count"] += 1
-                        else:
-                            [count, name] = item
-                            stats[stat_keys[idx]]["count"] += count
-
-                        break
-                else:
-                    raise Exception(
-                        f"User {user} did not win any prizes in lottery {lottery}"
-                    )
+            stats = {cat: dict(count=0, wins=0) for cat in STAT_CATEGORIES.values()}
+            for p in places:
+                cat = STAT_CATEGORIES[p["place"]]
+                stats[cat]["count"] += p["quantity"]
+                stats[cat]["wins"] += p["wins"]
 
             # Crate table
             tbl = Table()
@@ -327,12 +315,11 @@ Everything after the username ("프레이") is optional
 
         def fmt_prize(lottery: dict, user: str):
             prizes = lottery["prizes"]
-            if prizes[0][1] == user:  # type: ignore
+            if is_same_user(prizes[0][1], user):
                 return _fmt_name(prizes[0][0])
             else:
                 for prize in prizes[1:]:
-                    winner = prize[1] or ""
-                    if winner == user:  # type: ignore
+                    if is_same_user(prize[1], user):
                         return _fmt_name(prize[0])
                 else:
                     raise Exception(
@@ -340,16 +327,21 @@ Everything after the username ("프레이") is optional
                     )
 
         def fmt_grand_prize(lottery: dict, user: str):
-            if lottery["prizes"][0][1] == user:  # type: ignore
+            if is_same_user(lottery["prizes"][0][1], user):
                 return "<-"
             else:
                 return lottery["prizes"][0][0] or "??????????????????????"
 
+        def is_same_user(winner: str | None, user: str) -> bool:
+            # The api matches names case-insensitively
+            return (winner or "").lower() == user.lower()
+
         return await main()
 
     def __hash__(self) -> int:
         return self.__class__.__name__.__hash__()
 
+
 def _fmt_date(ts, title) -> str:
     title_str = "#" + title[:4]
     ts_str = datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
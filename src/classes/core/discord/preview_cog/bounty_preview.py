@@ -6,6 +6,7 @@ import loguru
 import yarl
 from bs4 import BeautifulSoup, Tag
 
+from classes.hv_limiter import Priority, hv_bucket
 from config import paths
 from utils.html import (
     get_attr_or_raise,
@@ -56,6 +57,8 @@ async def fetch_bounty_page(bid: int) -> tuple[BeautifulSoup, str] | tuple[None,
     url = f"https://e-hentai.org/bounty.php?bid={bid}"
 
     try:
+        await hv_bucket.acquire(Priority.INTERACTIVE)
+
         LOGGER.info(f"Fetching {url}")
         resp = await session.get(url)
         LOGGER.info(f"{resp.status} for {url}")
@@ -1,12 +1,16 @@
+import asyncio
 import re
 import traceback
 from dataclasses import dataclass
 
-import requests
 import tomli
 import yarl
 
 from config.paths import CONFIG_DIR
+from utils.http import do_post
+
+# Max equips per /equips/batch request (EQUIP_BATCH_LIMIT in server.py)
+EQUIP_BATCH_SIZE = 25
 
 
 @dataclass
@@ -22,16 +26,14 @@ def extract_equip_links(text: str):
     return _extract_links(text) + _extract_legacy_links(text)
 
 
-def generate_equip_preview(links: list[EquipLink]) -> tuple[list[str], bool]:
+async def generate_equip_preview(links: list[EquipLink]) -> tuple[list[str], bool]:
     config = tomli.loads((CONFIG_DIR / "preview_config.toml").read_text())
 
-    with_info = []
-    for l in links:
-        d = _fetch_equip_info(config["equip"]["api_url"], l.eid, l.key, l.is_isekai)
-        with_info.append(dict(link=l, info=d))
+    infos = await _fetch_equip_infos(config["equip"]["api_url"], links)
+    if any(d is None for d in infos):
+        return [], True
 
-        if d is None:
-            return [], True
+    with_info = [dict(link=l, info=d) for l, d in zip(links, infos)]
 
     try:
         previews = []
@@ -109,13 +111,28 @@ def _extract_legacy_links(text: str) -> list[EquipLink]:
     return matches
 
 
-def _fetch_equip_info(api_url: str, eid: int, key: str, is_isekai: bool):
-    resp = requests.get(f"{api_url}/equip?eid={eid}&key={key}&is_isekai={is_isekai}")
+async def _fetch_equip_infos(api_url: str, links: list[EquipLink]) -> list[dict | None]:
+    """Fetch info for all links, EQUIP_BATCH_SIZE per request (None for each equip that couldn't be fetched)"""
 
-    if resp.status_code == 200:
-        return resp.json()
-    else:
-        return None
+    batches = [
+        links[idx : idx + EQUIP_BATCH_SIZE]
+        for idx in range(0, len(links), EQUIP_BATCH_SIZE)
+    ]
+    results = await asyncio.gather(*[_fetch_batch(api_url, b) for b in batches])
+    return [info for batch in results for info in batch]
+
+
+async def _fetch_batch(api_url: str, links: list[EquipLink]) -> list[dict | None]:
+    body = [dict(eid=l.eid, key=l.key, is_isekai=l.is_isekai) for l in links]
+    try:
+        results = await do_post(
+            f"{api_url}/equips/batch", json=body, content_type="json"
+        )
+    except Exception:
+        traceback.print_exc()
+        return [None for _ in links]
+
+    return [r["data"] if r["status"] == 200 else None for r in results]
 
 
 def _format_terse_equip_preview(config: dict, info: dict):
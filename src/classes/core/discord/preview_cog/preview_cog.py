@@ -43,7 +43,6 @@ class PreviewCog(commands.Cog):
     bot: "discord.AmyBot"
 
     THREAD_FETCH_DELAY = 2
-    BOUNTY_FETCH_DELAY = 2
 
     def __init__(self, bot, *args: Any) -> None:
         super().__init__(*args)
@@ -51,7 +50,6 @@ class PreviewCog(commands.Cog):
         self.bot = bot
 
         self.last_thread_fetch = 0
-        self.last_bounty_fetch = 0
 
     @commands.Cog.listener()
     async def on_message(self, msg: Message):
@@ -68,7 +66,7 @@ class PreviewCog(commands.Cog):
             return
 
         async with msg.channel.typing():
-            equip_previews, has_fail = generate_equip_preview(links)
+            equip_previews, has_fail = await generate_equip_preview(links)
             if has_fail:
                 await msg.add_reaction("❌")
 
@@ -197,14 +195,7 @@ class PreviewCog(commands.Cog):
         has_fail = False
         async with msg.channel.typing():
             for l in links:
-                # Rate limit
-                delay, self.last_bounty_fetch = _calc_delay(
-                    self.last_bounty_fetch, self.BOUNTY_FETCH_DELAY
-                )
-                if delay > 0:
-                    await asyncio.sleep(delay)
-
-                # Fetch bounty
+                # Fetch bounty (rate limited by hv_bucket)
                 soup, url = await fetch_bounty_page(l["bid"])
                 if not soup:
                     continue
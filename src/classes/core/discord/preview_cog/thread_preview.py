@@ -363,7 +363,8 @@ async def fetch_super_auction_info(api_url: yarl.URL, id_auction: str):
     params = types._Equip.FetchParams()
     params["id_auction"] = id_auction
     params["is_incomplete"] = True
-    equips = await fetch_equips(api_url, params)
+    params["source"] = "super"
+    equips = await fetch_equips(api_url, params, max_items=None)
 
     return equips
 
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Optional, TypedDict
+from typing import Literal, Optional, TypedDict
 
 
 class _Equip:
@@ -14,6 +14,7 @@ class _Equip:
         buyer_partial: str | None
         id_auction: str | None
         is_incomplete: bool | None
+        source: Literal["super", "kedama"] | None
 
     @dataclass
     class FormatOptions:
@@ -23,11 +24,14 @@ class _Equip:
         show_thread_link: bool = False
 
     class CogAuction(TypedDict):
+        id: str
         time: float
         is_complete: bool
         title: str
+        title_short: str
 
     class CogEquip(TypedDict):
+        source: Literal["super", "kedama"]
         id: str
         name: str
         eid: int
@@ -1,8 +1,8 @@
 import re
 from typing import cast
 
+import aiohttp
 import loguru
-import requests
 from bs4 import BeautifulSoup, Tag
 
 from config import paths
@@ -17,19 +17,31 @@ from utils.misc import load_toml
 
 LOGGER = loguru.logger.bind(tags=["equip_parser"])
 
+# Reused across fetches for keep-alive (created lazily because it needs a running event loop)
+_hv_session: aiohttp.ClientSession | None = None
 
-def _init_hv_session():
-    secrets = load_toml(paths.SECRETS_FILE).value
 
-    session = requests.Session()
-    for k, v in secrets["HV_COOKIES"].items():
-        session.cookies.set(k, str(v))
+def _get_hv_session() -> aiohttp.ClientSession:
+    global _hv_session
 
-    return session
+    if _hv_session is None or _hv_session.closed:
+        secrets = load_toml(paths.SECRETS_FILE).value
+        cookies = {k: str(v) for k, v in secrets["HV_COOKIES"].items()}
 
+        _hv_session = aiohttp.ClientSession(cookies=cookies)
 
-def fetch_equip_html(eid: int, key: str, is_isekai: bool):
-    session = _init_hv_session()
+    return _hv_session
+
+
+async def close_hv_session() -> None:
+    if _hv_session is not None:
+        await _hv_session.close()
+
+
+async def fetch_equip_html(eid: int, key: str, is_isekai: bool) -> tuple[int, str]:
+    """Returns (status code, html)"""
+
+    session = _get_hv_session()
 
     if not is_isekai:
         url = f"https://hentaiverse.org/equip/{eid}/{key}"
@@ -37,10 +49,11 @@ def fetch_equip_html(eid: int, key: str, is_isekai: bool):
         url = f"https://hentaiverse.org/isekai/equip/{eid}/{key}"
 
     LOGGER.info(f"Fetching {url}")
-    resp = session.get(url)
+    async with session.get(url) as resp:
+        html = await resp.text()
     LOGGER.info("Fetch complete.")
 
-    return resp
+    return resp.status, html
 
 
 def parse_equip_html(html: str) -> dict:
@@ -0,0 +1,558 @@
+import gzip
+import itertools
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterator, Literal
+
+import pyarrow
+import pyarrow.ipc
+import pyarrow.parquet
+
+from classes.core.server import logger
+from classes.core.server.metrics import iter_timed
+from classes.db import (
+    EXPORTED_TABLES,
+    DbPool,
+    select_export_version,
+    select_primary_key,
+    select_table_version,
+)
+from config import paths
+
+EXPORT_DIR = paths.DATA_DIR / "exports"
+
+# Previous snapshots are kept for a bit in case they're still being downloaded
+NUM_SNAPSHOTS_KEPT = 2
+
+CHUNK_SIZE = 2**16
+
+# Rows per record batch in the columnar exports (so memory use doesn't depend on the table size)
+BATCH_ROWS = 10_000
+
+ColumnarFormat = Literal["parquet", "arrow"]
+
+
+@dataclass
+class Snapshot:
+    path: Path
+    # Value of select_export_version() when the snapshot was taken
+    version: int
+
+
+def latest_sqlite_export() -> Snapshot | None:
+    snapshots = _list_snapshots("sqlite", "sql.gz")
+    return snapshots[-1] if snapshots else None
+
+
+def build_sqlite_export(fp: Path | str = paths.DB_FILE) -> Snapshot:
+    """Write a gzip'd .dump of the exported tables to EXPORT_DIR
+
+    The dump is streamed to disk so memory use doesn't depend on the db size.
+    """
+
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    copy_fp = EXPORT_DIR / f"sqlite.{os.getpid()}.tmp.sqlite"
+    dump_fp = EXPORT_DIR / f"sqlite.{os.getpid()}.tmp.sql.gz"
+
+    try:
+        # Copy db (onto disk rather than into memory)
+        copy_fp.unlink(missing_ok=True)
+        db = sqlite3.connect(fp)
+        db_copy = sqlite3.connect(copy_fp)
+        db.backup(db_copy)
+        db.close()
+
+        version = select_export_version(db_copy)
+        _drop_unexported(db_copy)
+
+        # Export
+        with gzip.open(dump_fp, "wt", encoding="utf-8") as file:
+            for line in db_copy.iterdump():
+                # sqlite_sequence can't be dropped, and only applies to the unexported tables anyway
+                if '"sqlite_sequence"' in line[:40]:
+                    continue
+                file.write(line + "\n")
+        db_copy.close()
+
+        snapshot = Snapshot(EXPORT_DIR / f"sqlite-{version}.sql.gz", version)
+        dump_fp.replace(snapshot.path)
+    finally:
+        copy_fp.unlink(missing_ok=True)
+        dump_fp.unlink(missing_ok=True)
+
+    _prune_snapshots("sqlite", "sql.gz")
+    logger.info(f"Built sqlite export for version {version}")
+
+    return snapshot
+
+
+def latest_columnar_export(table: str, format: ColumnarFormat) -> Snapshot | None:
+    snapshots = _list_snapshots(table, format)
+    return snapshots[-1] if snapshots else None
+
+
+_columnar_locks: dict[tuple[str, str], threading.Lock] = dict()
+_columnar_locks_guard = threading.Lock()
+
+
+def get_columnar_export(pool: DbPool, table: str, format: ColumnarFormat) -> Snapshot:
+    """Get a Parquet / Arrow IPC file for a table, (re)building it if the table changed since the last one"""
+
+    with pool.connection() as db:
+        version = select_table_version(db, table)
+
+    snapshot = latest_columnar_export(table, format)
+    if snapshot is not None and snapshot.version >= version:
+        return snapshot
+
+    with _columnar_locks_guard:
+        lock = _columnar_locks.setdefault((table, format), threading.Lock())
+
+    with lock:
+        # Another request may have built it while we waited
+        snapshot = latest_columnar_export(table, format)
+        if snapshot is not None and snapshot.version >= version:
+            return snapshot
+        return build_columnar_export(pool, table, format)
+
+
+def build_columnar_export(pool: DbPool, table: str, format: ColumnarFormat) -> Snapshot:
+    """Write a table to EXPORT_DIR as Parquet / Arrow IPC
+
+    Json columns (equip stats, lottery prizes, equip data) are also expanded into one column per key,
+    eg "stats.ADB" for super_equips or "2_prize.quantity" for lottery_weapon.
+
+    The table is read twice, first for the schema (since the expanded columns depend on every row),
+    then to write the rows in batches of BATCH_ROWS.
+    """
+
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_fp = EXPORT_DIR / f"{table}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    try:
+        with pool.connection() as db:
+            # Both reads in one transaction so that they see the same rows
+            db.execute("BEGIN")
+            version = select_table_version(db, table)
+
+            schema = _select_arrow_schema(db, table)
+            rows = iter_timed(db.execute(f"SELECT * FROM {table}"))
+
+            if format == "parquet":
+                writer = pyarrow.parquet.ParquetWriter(
+                    tmp_fp, schema, compression="zstd"
+                )
+            else:
+                options = pyarrow.ipc.IpcWriteOptions(compression="lz4")
+                writer = pyarrow.ipc.new_file(tmp_fp, schema, options=options)
+
+            with writer:
+                while batch := list(itertools.islice(rows, BATCH_ROWS)):
+                    writer.write_batch(_to_record_batch(table, batch, schema))
+
+        snapshot = Snapshot(EXPORT_DIR / f"{table}-{version}.{format}", version)
+        tmp_fp.replace(snapshot.path)
+    finally:
+        tmp_fp.unlink(missing_ok=True)
+
+    _prune_snapshots(table, format)
+    logger.info(f"Built {format} export of {table} for version {version}")
+
+    return snapshot
+
+
+def _select_arrow_schema(db: sqlite3.Connection, table: str) -> pyarrow.Schema:
+    """Columns of the table (typed by their declared type) followed by the expanded json columns (typed by their values)"""
+
+    fields = []
+    # Python types of the values in each column without a declared type
+    value_types: dict[str, set[type]] = dict()
+
+    for c in db.execute(f"PRAGMA table_info({table})").fetchall():
+        arrow_type = _ARROW_TYPES.get(c["type"])
+        if arrow_type is None:
+            value_types[c["name"]] = set()
+        fields.append((c["name"], arrow_type))
+
+    flatteners = JSON_COLUMNS.get(table, dict())
+    expanded: dict[str, set[type]] = dict()
+    for row in iter_timed(db.execute(f"SELECT * FROM {table}")):
+        for name, types in value_types.items():
+            if row[name] is not None:
+                types.add(type(row[name]))
+
+        for name, values in _expand_json(row, flatteners).items():
+            for key, value in values.items():
+                types = expanded.setdefault(key, set())
+                if value is not None:
+                    types.add(type(value))
+
+    fields = [
+        (name, arrow_type or _infer_arrow_type(value_types[name]))
+        for name, arrow_type in fields
+    ]
+    fields += [
+        (key, _infer_arrow_type(types)) for key, types in sorted(expanded.items())
+    ]
+    return pyarrow.schema(fields)
+
+
+def _to_record_batch(
+    table: str, rows: list[sqlite3.Row], schema: pyarrow.Schema
+) -> pyarrow.RecordBatch:
+    columns: dict[str, list] = {name: [] for name in schema.names}
+    flatteners = JSON_COLUMNS.get(table, dict())
+
+    for row in rows:
+        values = dict(zip(row.keys(), row))
+        for expanded in _expand_json(row, flatteners).values():
+            values.update(expanded)
+
+        for name, column in columns.items():
+            column.append(values.get(name))
+
+    arrays = []
+    for field in schema:
+        values = columns[field.name]
+        if pyarrow.types.is_string(field.type):
+            # Mixed types (eg a level that's either a number or "Unassigned")
+            values = [None if v is None else str(v) for v in values]
+        arrays.append(pyarrow.array(values, type=field.type))
+
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _expand_json(
+    row: sqlite3.Row, flatteners: dict[str, Callable[[Any], dict[str, Any]]]
+) -> dict[str, dict[str, Any]]:
+    """Values of the expanded columns, by json column (eg {"stats": {"stats.ADB": 94}})"""
+
+    result = dict()
+    for name, flatten in flatteners.items():
+        if row[name] is not None:
+            result[name] = {
+                f"{name}.{key}": value
+                for key, value in flatten(json.loads(row[name])).items()
+            }
+    return result
+
+
+def _flatten_stat_list(stats: Any) -> dict[str, float]:
+    """eg ["ADB 94%", "Holy EDB 73%"] -> {"ADB": 94, "Holy EDB": 73}"""
+
+    result = dict()
+    if isinstance(stats, list):
+        for text in stats:
+            m = re.fullmatch(r"(.+?) (-?[\d.]+)%?", str(text))
+            if m:
+                result[m.group(1)] = float(m.group(2))
+    return result
+
+
+def _flatten_prize(prize: Any) -> dict[str, Any]:
+    """eg [3, "Binding of Slaughter"] -> {"quantity": 3, "name": "Binding of Slaughter"}"""
+
+    match prize:
+        case [quantity, name]:
+            return dict(quantity=quantity, name=name)
+        case _:
+            return dict()
+
+
+def _flatten_dict(data: Any, prefix: str = "") -> dict[str, Any]:
+    """eg {"stats": {"misc": {"Burden": {"value": 7}}}} -> {"stats.misc.Burden.value": 7}
+
+    Lists are left as json
+    """
+
+    result = dict()
+    if isinstance(data, dict):
+        for key, value in data.items():
+            result.update(_flatten_dict(value, f"{prefix}{key}."))
+    elif isinstance(data, list):
+        result[prefix[:-1]] = json.dumps(data)
+    else:
+        result[prefix[:-1]] = data
+    return result
+
+
+# Json columns to expand in the columnar exports
+JSON_COLUMNS: dict[str, dict[str, Callable[[Any], dict[str, Any]]]] = {
+    "super_equips": {"stats": _flatten_stat_list},
+    "kedama_equips": {"stats": _flatten_stat_list},
+    "lottery_weapon": {f"{rank}_prize": _flatten_prize for rank in [2, 3, 4, 5]},
+    "lottery_armor": {f"{rank}_prize": _flatten_prize for rank in [2, 3, 4, 5]},
+    "equips": {"data": _flatten_dict},
+}
+
+_ARROW_TYPES = dict(
+    INTEGER=pyarrow.int64(),
+    REAL=pyarrow.float64(),
+    TEXT=pyarrow.string(),
+)
+
+
+def _infer_arrow_type(types: set[type]) -> pyarrow.DataType:
+    """Type for a column whose values have these python types"""
+
+    if not types:
+        return pyarrow.null()
+    elif types == {bool}:
+        return pyarrow.bool_()
+    elif types == {int}:
+        return pyarrow.int64()
+    elif types <= {int, float}:
+        return pyarrow.float64()
+    else:
+        return pyarrow.string()
+
+
+def iter_decompressed(fp: Path) -> Iterator[bytes]:
+    """Read a gzip'd snapshot for clients that don't accept gzip"""
+
+    with gzip.open(fp, "rb") as file:
+        while chunk := file.read(CHUNK_SIZE):
+            yield chunk
+
+
+def iter_json_export(
+    pool: DbPool,
+    tables: list[str],
+    since: int | None = None,
+    format: Literal["json", "ndjson"] = "json",
+) -> Iterator[bytes]:
+    """Stream rows from each table, one table at a time
+
+    Args:
+        tables: Subset of EXPORTED_TABLES
+        since: Only include rows inserted / updated after this export version
+        format: json for a single {table: [row, ...]} object, ndjson for a {"table": ..., "row": ...} object per line
+    """
+
+    # Reads all happen in one transaction so that tables are consistent with each other
+    with pool.connection() as db:
+        db.execute("BEGIN")
+
+        buffer: list[str] = []
+        size = 0
+
+        if format == "json":
+            buffer.append("{")
+
+        for idx_table, table in enumerate(tables):
+            if format == "json":
+                prefix = "," if idx_table > 0 else ""
+                buffer.append(f"{prefix}{json.dumps(table)}:[")
+
+            for idx_row, row in enumerate(iter_timed(_select_rows(db, table, since))):
+                if format == "json":
+                    prefix = "," if idx_row > 0 else ""
+                    text = prefix + json.dumps(dict(row))
+                else:
+                    text = json.dumps(dict(table=table, row=dict(row))) + "\n"
+
+                buffer.append(text)
+                size += len(text)
+
+                # Yield in chunks rather than per row to cut down on overhead
+                if size >= CHUNK_SIZE:
+                    yield "".join(buffer).encode()
+                    buffer = []
+                    size = 0
+
+            if format == "json":
+                buffer.append("]")
+
+        if format == "json":
+            buffer.append("}")
+
+        yield "".join(buffer).encode()
+
+
+def iter_changes(
+    pool: DbPool,
+    since: int,
+    until: int,
+    format: Literal["ndjson", "sql"] = "ndjson",
+) -> Iterator[bytes]:
+    """Stream the rows inserted / updated / deleted in (since, until]
+
+    Only the latest change to each row is included, with upserts containing the row's current values.
+    Rows deleted after until are skipped (the delete shows up in the next delta).
+
+    Args:
+        format: ndjson for an {"op": "upsert" | "delete", "table": ..., "row" | "key": ...} object per line,
+                sql for statements that can be piped into sqlite3
+    """
+
+    with pool.connection() as db:
+        db.execute("BEGIN")
+
+        buffer: list[str] = []
+        size = 0
+
+        if format == "sql":
+            buffer.append("BEGIN TRANSACTION;\n")
+
+        for table in EXPORTED_TABLES:
+            pk_cols = select_primary_key(db, table)
+            params = [since, until, table]
+
+            deleted = db.execute(
+                f"""
+                SELECT row_key FROM ({_LATEST_CHANGES})
+                WHERE is_delete = 1
+                """,
+                params,
+            )
+            for r in iter_timed(deleted):
+                key = dict(zip(pk_cols, json.loads(r["row_key"])))
+                if format == "ndjson":
+                    text = json.dumps(dict(op="delete", table=table, key=key))
+                else:
+                    condition = " AND ".join(
+                        f'"{c}" = {_to_sql_literal(v)}' for c, v in key.items()
+                    )
+                    text = f'DELETE FROM "{table}" WHERE {condition};'
+
+                buffer.append(text + "\n")
+                size += len(text) + 1
+
+                if size >= CHUNK_SIZE:
+                    yield "".join(buffer).encode()
+                    buffer = []
+                    size = 0
+
+            key_cols = ", ".join(f'"{c}"' for c in pk_cols)
+            key_values = ", ".join(
+                f"json_extract(row_key, '$[{i}]')" for i in range(len(pk_cols))
+            )
+            upserted = db.execute(
+                f"""
+                SELECT * FROM {table}
+                WHERE ({key_cols}) IN (
+                    SELECT {key_values} FROM ({_LATEST_CHANGES})
+                    WHERE is_delete = 0
+                )
+                """,
+                params,
+            )
+            for row in iter_timed(upserted):
+                if format == "ndjson":
+                    text = json.dumps(dict(op="upsert", table=table, row=dict(row)))
+                else:
+                    cols = ", ".join(f'"{c}"' for c in row.keys())
+                    values = ", ".join(_to_sql_literal(v) for v in row)
+                    text = (
+                        f'INSERT OR REPLACE INTO "{table}" ({cols}) VALUES ({values});'
+                    )
+
+                buffer.append(text + "\n")
+                size += len(text) + 1
+
+                if size >= CHUNK_SIZE:
+                    yield "".join(buffer).encode()
+                    buffer = []
+                    size = 0
+
+        if format == "sql":
+            buffer.append("COMMIT;\n")
+
+        yield "".join(buffer).encode()
+
+
+# Last change to each row of a table in a version range (the bare columns come from the row with the MAX())
+_LATEST_CHANGES = """
+    SELECT row_key, is_delete, MAX(version) FROM export_changes
+    WHERE version > ? AND version <= ? AND table_name = ?
+    GROUP BY row_key
+"""
+
+
+def _to_sql_literal(value) -> str:
+    if value is None:
+        return "NULL"
+    elif isinstance(value, int):
+        return str(value)
+    elif isinstance(value, float):
+        # repr() gives the shortest string that round-trips, except for inf
+        return (
+            repr(value)
+            if math.isfinite(value)
+            else ("9e999" if value > 0 else "-9e999")
+        )
+    elif isinstance(value, bytes):
+        return f"X'{value.hex()}'"
+    else:
+        return "'" + str(value).replace("'", "''") + "'"
+
+
+def _select_rows(
+    db: sqlite3.Connection, table: str, since: int | None
+) -> Iterator[sqlite3.Row]:
+    if since is None:
+        return db.execute(f"SELECT * FROM {table}")
+
+    # Rows whose primary key was logged as changed
+    pk_cols = select_primary_key(db, table)
+    key_cols = ", ".join(f'"{c}"' for c in pk_cols)
+    key_values = ", ".join(
+        f"json_extract(row_key, '$[{i}]')" for i in range(len(pk_cols))
+    )
+    return db.execute(
+        f"""
+        SELECT * FROM {table}
+        WHERE ({key_cols}) IN (
+            SELECT {key_values} FROM export_changes
+            WHERE version > ? AND table_name = ? AND is_delete = 0
+        )
+        """,
+        [since, table],
+    )
+
+
+def _drop_unexported(db: sqlite3.Connection) -> None:
+    with db:
+        # Triggers that maintain unexported tables (eg the name indices)
+        triggers = db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger'"
+        ).fetchall()
+        for (trigger,) in triggers:
+            db.execute(f'DROP TRIGGER "{trigger}"')
+
+        views = db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'view'"
+        ).fetchall()
+        for (view,) in views:
+            db.execute(f'DROP VIEW "{view}"')
+
+        tables = db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        ).fetchall()
+        for (tbl,) in tables:
+            if tbl not in EXPORTED_TABLES and tbl != "sqlite_sequence":
+                # Dropping a virtual table also drops its shadow tables
+                db.execute(f'DROP TABLE IF EXISTS "{tbl}"')
+
+
+def _list_snapshots(name: str, ext: str) -> list[Snapshot]:
+    """Snapshots in EXPORT_DIR, oldest first"""
+
+    snapshots = []
+    for fp in EXPORT_DIR.glob(f"{name}-*.{ext}"):
+        m = re.fullmatch(rf"{name}-(\d+)\.{re.escape(ext)}", fp.name)
+        if m:
+            snapshots.append(Snapshot(fp, int(m.group(1))))
+
+    return sorted(snapshots, key=lambda s: s.version)
+
+
+def _prune_snapshots(name: str, ext: str) -> None:
+    for snapshot in _list_snapshots(name, ext)[:-NUM_SNAPSHOTS_KEPT]:
+        snapshot.path.unlink(missing_ok=True)
@@ -1,5 +1,6 @@
 import json
 import math
+import threading
 
 import loguru
 
@@ -7,14 +8,101 @@ from config import paths
 
 LOGGER = loguru.logger.bind(tags=["equip_parser"])
 
+# (is_negated, lowercased pattern), or None for "all" (see RangeIndex.find_min_max)
+_Requirement = tuple[bool, str] | None
+
+
+class RangeIndex:
+    """Range data (see _enumerate_range_path_options_from_name) with lowercased keys
+
+    Names are matched case-insensitively (to handle the no-custom-font case),
+    so lowercasing once here turns each level of a lookup into a dict get instead of a scan.
+    The "prefix | suffix" requirements of each stat are also parsed ahead of time.
+    """
+
+    def __init__(self, ranges: dict, mtime: int | None = None):
+        self.tree = _compile(ranges)
+        # Of the file this was compiled from
+        self.mtime = mtime
+
+    def find_min_max(self, path: dict, stat: str) -> tuple[float, float] | None:
+        """
+        Args:
+            path: Lowercased path option
+            stat:
+        """
+
+        stat = stat.lower()
+
+        # Try slot -> quality -> stat
+        reqs = self._walk([path["slot"], path["quality"], stat])
+
+        # Try category -> slot -> quality -> stat
+        if not reqs and path["category"]:
+            reqs = self._walk([path["category"], path["slot"], path["quality"], stat])
+
+        if not reqs:
+            return None
+
+        for prefix_req, suffix_req, min_max in reqs:
+            if _is_match(prefix_req, path["prefix"]) and _is_match(
+                suffix_req, path["suffix"]
+            ):
+                return min_max
+
+        return None
+
+    def _walk(self, keys: list[str]):
+        v = self.tree
+        for k in keys:
+            if not isinstance(v, dict):
+                return None
+            v = v.get(k)
+            if v is None:
+                return None
+        return v
+
+
+_range_index: RangeIndex | None = None
+_load_lock = threading.Lock()
+
+
+def load_range_index() -> RangeIndex:
+    """Get the compiled RANGES_FILE, recompiling it if the file changed since"""
+
+    global _range_index
+
+    mtime = paths.RANGES_FILE.stat().st_mtime_ns
+    index = _range_index
+    if index is not None and index.mtime == mtime:
+        return index
+
+    with _load_lock:
+        # Another thread may have reloaded while we waited
+        index = _range_index
+        if index is not None and index.mtime == mtime:
+            return index
+
+        index = RangeIndex(json.loads(paths.RANGES_FILE.read_text()), mtime)
+        _range_index = index
+        return index
+
 
 def infer_equip_stats(
     equip: dict,
     ranges_override: dict | None = None,
 ):
-    percentiles = _calc_all_percentiles(equip, ranges_override)
+    if ranges_override is None:
+        index = load_range_index()
+    else:
+        index = RangeIndex(ranges_override)
+
+    # Same for both tiers, since the downgrades don't depend on the quality
+    real_bases = _downgrade_all_stats(equip)
+
+    percentiles = _calc_all_percentiles(index, equip, real_bases)
     legendary_percentiles = _calc_all_percentiles(
-        equip, ranges_override, tier_override="Legendary"
+        index, equip, real_bases, tier_override="Legendary"
     )
 
     return dict(
@@ -23,52 +111,52 @@ def infer_equip_stats(
     )
 
 
+def _downgrade_all_stats(equip: dict) -> dict[str, dict[str, float]]:
+    """Base value of each stat without forging / IW, keyed like the percentiles"""
+
+    real_bases = dict()
+
+    if equip["weapon_damage"]:
+        base = equip["weapon_damage"]["Attack Damage"]["base"]
+        real_bases["weapon_damage"] = {
+            "Attack Damage": _downgrade_stat("", "Attack Damage", base, equip)
+        }
+
+    for cat, stats in equip["stats"].items():
+        real_bases[cat] = {
+            st: _downgrade_stat(cat, st, d["base"], equip) for st, d in stats.items()
+        }
+
+    return real_bases
+
+
 @LOGGER.catch(reraise=True)
 def _calc_all_percentiles(
+    index: RangeIndex,
     equip: dict,
-    ranges_override: dict | None = None,
+    real_bases: dict[str, dict[str, float]],
     tier_override: str | None = None,
 ):
-    if ranges_override is None:
-        ranges = json.loads(paths.RANGES_FILE.read_text())
-    else:
-        ranges = ranges_override
-
     path_options = _enumerate_range_path_options_from_name(equip["name"])
     if tier_override:
         for p in path_options:
             p["quality"] = tier_override
 
+    # Lowercased once here rather than per lookup
+    path_options = [
+        {k: v.lower() if v else v for k, v in p.items()} for p in path_options
+    ]
+
     percentiles = dict()
 
-    if equip["weapon_damage"]:
-        base = equip["weapon_damage"]["Attack Damage"]["base"]
-        real_base = _downgrade_stat("", "Attack Damage", base, equip)
-
-        percentiles["weapon_damage"] = {
-            "Attack Damage": _calc_percentile(
-                ranges,
-                path_options,
-                "",
-                "Attack Damage",
-                real_base,
-            ),
-        }
+    for key, stats in real_bases.items():
+        # Weapon damage has no category in the range data
+        cat = "" if key == "weapon_damage" else key
 
-    for cat, stats in equip["stats"].items():
-        percentiles[cat] = dict()
-
-        for st, d in stats.items():
-            base = d["base"]
-            real_base = _downgrade_stat(cat, st, base, equip)
-
-            percentiles[cat][st] = _calc_percentile(
-                ranges,
-                path_options,
-                cat,
-                st,
-                real_base,
-            )
+        percentiles[key] = {
+            st: _calc_percentile(index, path_options, cat, st, real_base)
+            for st, real_base in stats.items()
+        }
 
     return percentiles
 
@@ -184,77 +272,69 @@ def _enumerate_range_path_options_from_name(name: str) -> list[dict]:
     return path_options
 
 
-def _find_min_max(ranges: dict, path: dict, stat: str) -> tuple[float, float] | None:
-    def walk(d: dict, keys: list[str]):
-        v = d
-        for k in keys:
-            for k2 in v:
-                # Anything involving equip name needs to be case-insensitive to handle no-custom-font case
-                if k2.lower() == k.lower():
-                    v = v[k2]
-                    break
-            else:
-                return None
-
-        return v
-
-    def is_match(req: str, value: str | None) -> bool:
-        """
-        eg
-            value   = "Slaughter"
-            req     = "Slaughter"
-            returns True
-
-            value   = "Slaughter"
-            req     = "not!Slaughter"
-            returns False
-
-            value   = "Banshee"
-            req     = "Slaughter"
-            returns False
-
-            value   = "Banshee"
-            req     = "not!Slaughter"
-            returns True
-        """
-
-        if req == "all":
-            return True
-
-        is_negative = req.startswith("not!")
-        patt = req.replace("not!", "")
+def _compile(d: dict):
+    """Lowercase the keys, and turn each stat's requirements into a list of (prefix_req, suffix_req, (min, max))
 
-        result = patt.lower() == (value or "").lower()
-        if is_negative:
-            result = not result
+    If two keys only differ in case, the first one wins (as it would when scanning for a match).
+    """
 
-        return result
+    if d and all(isinstance(v, dict) and "min" in v and "max" in v for v in d.values()):
+        reqs = []
+        for req, min_max in d.items():
+            prefix_req, suffix_req = req.split(" | ")
+            reqs.append(
+                (
+                    _parse_requirement(prefix_req),
+                    _parse_requirement(suffix_req),
+                    (min_max["min"], min_max["max"]),
+                )
+            )
+        return reqs
 
-    # Try slot -> quality -> stat
-    d = walk(ranges, [path["slot"], path["quality"], stat])
+    result = dict()
+    for k, v in d.items():
+        if k.lower() not in result:
+            result[k.lower()] = _compile(v) if isinstance(v, dict) else v
+    return result
 
-    # Try category -> slot -> quality -> stat
-    if not d and path["category"]:
-        d = walk(ranges, [path["category"], path["slot"], path["quality"], stat])
 
-    if not d:
+def _parse_requirement(req: str) -> _Requirement:
+    if req == "all":
         return None
 
-    for req, min_max in d.items():
-        prefix_req, suffix_req = req.split(" | ")
+    is_negated = req.startswith("not!")
+    return (is_negated, req.replace("not!", "").lower())
 
-        if not is_match(prefix_req, path["prefix"]):
-            continue
-        if not is_match(suffix_req, path["suffix"]):
-            continue
 
-        return (min_max["min"], min_max["max"])
+def _is_match(req: _Requirement, value: str | None) -> bool:
+    """
+    eg
+        value   = "slaughter"
+        req     = "Slaughter"
+        returns True
+
+        value   = "slaughter"
+        req     = "not!Slaughter"
+        returns False
+
+        value   = "banshee"
+        req     = "Slaughter"
+        returns False
+
+        value   = "banshee"
+        req     = "not!Slaughter"
+        returns True
+    """
 
-    return None
+    if req is None:
+        return True
+
+    is_negated, patt = req
+    return (patt == (value or "")) != is_negated
 
 
 def _calc_percentile(
-    ranges: dict,
+    index: RangeIndex,
     path_options: list[dict],
     cat: str,
     stat: str,
@@ -268,7 +348,7 @@ def _calc_percentile(
         alias += " EDB"
 
     for p in path_options:
-        r = _find_min_max(ranges, p, alias)
+        r = index.find_min_max(p, alias)
         if not r:
             continue
 
@@ -0,0 +1,503 @@
+"""Per-route request metrics, served by /metrics in the Prometheus text format
+
+Each request's time is split into phases:
+    sql             Inside a timed("sql") block (or iter_timed())
+    hv_fetch        Waiting on HV (including the delay between fetches and parsing the page)
+    serialization   Time in the route handler outside the endpoint function (mostly converting the return value into a response)
+    python          Everything else (eg turning rows into dicts, streaming)
+
+With several api workers, each one calls share() so that /metrics covers all of them, whichever worker serves it.
+"""
+
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from sqlite3 import Cursor
+from typing import Any, Callable, Iterator
+
+from fastapi.routing import APIRoute
+from starlette.routing import Match
+from starlette.types import Scope
+
+# Upper bounds of the histogram buckets
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+SIZE_BUCKETS = [2**i for i in range(8, 30, 2)]
+
+# p50 / p95 / p99 are calculated from this many of the most recent requests (per route)
+QUANTILES = [0.5, 0.95, 0.99]
+QUANTILE_WINDOW = 1024
+
+PHASES = ["sql", "hv_fetch", "serialization", "python"]
+
+# Label for requests that didn't match a route (eg 404s)
+UNMATCHED_ROUTE = "unmatched"
+
+# Rows fetched at a time by iter_timed()
+FETCH_SIZE = 1000
+
+# Directory for share(), passed from run_server.py to the workers
+SHARED_DIR_ENV_VAR = "AMYBOT_METRICS_DIR"
+# How often a worker writes its metrics for the others
+SHARE_FLUSH_SECONDS = 1
+# A worker whose file wasn't written for this long is assumed to have exited (so its in-flight requests aren't counted)
+STALE_WORKER_SECONDS = 30
+
+
+class Histogram:
+    def __init__(self, buckets: list[float], window: int | None = None):
+        self.buckets = buckets
+        # Last count is for values above the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent: deque[float] | None = deque(maxlen=window) if window else None
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if self.recent is not None:
+            self.recent.append(value)
+
+    def quantile(self, q: float) -> float:
+        """Quantile of the recent values"""
+
+        assert self.recent is not None
+        if not self.recent:
+            return 0.0
+
+        values = sorted(self.recent)
+        return values[min(int(q * len(values)), len(values) - 1)]
+
+    def to_json(self) -> dict:
+        recent = list(self.recent) if self.recent is not None else None
+        return dict(counts=self.counts, sum=self.sum, count=self.count, recent=recent)
+
+    def add(self, data: dict) -> None:
+        """Add the values of another histogram (from to_json())"""
+
+        self.counts = [a + b for a, b in zip(self.counts, data["counts"])]
+        self.sum += data["sum"]
+        self.count += data["count"]
+        if self.recent is not None and data["recent"]:
+            self.recent.extend(data["recent"])
+
+
+_lock = threading.Lock()
+
+# Keyed by (method, route)
+_durations: dict[tuple[str, str], Histogram] = dict()
+_sizes: dict[tuple[str, str], Histogram] = dict()
+_in_flight: dict[tuple[str, str], int] = dict()
+# Keyed by (method, route, status)
+_responses: dict[tuple[str, str, int], int] = dict()
+# Keyed by (method, route, phase)
+_phases: dict[tuple[str, str, str], Histogram] = dict()
+
+# Other counters (eg from response_cache.py), keyed by name then labels
+_counters: dict[str, dict[tuple[tuple[str, Any], ...], int]] = dict()
+_counter_help: dict[str, str] = dict()
+
+# Gauges whose values are read when rendering (eg from the db, for values shared by all workers)
+# Keyed by name, with a function that returns the values keyed by labels
+_gauges: dict[
+    str, tuple[str, Callable[[], dict[tuple[tuple[str, Any], ...], float]]]
+] = dict()
+
+# Set by share()
+_shared_dir: Path | None = None
+_stop_sharing = threading.Event()
+
+# Seconds spent in each phase by the current request
+_request_phases: ContextVar[dict[str, float] | None] = ContextVar(
+    "request_phases", default=None
+)
+
+
+def route_label(scope: Scope) -> str:
+    """Path of the route that handles a request (eg "/export/{format}/{table}")"""
+
+    app = scope.get("app")
+    if app is None:
+        return UNMATCHED_ROUTE
+
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match != Match.NONE:
+            return route.path
+
+    return UNMATCHED_ROUTE
+
+
+def request_started(method: str, route: str) -> dict[str, float]:
+    """Start collecting phase timings for the current request"""
+
+    with _lock:
+        _in_flight[method, route] = _in_flight.get((method, route), 0) + 1
+
+    phases = dict()
+    _request_phases.set(phases)
+    return phases
+
+
+def request_finished(
+    method: str,
+    route: str,
+    status: int,
+    duration: float,
+    size: int,
+    phases: dict[str, float],
+) -> None:
+    # Serialization is the time the route handler spent outside the endpoint function
+    serialization = max(phases.get("handler", 0) - phases.get("endpoint", 0), 0)
+    breakdown = dict(
+        sql=phases.get("sql", 0),
+        hv_fetch=phases.get("hv_fetch", 0),
+        serialization=serialization,
+    )
+    breakdown["python"] = max(duration - sum(breakdown.values()), 0)
+
+    key = (method, route)
+    with _lock:
+        _in_flight[key] = _in_flight.get(key, 0) - 1
+        _responses[method, route, status] = (
+            _responses.get((method, route, status), 0) + 1
+        )
+
+        if key not in _durations:
+            _durations[key] = Histogram(LATENCY_BUCKETS, QUANTILE_WINDOW)
+            _sizes[key] = Histogram(SIZE_BUCKETS)
+        _durations[key].observe(duration)
+        _sizes[key].observe(size)
+
+        for phase, seconds in breakdown.items():
+            hist = _phases.setdefault(
+                (method, route, phase), Histogram(LATENCY_BUCKETS)
+            )
+            hist.observe(seconds)
+
+
+def register_counter(name: str, help: str) -> None:
+    with _lock:
+        _counters.setdefault(name, dict())
+        _counter_help[name] = help
+
+
+def register_gauge(
+    name: str,
+    help: str,
+    collect: Callable[[], dict[tuple[tuple[str, Any], ...], float]],
+) -> None:
+    with _lock:
+        _gauges[name] = (help, collect)
+
+
+def increment(name: str, amount: int = 1, **labels: Any) -> None:
+    key = tuple(labels.items())
+    with _lock:
+        counter = _counters.setdefault(name, dict())
+        counter[key] = counter.get(key, 0) + amount
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """Add the time spent in this block to a phase of the current request"""
+
+    phases = _request_phases.get()
+    if phases is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[phase] = phases.get(phase, 0) + time.perf_counter() - start
+
+
+def iter_timed(cursor: Cursor, phase: str = "sql") -> Iterator[Any]:
+    """Iterate over a cursor's rows, counting the time spent fetching them (but not processing them)"""
+
+    while True:
+        with timed(phase):
+            rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+class TimedRoute(APIRoute):
+    """Route that records how long the endpoint function took, separately from the rest of the handler (validation / serialization)"""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _time_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            with timed("handler"):
+                return await handler(request)
+
+        return timed_handler
+
+
+def _time_endpoint(endpoint: Callable) -> Callable:
+    # FastAPI reads the signature through functools.wraps, and runs sync endpoints in a thread, so the wrapper has to match
+    if inspect.iscoroutinefunction(endpoint):
+
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            with timed("endpoint"):
+                return await endpoint(*args, **kwargs)
+
+        return async_wrapper
+    else:
+
+        @functools.wraps(endpoint)
+        def wrapper(*args, **kwargs):
+            with timed("endpoint"):
+                return endpoint(*args, **kwargs)
+
+        return wrapper
+
+
+def render() -> str:
+    """Metrics in the Prometheus text format (for every worker, if shared)"""
+
+    lines = []
+
+    def family(name: str, type: str, help: str):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {type}")
+
+    def histogram(name: str, labels: dict[str, Any], hist: Histogram):
+        cumulative = 0
+        for bound, count in zip(hist.buckets + ["+Inf"], hist.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(dict(labels, le=bound))} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {hist.sum}")
+        lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+
+    # Collected up front, since it may be slow (and shouldn't run under the lock)
+    with _lock:
+        gauges = sorted(_gauges.items())
+        counter_help = dict(_counter_help)
+    gauge_values = [(name, help, _collect(collect)) for name, (help, collect) in gauges]
+
+    snapshots = [_snapshot(), *_read_shared()]
+    durations, sizes, phases, responses, in_flight, counters = _merge(snapshots)
+
+    family(
+        "http_request_duration_seconds",
+        "histogram",
+        "Time until the last byte of the response was sent",
+    )
+    for (method, route), hist in sorted(durations.items()):
+        histogram(
+            "http_request_duration_seconds", dict(method=method, route=route), hist
+        )
+
+    family(
+        "http_request_duration_quantile_seconds",
+        "gauge",
+        f"Request duration quantiles over the last {QUANTILE_WINDOW} requests (per worker)",
+    )
+    for (method, route), hist in sorted(durations.items()):
+        for q in QUANTILES:
+            labels = dict(method=method, route=route, quantile=q)
+            lines.append(
+                f"http_request_duration_quantile_seconds{_labels(labels)} {hist.quantile(q)}"
+            )
+
+    family(
+        "http_request_phase_seconds",
+        "histogram",
+        f"Time spent per request in each phase ({', '.join(PHASES)})",
+    )
+    for (method, route, phase), hist in sorted(phases.items()):
+        histogram(
+            "http_request_phase_seconds",
+            dict(method=method, route=route, phase=phase),
+            hist,
+        )
+
+    family("http_response_size_bytes", "histogram", "Size of the response body")
+    for (method, route), hist in sorted(sizes.items()):
+        histogram("http_response_size_bytes", dict(method=method, route=route), hist)
+
+    family("http_responses_total", "counter", "Responses by status code")
+    for (method, route, status), count in sorted(responses.items()):
+        labels = dict(method=method, route=route, status=status)
+        lines.append(f"http_responses_total{_labels(labels)} {count}")
+
+    family(
+        "http_requests_in_flight",
+        "gauge",
+        "Requests being handled (including responses still being streamed)",
+    )
+    for (method, route), count in sorted(in_flight.items()):
+        labels = dict(method=method, route=route)
+        lines.append(f"http_requests_in_flight{_labels(labels)} {count}")
+
+    for name, counter in sorted(counters.items()):
+        family(name, "counter", counter_help.get(name, name))
+        for labels, count in sorted(counter.items()):
+            lines.append(f"{name}{_labels(dict(labels))} {count}")
+
+    for name, help, values in gauge_values:
+        family(name, "gauge", help)
+        for labels, value in sorted(values.items()):
+            lines.append(f"{name}{_labels(dict(labels))} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def share(dir: Path) -> None:
+    """Write this process's metrics to dir every SHARE_FLUSH_SECONDS, and include the other processes' in render()
+
+    dir should be emptied before the processes start (see run_server.py).
+    Files from processes that exited are kept, so that their counts aren't lost.
+    """
+
+    global _shared_dir
+
+    dir.mkdir(parents=True, exist_ok=True)
+    _shared_dir = dir
+    _stop_sharing.clear()
+    threading.Thread(target=_flush_loop, args=[dir], daemon=True).start()
+
+
+def stop_sharing() -> None:
+    global _shared_dir
+
+    _stop_sharing.set()
+    if _shared_dir is not None:
+        _flush(_shared_dir)
+    _shared_dir = None
+
+
+def reset() -> None:
+    with _lock:
+        for d in [_durations, _sizes, _in_flight, _responses, _phases]:
+            d.clear()
+        for counter in _counters.values():
+            counter.clear()
+
+
+def _collect(collect: Callable[[], dict]) -> dict:
+    # A broken gauge (eg the db being unavailable) shouldn't take the other metrics down with it
+    try:
+        return collect()
+    except Exception:
+        return dict()
+
+
+def _labels(labels: dict[str, Any]) -> str:
+    def escape(value: Any) -> str:
+        text = str(value)
+        return text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _snapshot() -> dict:
+    """This process's metrics, as json"""
+
+    with _lock:
+        return dict(
+            durations=[[*k, h.to_json()] for k, h in _durations.items()],
+            sizes=[[*k, h.to_json()] for k, h in _sizes.items()],
+            phases=[[*k, h.to_json()] for k, h in _phases.items()],
+            responses=[[*k, n] for k, n in _responses.items()],
+            in_flight=[[*k, n] for k, n in _in_flight.items()],
+            counters={
+                name: [[list(labels), n] for labels, n in counter.items()]
+                for name, counter in _counters.items()
+            },
+        )
+
+
+def _merge(snapshots: list[dict]) -> tuple[dict, dict, dict, dict, dict, dict]:
+    """Sum the snapshots of each process"""
+
+    durations: dict[tuple, Histogram] = dict()
+    sizes: dict[tuple, Histogram] = dict()
+    phases: dict[tuple, Histogram] = dict()
+    responses: dict[tuple, int] = dict()
+    in_flight: dict[tuple, int] = dict()
+    counters: dict[str, dict[tuple, int]] = dict()
+
+    window = QUANTILE_WINDOW * len(snapshots)
+    for snapshot in snapshots:
+        for *k, data in snapshot["durations"]:
+            hist = durations.setdefault(tuple(k), Histogram(LATENCY_BUCKETS, window))
+            hist.add(data)
+        for *k, data in snapshot["sizes"]:
+            sizes.setdefault(tuple(k), Histogram(SIZE_BUCKETS)).add(data)
+        for *k, data in snapshot["phases"]:
+            phases.setdefault(tuple(k), Histogram(LATENCY_BUCKETS)).add(data)
+
+        for *k, n in snapshot["responses"]:
+            responses[tuple(k)] = responses.get(tuple(k), 0) + n
+        for *k, n in snapshot["in_flight"]:
+            in_flight[tuple(k)] = in_flight.get(tuple(k), 0) + n
+
+        for name, values in snapshot["counters"].items():
+            counter = counters.setdefault(name, dict())
+            for labels, n in values:
+                key = tuple(tuple(pair) for pair in labels)
+                counter[key] = counter.get(key, 0) + n
+
+    return durations, sizes, phases, responses, in_flight, counters
+
+
+def _read_shared() -> list[dict]:
+    """Snapshots of the other processes"""
+
+    dir = _shared_dir
+    if dir is None:
+        return []
+
+    snapshots = []
+    for fp in dir.glob("*.json"):
+        if fp.stem == str(os.getpid()):
+            continue
+
+        try:
+            is_stale = time.time() - fp.stat().st_mtime > STALE_WORKER_SECONDS
+            snapshot = json.loads(fp.read_text())
+        except (OSError, ValueError):
+            # (Eg removed since the glob)
+            continue
+
+        if is_stale:
+            snapshot["in_flight"] = []
+        snapshots.append(snapshot)
+
+    return snapshots
+
+
+def _flush(dir: Path) -> None:
+    fp = dir / f"{os.getpid()}.json"
+    tmp = fp.with_suffix(".tmp")
+
+    # Replaced in one step, so that readers never see a partial file
+    tmp.write_text(json.dumps(_snapshot()))
+    os.replace(tmp, fp)
+
+
+def _flush_loop(dir: Path) -> None:
+    while not _stop_sharing.wait(SHARE_FLUSH_SECONDS):
+        try:
+            _flush(dir)
+        except OSError:
+            pass
@@ -1,73 +1,145 @@
+import random
 import time
-from typing import Awaitable, Callable, ClassVar, Optional
+from typing import ClassVar
 
-from fastapi import Request
-from starlette.concurrency import iterate_in_threadpool
-from starlette.middleware.base import BaseHTTPMiddleware, DispatchFunction
+from starlette.datastructures import URL, Headers
 from starlette.middleware.gzip import GZipMiddleware
-from starlette.responses import StreamingResponse
-from starlette.types import ASGIApp, Receive, Scope, Send
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from classes.core.server import metrics
 from config import logger
 
 logger = logger.bind(tags=["server"])
 
-_CallNext = Callable[[Request], Awaitable[StreamingResponse]]
+# These are plain ASGI middlewares (rather than BaseHTTPMiddleware)
+# so that response chunks are passed straight through instead of being copied into a new stream per layer
 
 
-class RequestLog(BaseHTTPMiddleware):
+class RequestLog:
     """Log request and response"""
 
-    def __init__(self, app: ASGIApp, dispatch: Optional[DispatchFunction] = None):
-        super().__init__(app, dispatch)
+    # Fraction of responses whose body is logged
+    body_sample_rate: ClassVar[float] = 0.1
+    # Only the start of the body is logged
+    body_max_bytes: ClassVar[int] = 1024
 
-    async def dispatch(self, request: Request, call_next: _CallNext):
-        logger.debug(f"{request.method} {request.url}")
-        resp = await call_next(request)
+    def __init__(self, app: ASGIApp):
+        self.app = app
 
-        resp_body = [section async for section in resp.body_iterator]
-        resp.body_iterator = iterate_in_threadpool(iter(resp_body))
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        logger.debug(f"{scope['method']} {URL(scope=scope)}")
+
+        should_log_body = random.random() < self.body_sample_rate
+        body_start = bytearray()
+        size = 0
+        is_gzip = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal size, is_gzip
+
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                is_gzip = headers.get("content-encoding") == "gzip"
+            elif message["type"] == "http.response.body" and should_log_body:
+                body = message.get("body", b"")
+                size += len(body)
+                if len(body_start) < self.body_max_bytes:
+                    body_start.extend(body[: self.body_max_bytes - len(body_start)])
+
+                if not message.get("more_body", False):
+                    self._log_body(bytes(body_start), size, is_gzip)
+
+            await send(message)
 
-        if resp_body:
-            try:
-                resp_data = resp_body[0].decode()  # type: ignore
-                logger.trace(resp_data)
-            except UnicodeDecodeError:
-                size = sum(len(x) for x in resp_body)
-                logger.trace(f"gzip'd response of size {size}")
+        await self.app(scope, receive, send_wrapper)
 
-        return resp
+    def _log_body(self, body_start: bytes, size: int, is_gzip: bool) -> None:
+        if size == 0:
+            return
+
+        if is_gzip:
+            logger.trace(f"gzip'd response of size {size}")
+        elif size > len(body_start):
+            text = body_start.decode(errors="replace")
+            logger.trace(f"{text}... ({size} bytes)")
+        else:
+            logger.trace(body_start.decode(errors="replace"))
 
 
-class ErrorLog(BaseHTTPMiddleware):
+class ErrorLog:
     """Log Errors"""
 
-    def __init__(self, app: ASGIApp, dispatch: Optional[DispatchFunction] = None):
-        super().__init__(app, dispatch)
+    def __init__(self, app: ASGIApp):
+        self.app = app
 
-    async def dispatch(self, request: Request, call_next: _CallNext):
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
         try:
-            resp = await call_next(request)
-            return resp
+            await self.app(scope, receive, send)
         except:
             logger.exception("")
             raise
 
 
-class PerformanceLog(BaseHTTPMiddleware):
-    """Measure response time"""
+class PerformanceLog:
+    """Measure response time (until the last chunk of the body is sent)"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
 
-    def __init__(self, app: ASGIApp, dispatch: Optional[DispatchFunction] = None):
-        super().__init__(app, dispatch)
+        start = time.perf_counter()
 
-    async def dispatch(self, request: Request, call_next: _CallNext):
-        start = time.time()
-        resp = await call_next(request)
-        end = time.time()
+        async def send_wrapper(message: Message) -> None:
+            await send(message)
 
-        elapsed_ms = (end - start) * 1000
-        logger.debug(f"Response took {elapsed_ms:.0f}ms")
-        return resp
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                logger.debug(f"Response took {elapsed_ms:.0f}ms")
+
+        await self.app(scope, receive, send_wrapper)
+
+
+class RequestMetrics:
+    """Record per-route latency, response size, etc (see metrics.py)"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        route = metrics.route_label(scope)
+        phases = metrics.request_started(method, route)
+
+        start = time.perf_counter()
+        status = 500
+        size = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, size
+
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - start
+            metrics.request_finished(method, route, status, duration, size, phases)
 
 
 class GZipWrapper(GZipMiddleware):
@@ -0,0 +1,109 @@
+import base64
+import binascii
+import json
+from dataclasses import asdict, dataclass
+from typing import Any, Literal
+
+from fastapi import HTTPException
+
+# Page size when a cursor is passed without a limit
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+SortOrder = Literal["asc", "desc"]
+
+
+@dataclass
+class Cursor:
+    """Position of the last row on a page, handed to the client as an opaque string
+
+    Pages are fetched by filtering for rows that sort after this position (keyset pagination),
+    so deep pages cost the same as the first one, unlike OFFSET.
+    """
+
+    sort: str
+    order: SortOrder
+    # Sort key of the last row on the previous page
+    after: list[Any]
+    # Number of matching rows, counted once for the first page
+    total: int
+    # Whether the name filter used the full-text index (see _search_with_fallback)
+    use_fts: bool = True
+
+    def encode(self) -> str:
+        text = json.dumps(asdict(self), separators=(",", ":"))
+        return base64.urlsafe_b64encode(text.encode()).decode()
+
+    @classmethod
+    def decode(cls, text: str, sort: str, order: SortOrder) -> "Cursor":
+        """Parse cursor, raising a 400 if it is malformed or from a differently sorted search"""
+
+        try:
+            data = json.loads(base64.urlsafe_b64decode(text.encode()))
+            cursor = cls(**data)
+        except (binascii.Error, ValueError, TypeError):
+            raise HTTPException(400, detail="Invalid cursor")
+
+        if cursor.sort != sort or cursor.order != order:
+            raise HTTPException(
+                400, detail="Cursor is from a search with a different sort order"
+            )
+
+        return cursor
+
+
+def check_page_size(limit: int | None) -> int:
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+
+    if limit < 1 or limit > MAX_PAGE_SIZE:
+        raise HTTPException(400, detail=f"limit must be in [1, {MAX_PAGE_SIZE}]")
+
+    return limit
+
+
+def parse_fields(fields: str | None, allowed: list[str]) -> list[str]:
+    """Parse a comma separated list of response fields (eg "name,price,auction")
+
+    Returns all allowed fields if none were specified
+    """
+
+    if fields is None:
+        return allowed
+
+    result = [x.strip() for x in fields.split(",") if x.strip()]
+    unknown = [x for x in result if x not in allowed]
+    if unknown:
+        raise HTTPException(
+            400, detail=f"Unknown fields {unknown}. Choose from {allowed}"
+        )
+    if not result:
+        raise HTTPException(400, detail="No fields selected")
+
+    return result
+
+
+def order_by_clause(keys: list[str], order: SortOrder) -> str:
+    return "ORDER BY " + ", ".join(f"{k} {order.upper()}" for k in keys)
+
+
+def keyset_condition(
+    keys: list[str], order: SortOrder, after: list[Any]
+) -> tuple[str, list[Any]]:
+    """Condition for rows that come after the given sort key
+
+    eg "(sa.end_time, se.rowid) < (?, ?)" for descending order
+    """
+
+    op = "<" if order == "desc" else ">"
+    placeholders = ", ".join("?" for _ in keys)
+    return f"({', '.join(keys)}) {op} ({placeholders})", after
+
+
+def and_where(where: str, condition: str) -> str:
+    """Append condition to a clause from WhereBuilder.print()"""
+
+    if where:
+        return f"{where} AND {condition}"
+    else:
+        return f"WHERE {condition}"
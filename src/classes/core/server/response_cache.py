@@ -0,0 +1,200 @@
+"""In-process cache of search responses
+
+Entries are tagged with the version of the tables the endpoint reads (see select_table_version),
+so a scrape that changes those tables makes the old entries miss instead of serving stale results.
+
+The same version (plus the query) is used as the response's ETag,
+so a client that sends it back in If-None-Match gets a 304 without the search running at all.
+"""
+
+import asyncio
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import ClassVar
+from urllib.parse import parse_qsl
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from classes.core.server import metrics
+from classes.db import DbPool, select_table_version
+
+# Total size of the cached responses
+MAX_CACHE_BYTES = 64 * 1024**2
+# Larger responses aren't cached, so that one big search can't flush everything else
+MAX_ENTRY_BYTES = 4 * 1024**2
+
+# Params whose case matters (the search filters are all case-insensitive)
+CASE_SENSITIVE_PARAMS = ["cursor", "fields", "sort", "order", "source"]
+
+metrics.register_counter(
+    "response_cache_requests_total",
+    "Cached endpoint requests, by result (hit, miss, collapsed into an identical in-progress miss, or not_modified)",
+)
+
+
+@dataclass
+class _Entry:
+    version: tuple[int, ...]
+    # ASGI messages of the response
+    messages: list[Message]
+    size: int
+
+
+class ResponseCache:
+    """Cache GET responses for specific endpoints, keyed by their normalized query params
+
+    Concurrent requests for the same uncached response wait on the first one instead of each running the search.
+    Only 200 responses are stored (and given an ETag).
+    """
+
+    # Path -> tables read by the endpoint
+    endpoints: ClassVar[dict[str, list[str]]] = dict()
+    # For reading table versions
+    pool: ClassVar[DbPool | None] = None
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.entries: OrderedDict[tuple, _Entry] = OrderedDict()
+        self.size = 0
+        # Misses being computed, keyed by (key, version)
+        self.in_flight: dict[tuple, asyncio.Future[list[Message]]] = dict()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        path = scope.get("path")
+        tables = self.endpoints.get(path)  # type: ignore
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "GET"
+            or tables is None
+            or self.pool is None
+        ):
+            return await self.app(scope, receive, send)
+
+        key = (path, *normalize_query(scope["query_string"]))
+        version = await asyncio.to_thread(self._select_version, tables)
+
+        etag = _create_etag(key, version)
+        if_none_match = _parse_if_none_match(scope)
+        if etag in if_none_match or "*" in if_none_match:
+            metrics.increment(
+                "response_cache_requests_total", endpoint=path, result="not_modified"
+            )
+            return await _send_not_modified(etag, send)
+
+        entry = self.entries.get(key)
+        if entry is not None and entry.version == version:
+            self.entries.move_to_end(key)
+            metrics.increment(
+                "response_cache_requests_total", endpoint=path, result="hit"
+            )
+            return await _replay(entry.messages, send)
+
+        flight = self.in_flight.get((key, version))
+        if flight is not None:
+            metrics.increment(
+                "response_cache_requests_total", endpoint=path, result="collapsed"
+            )
+            return await _replay(await asyncio.shield(flight), send)
+
+        metrics.increment("response_cache_requests_total", endpoint=path, result="miss")
+        flight = asyncio.get_running_loop().create_future()
+        self.in_flight[key, version] = flight
+
+        messages: list[Message] = []
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                headers = list(message.get("headers", []))
+                headers.append((b"etag", etag.encode()))
+                message = dict(message, headers=headers)
+
+            messages.append(message)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            flight.set_exception(e)
+            # Don't warn about an unretrieved exception if nobody was waiting
+            flight.exception()
+            raise
+        finally:
+            self.in_flight.pop((key, version), None)
+
+        # Waiting requests get the same response, even if it's an error
+        flight.set_result(messages)
+
+        is_ok = messages and messages[0].get("status") == 200
+        size = sum(len(m.get("body", b"")) for m in messages)
+        if is_ok and size <= MAX_ENTRY_BYTES:
+            self._store(key, _Entry(version, messages, size))
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+    def _select_version(self, tables: list[str]) -> tuple[int, ...]:
+        assert self.pool is not None
+        with self.pool.connection() as db:
+            return tuple(select_table_version(db, table) for table in tables)
+
+    def _store(self, key: tuple, entry: _Entry) -> None:
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= old.size
+
+        self.entries[key] = entry
+        self.size += entry.size
+
+        while self.size > MAX_CACHE_BYTES:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.size
+
+
+def normalize_query(query_string: bytes) -> list[tuple[str, str]]:
+    """Sorted (name, value) pairs, without empty params and with case-insensitive values lowercased
+
+    eg "name=Peerless%20Heimd&seller=" -> [("name", "peerless heimd")]
+    """
+
+    result = []
+    for name, value in parse_qsl(query_string.decode("latin-1")):
+        value = value.strip()
+        if not value:
+            continue
+        if name not in CASE_SENSITIVE_PARAMS:
+            value = value.lower()
+        result.append((name, value))
+    return sorted(result)
+
+
+def _create_etag(key: tuple, version: tuple[int, ...]) -> str:
+    digest = hashlib.sha1(repr((key, version)).encode()).hexdigest()
+    return f'"{digest[:20]}"'
+
+
+def _parse_if_none_match(scope: Scope) -> list[str]:
+    """ETags in the If-None-Match header (weak ones are compared as strong, per RFC 9110)"""
+
+    header = Headers(scope=scope).get("if-none-match")
+    if not header:
+        return []
+    return [tag.strip().removeprefix("W/") for tag in header.split(",")]
+
+
+async def _send_not_modified(etag: str, send: Send) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 304,
+            "headers": [(b"etag", etag.encode())],
+        }
+    )
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _replay(messages: list[Message], send: Send) -> None:
+    for message in messages:
+        await send(message)
@@ -0,0 +1,108 @@
+"""Runs the server's periodic jobs (range updates, name dictionary, db analyze, exports) in a separate process
+
+so that the API can run several uvicorn workers without each of them repeating the jobs.
+The jobs keep their state in the db (metadata table) and data dir rather than in memory,
+so a job that is restarted resumes its schedule instead of starting over.
+"""
+
+import asyncio
+import multiprocessing
+import signal
+import threading
+import time
+from typing import Callable, Coroutine
+
+from classes.core.server import logger
+from classes.core.server.server import (
+    create_db_analyze_task,
+    create_export_task,
+    create_name_dictionary_task,
+    create_range_update_task,
+)
+
+# Delay before restarting a failed job / process, doubled after each consecutive failure
+MIN_BACKOFF_SECONDS = 5
+MAX_BACKOFF_SECONDS = 60 * 15
+# A job / process that ran at least this long before failing starts over at MIN_BACKOFF_SECONDS
+RESET_BACKOFF_SECONDS = 60 * 10
+
+JOBS: dict[str, Callable[[], Coroutine]] = dict(
+    range_update=create_range_update_task,
+    name_dictionary=create_name_dictionary_task,
+    db_analyze=create_db_analyze_task,
+    export=create_export_task,
+)
+
+
+class Scheduler:
+    """Keeps the jobs running in a child process, restarting it (with backoff) if it dies
+
+    Each job is also restarted on its own if it raises, so one failing job doesn't take the others down.
+    """
+
+    def __init__(self):
+        self.process: multiprocessing.process.BaseProcess | None = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._supervise, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.process is not None:
+            self.process.terminate()
+        self._thread.join()
+
+    def _supervise(self) -> None:
+        # Spawn rather than fork, since the parent has threads (this one, uvicorn's)
+        context = multiprocessing.get_context("spawn")
+        backoff = MIN_BACKOFF_SECONDS
+
+        while not self._stop.is_set():
+            start = time.monotonic()
+            self.process = context.Process(target=run, name="scheduler", daemon=True)
+            self.process.start()
+            self.process.join()
+
+            if self._stop.is_set():
+                break
+
+            if time.monotonic() - start >= RESET_BACKOFF_SECONDS:
+                backoff = MIN_BACKOFF_SECONDS
+            logger.error(
+                f"Scheduler exited with code {self.process.exitcode}, restarting in {backoff}s"
+            )
+            self._stop.wait(backoff)
+            backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
+
+
+def run() -> None:
+    """Entry point of the scheduler process"""
+
+    # Ctrl-C is handled by the parent, which terminates this process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    asyncio.run(run_jobs())
+
+
+async def run_jobs() -> None:
+    await asyncio.gather(*[run_job(name, job) for name, job in JOBS.items()])
+
+
+async def run_job(name: str, create_job: Callable[[], Coroutine]) -> None:
+    backoff = MIN_BACKOFF_SECONDS
+
+    while True:
+        start = time.monotonic()
+        try:
+            await create_job()
+            logger.error(f"Job {name} returned")
+        except Exception:
+            logger.exception(f"Job {name} failed")
+
+        if time.monotonic() - start >= RESET_BACKOFF_SECONDS:
+            backoff = MIN_BACKOFF_SECONDS
+        logger.info(f"Restarting job {name} in {backoff}s")
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, MAX_BACKOFF_SECONDS)
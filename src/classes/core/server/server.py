@@ -1,43 +1,168 @@
 import asyncio
 import datetime
+import hashlib
+import hmac
 import json
+import os
 import sqlite3
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
+from pathlib import Path
 from sqlite3 import Connection
-from typing import Optional
+from typing import Callable, Iterator, Literal, Optional
 
 import aiohttp
 from bs4 import BeautifulSoup
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import (
+    BackgroundTasks,
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Request,
+    Response,
+)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse
-from Levenshtein import distance
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
 
 from classes.core.server import (
     equip_parser,
     equip_parser_beta,
+    exports,
     infer_equip_stats,
     infer_equip_stats_beta,
     logger,
+    metrics,
+    spellcheck,
 )
-from classes.core.server.equip_parser import LOGGER, fetch_equip_html
+from classes.core.server.equip_parser import LOGGER
+from classes.core.server.metrics import TimedRoute, timed
 from classes.core.server.middleware import (
     ErrorLog,
     GZipWrapper,
     PerformanceLog,
     RequestLog,
+    RequestMetrics,
+)
+from classes.core.server.pagination import (
+    DEFAULT_PAGE_SIZE,
+    Cursor,
+    SortOrder,
+    and_where,
+    check_page_size,
+    keyset_condition,
+    order_by_clause,
+    parse_fields,
+)
+from classes.core.server.response_cache import ResponseCache
+from classes.db import (
+    EXPORTED_TABLES,
+    Db,
+    DbPool,
+    analyze_db,
+    apply_name_log,
+    bootstrap_db,
+    compact_change_log,
+    init_db,
+    insert_metadata,
+    select_export_version,
+    select_metadata,
 )
-from classes.db import Db, init_db, insert_metadata, select_metadata
+from classes.hv_limiter import Priority, hv_bucket
+from config import paths
 from config.paths import RANGES_FILE
+from utils import sql_trace
 from utils.html import select_one_or_raise
-from utils.sql import WhereBuilder
+from utils.misc import load_toml
+from utils.sql import FTS_MIN_TERM_LENGTH, ColumnType, WhereBuilder, to_fts_query
 
-HV_FETCH_DELAY_SECONDS = 0.5
 RANGE_FETCH_DELAY_SECONDS = 86400 * 3
 NAME_UPDATE_DELAY = 86400 * 1
+EQUIP_CACHE_TTL_SECONDS = 86400 * 1
+EQUIP_BATCH_LIMIT = 25
+DB_ANALYZE_DELAY = 86400 * 1
+EXPORT_POLL_DELAY = 60
+EXPORT_REBUILD_DELAY = 60 * 10
+# Record every statement's duration for /admin/sql (adds overhead, see utils/sql_trace.py)
+SQL_TRACE = False
+
+EquipSort = Literal["price", "time", "level"]
+PRIZE_RANKS = ["1", "1b", "2", "3", "4", "5"]
+
+# Columns filtered on by /lottery/search (in lottery_weapon / lottery_armor and lottery_winners)
+LOTTERY_COLUMN_TYPES: dict[str, ColumnType] = {
+    "date": "number",
+    '"1_prize"': "text",
+    # lottery_winners
+    "user": "text",
+}
+
+# Connections for endpoints that only read / those that also write
+ro_db_pool = DbPool(read_only=True, size=8, trace=SQL_TRACE)
+db_pool = DbPool(size=2, trace=SQL_TRACE)
+# Exports hold a connection for the whole download, so they get their own to keep slow clients from starving the searches
+export_db_pool = DbPool(read_only=True, size=4, trace=SQL_TRACE)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    bootstrap_db()
+    # Set by run_server.py
+    if shared_dir := os.environ.get(metrics.SHARED_DIR_ENV_VAR):
+        metrics.share(Path(shared_dir))
+    yield
+    metrics.stop_sharing()
+    await equip_parser.close_hv_session()
+    ro_db_pool.close()
+    db_pool.close()
+    export_db_pool.close()
+
+
+def get_ro_db() -> Iterator[Db]:
+    with ro_db_pool.connection() as db:
+        yield db
+
+
+def require_admin(x_admin_key: str | None = Header(None)) -> None:
+    """Check the X-Admin-Key header against ADMIN_KEY in secrets.toml (admin endpoints are disabled if it isn't set)"""
+
+    secrets = load_toml(paths.SECRETS_FILE).value
+    admin_key = secrets.get("ADMIN_KEY")
+
+    if not admin_key:
+        raise HTTPException(404)
+    if x_admin_key is None or not hmac.compare_digest(x_admin_key, str(admin_key)):
+        raise HTTPException(403)
+
+
+server = FastAPI(lifespan=lifespan)
+server.router.route_class = TimedRoute
+
+# Endpoints with a gzip'd response
+# (/export/sqlite is stored compressed)
+GZipWrapper.endpoints = ["/export/json"]
+
+# Search endpoints whose responses are cached until the tables they read change
+ResponseCache.endpoints = {
+    "/super/search_equips": ["super_auctions", "super_equips"],
+    "/kedama/search_equips": ["kedama_auctions", "kedama_equips"],
+    "/equips/search": ["super_auctions", "super_equips", "kedama_auctions", "kedama_equips"],
+    "/lottery/search": ["lottery_weapon", "lottery_armor"],
+    "/lottery/user_stats": ["lottery_weapon", "lottery_armor"],
+}  # fmt: skip
+ResponseCache.pool = ro_db_pool
 
-server = FastAPI()
+# Order matters, topmost are called first
+server.add_middleware(ResponseCache)
+server.add_middleware(ErrorLog)
+server.add_middleware(GZipWrapper)
+server.add_middleware(PerformanceLog)
+server.add_middleware(RequestMetrics)
+server.add_middleware(RequestLog)
 
 # Enable CORS
+# (Added last so that it is the outermost middleware. The allowed origin is echoed from each request, so it must not be replayed by ResponseCache)
 server.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -46,17 +171,6 @@ server.add_middleware(
     allow_headers=["*"],
 )
 
-# Endpoints with a gzip'd response
-GZipWrapper.endpoints = ["/export/sqlite", "/export/json"]
-
-# Order matters, topmost are called first
-server.add_middleware(ErrorLog)
-server.add_middleware(GZipWrapper)
-server.add_middleware(PerformanceLog)
-server.add_middleware(RequestLog)
-
-EXPORTED_TABLES = ['super_auctions', 'super_equips', 'super_mats', 'super_fails', 'kedama_auctions' ,'kedama_equips', 'kedama_mats', 'kedama_fails_item', 'lottery_weapon', 'lottery_armor', 'equips']  # fmt: skip
-
 
 @server.get("/super/search_equips")
 def get_super_equips(
@@ -71,21 +185,22 @@ def get_super_equips(
     buyer_partial: Optional[str] = None,
     complete: Optional[bool] = None,
     id_auction: Optional[str] = None,
-    db: Connection = Depends(init_db),
+    sort: Optional[EquipSort] = None,
+    order: SortOrder = "desc",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Connection = Depends(get_ro_db),
 ):
     """Search for items sold at a Super auction
 
     The equip name and user name can be a comma separated list (eg "peerl,oak,heimd" instead of "Peerless Oak Staff of Heimdall")
-    """
 
-    where_builder = WhereBuilder("AND")
+    Pass a limit to get results a page at a time, sorted by sort (default time), and the cursor from each page to get the next one.
+    fields is a comma separated list of keys to include for each equip (eg "name,price,auction")
+    """
 
-    # Create name filters
-    #   eg "name=peer,waki" should match "Peerless * Wakizashi of the *"
-    if name is not None:
-        fragments = [x.strip() for x in name.split(",")]
-        for fragment in fragments:
-            where_builder.add("name LIKE ?", f"%{fragment}%")
+    where_builder = WhereBuilder("AND", columns=SUPER_EQUIPS.column_types)
 
     # Create date filters (utc)
     #   eg "min_date=1546300800" should match items sold on / after Jan 1, 2019
@@ -94,9 +209,9 @@ def get_super_equips(
             400, detail=f"min_date > max_date ({min_date} > {max_date})"
         )
     if min_date is not None:
-        where_builder.add("sa.end_time >= ?", min_date)
+        where_builder.compare("sa.end_time", ">=", min_date)
     if max_date is not None:
-        where_builder.add("sa.end_time <= ?", max_date)
+        where_builder.compare("sa.end_time", "<=", max_date)
 
     # Create price filters
     #   eg "max_price=1000" should match items sold for <=1000c
@@ -105,72 +220,53 @@ def get_super_equips(
             400, detail=f"min_price > max_price ({min_price} > {max_price})"
         )
     if min_price is not None:
-        where_builder.add("se.price >= ?", min_price)
+        where_builder.compare("se.price", ">=", min_price)
     if max_price is not None:
-        wb = WhereBuilder("OR")
-        wb.add("se.price <= ?", max_price)
-        wb.add("se.price IS NULL", None)
+        wb = where_builder.child("OR")
+        wb.compare("se.price", "<=", max_price)
+        wb.add("se.price IS NULL")
         where_builder.add_builder(wb)
 
     # Create buyer filters
     if buyer is not None:
         # Exact match
-        where_builder.add("buyer = ?", buyer)
+        where_builder.compare("se.buyer", "=", buyer)
     elif buyer_partial is not None:
         # Partial match
         fragments = [x.strip() for x in buyer_partial.split(",")]
         for fragment in fragments:
-            where_builder.add("buyer LIKE ?", f"%{fragment}%")
+            where_builder.like("se.buyer", f"%{fragment}%")
 
     # Create seller filters
     if seller is not None:
         # Exact match
-        where_builder.add("seller = ?", seller)
+        where_builder.compare("se.seller", "=", seller)
     elif seller_partial is not None:
         # Partial match
         fragments = [x.strip() for x in seller_partial.split(",")]
         for fragment in fragments:
-            where_builder.add("seller LIKE ?", f"%{fragment}%")
+            where_builder.like("se.seller", f"%{fragment}%")
 
     # Create completion filter
     if complete is not None:
-        where_builder.add("sa.is_complete = ?", int(complete))
+        where_builder.compare("sa.is_complete", "=", int(complete))
 
     # Auciton filter
     if id_auction is not None:
-        where_builder.add("sa.id = ?", id_auction)
+        where_builder.compare("sa.id", "=", id_auction)
 
     # Query DB
-    with db:
-        where, data = where_builder.print()
-        query = f"""
-            SELECT se.*, sa.end_time as sa_end_time, sa.is_complete as sa_is_complete, sa.title as sa_title, sa.id as sa_id
-            FROM super_equips as se INNER JOIN super_auctions as sa
-            ON sa.id = se.id_auction
-            {where}
-            """
-        logger.trace(f"Search super equips {query} {data}")
-        rows = db.execute(query, data).fetchall()
-
-    # Massage data structure
-    result = [dict(row) for row in rows]
-    for r in result:
-        # Move joined cols into dict
-        r["auction"] = dict(
-            id=r["sa_id"],
-            end_time=r["sa_end_time"],
-            is_complete=r["sa_is_complete"],
-            title=r["sa_title"],
-        )
-        for k in list(r.keys()):
-            if k.startswith("sa_"):
-                del r[k]
-
-        # Stats col contains json
-        r["stats"] = json.loads(r["stats"])
-
-    # Return
-    return result
+    return _search_equips(
+        db,
+        SUPER_EQUIPS,
+        where_builder,
+        name=name,
+        sort=sort,
+        order=order,
+        limit=limit,
+        cursor=cursor,
+        fields=fields,
+    )
 
 
 @server.get("/kedama/search_equips")
@@ -185,21 +281,22 @@ def get_kedama_equips(
     buyer: Optional[str] = None,
     buyer_partial: Optional[str] = None,
     id_auction: Optional[str] = None,
-    db: Connection = Depends(init_db),
+    sort: Optional[EquipSort] = None,
+    order: SortOrder = "desc",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Connection = Depends(get_ro_db),
 ):
     """Search for items sold at a Kedama auction
 
     The equip name and user name can be a comma separated list (eg "peerl,oak,heimd" instead of "Peerless Oak Staff of Heimdall")
-    """
 
-    where_builder = WhereBuilder("AND")
+    Pass a limit to get results a page at a time, sorted by sort (default time), and the cursor from each page to get the next one.
+    fields is a comma separated list of keys to include for each equip (eg "name,price,auction")
+    """
 
-    # Create name filters
-    #   eg "name=peer,waki" should match "Peerless * Wakizashi of the *"
-    if name is not None:
-        fragments = [x.strip() for x in name.split(",")]
-        for fragment in fragments:
-            where_builder.add("name LIKE ?", f"%{fragment}%")
+    where_builder = WhereBuilder("AND", columns=KEDAMA_EQUIPS.column_types)
 
     # Create date filters (utc)
     #   eg "min_date=1546300800" should match items sold on / after Jan 1, 2019
@@ -208,9 +305,9 @@ def get_kedama_equips(
             400, detail=f"min_date > max_date ({min_date} > {max_date})"
         )
     if min_date is not None:
-        where_builder.add("list.start_time >= ?", min_date)
+        where_builder.compare("list.start_time", ">=", min_date)
     if max_date is not None:
-        where_builder.add("list.start_time <= ?", max_date)
+        where_builder.compare("list.start_time", "<=", max_date)
 
     # Create price filters
     #   eg "max_price=1000" should match items sold for <=1000c
@@ -219,69 +316,451 @@ def get_kedama_equips(
             400, detail=f"min_price > max_price ({min_price} > {max_price})"
         )
     if min_price is not None:
-        where_builder.add("equip.price >= ?", min_price)
+        where_builder.compare("equip.price", ">=", min_price)
     if max_price is not None:
-        wb = WhereBuilder("OR")
-        wb.add("equip.price <= ?", max_price)
-        wb.add("equip.price IS NULL", None)
+        wb = where_builder.child("OR")
+        wb.compare("equip.price", "<=", max_price)
+        wb.add("equip.price IS NULL")
         where_builder.add_builder(wb)
 
     # Create buyer filters
     if buyer is not None:
         # Exact match
-        where_builder.add("buyer = ?", buyer)
+        where_builder.compare("equip.buyer", "=", buyer)
     elif buyer_partial is not None:
         # Partial match
         fragments = [x.strip() for x in buyer_partial.split(",")]
         for fragment in fragments:
-            where_builder.add("buyer LIKE ?", f"%{fragment}%")
+            where_builder.like("equip.buyer", f"%{fragment}%")
 
     # Create seller filters
     if seller is not None:
         # Exact match
-        where_builder.add("seller = ?", seller)
+        where_builder.compare("equip.seller", "=", seller)
     elif seller_partial is not None:
         # Partial match
         fragments = [x.strip() for x in seller_partial.split(",")]
         for fragment in fragments:
-            where_builder.add("seller LIKE ?", f"%{fragment}%")
+            where_builder.like("equip.seller", f"%{fragment}%")
 
     # Auciton filter
     if id_auction is not None:
-        where_builder.add("list.id = ?", id_auction)
+        where_builder.compare("list.id", "=", id_auction)
 
     # Query DB
-    with db:
-        where, data = where_builder.print()
-        query = f"""
-            SELECT 
-                equip.*,
-                list.start_time as list_start_time,
-                list.title as list_title,
-                list.title_short as list_title_short,
-                list.id as list_id
-            FROM kedama_equips as equip INNER JOIN kedama_auctions as list
-            ON list.id = equip.id_auction
-            {where}
-            """
-        logger.trace(f"Search kedama equips {query} {data}")
-        rows = db.execute(query, data).fetchall()
+    return _search_equips(
+        db,
+        KEDAMA_EQUIPS,
+        where_builder,
+        name=name,
+        sort=sort,
+        order=order,
+        limit=limit,
+        cursor=cursor,
+        fields=fields,
+    )
+
+
+@server.get("/equips/search")
+def search_auction_equips(
+    name: Optional[str] = None,
+    source: Optional[Literal["super", "kedama"]] = None,
+    min_date: Optional[float] = None,
+    max_date: Optional[float] = None,
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None,
+    seller: Optional[str] = None,
+    seller_partial: Optional[str] = None,
+    buyer: Optional[str] = None,
+    buyer_partial: Optional[str] = None,
+    complete: Optional[bool] = None,
+    id_auction: Optional[str] = None,
+    sort: EquipSort = "time",
+    order: SortOrder = "desc",
+    limit: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Connection = Depends(get_ro_db),
+):
+    """Search for items sold at either auction
+
+    Same as /super/search_equips and /kedama/search_equips combined, except results are always paginated
+    and the equips / auctions have the same keys regardless of source
+    (eg auction.time instead of end_time / start_time, min_bid instead of next_bid / start_bid)
+    """
+
+    where_builder = WhereBuilder("AND", columns=AUCTION_EQUIPS.column_types)
+
+    if source is not None:
+        where_builder.add("ae.source = ?", source)
+
+    # Create date filters (utc)
+    if min_date is not None and max_date is not None and max_date < min_date:
+        raise HTTPException(
+            400, detail=f"min_date > max_date ({min_date} > {max_date})"
+        )
+    if min_date is not None:
+        where_builder.compare("ae.auction_time", ">=", min_date)
+    if max_date is not None:
+        where_builder.compare("ae.auction_time", "<=", max_date)
+
+    # Create price filters
+    if min_price is not None and max_price is not None and max_price < min_price:
+        raise HTTPException(
+            400, detail=f"min_price > max_price ({min_price} > {max_price})"
+        )
+    if min_price is not None:
+        where_builder.compare("ae.price", ">=", min_price)
+    if max_price is not None:
+        wb = where_builder.child("OR")
+        wb.compare("ae.price", "<=", max_price)
+        wb.add("ae.price IS NULL")
+        where_builder.add_builder(wb)
+
+    # Create buyer filters
+    if buyer is not None:
+        where_builder.compare("ae.buyer", "=", buyer)
+    elif buyer_partial is not None:
+        fragments = [x.strip() for x in buyer_partial.split(",")]
+        for fragment in fragments:
+            where_builder.like("ae.buyer", f"%{fragment}%")
+
+    # Create seller filters
+    if seller is not None:
+        where_builder.compare("ae.seller", "=", seller)
+    elif seller_partial is not None:
+        fragments = [x.strip() for x in seller_partial.split(",")]
+        for fragment in fragments:
+            where_builder.like("ae.seller", f"%{fragment}%")
+
+    # Create completion filter
+    if complete is not None:
+        where_builder.compare("ae.auction_is_complete", "=", int(complete))
+
+    # Auction filter
+    if id_auction is not None:
+        where_builder.compare("ae.auction_id", "=", id_auction)
+
+    # Query DB
+    return _search_equips(
+        db,
+        AUCTION_EQUIPS,
+        where_builder,
+        name=name,
+        sort=sort,
+        order=order,
+        limit=limit,
+        cursor=cursor,
+        fields=fields,
+    )
+
+
+@dataclass
+class _EquipSource:
+    """Tables backing an equip search endpoint"""
+
+    # FROM clause joining the equips to their auctions
+    tables: str
+    # Alias of the equips table in the FROM clause
+    alias: str
+    # Full-text index of the equips table, or for a view over multiple tables, source tag --> index
+    fts_table: str | dict[str, str]
+    columns: list[str]
+    # Response key --> column, for the nested "auction" object
+    auction_columns: dict[str, str]
+    # Sort option --> expression
+    sort_keys: dict[str, str]
+    # Expressions that uniquely identify a row, to break ties when sorting
+    row_keys: list[str]
+    # Filterable columns --> type (see WhereBuilder.columns)
+    column_types: dict[str, ColumnType]
+
+
+SUPER_EQUIPS = _EquipSource(
+    tables="super_equips as se INNER JOIN super_auctions as sa ON sa.id = se.id_auction",
+    alias="se",
+    fts_table="super_equips_fts",
+    columns=["id", "id_auction", "name", "eid", "key", "is_isekai", "level", "stats", "price", "bid_link", "next_bid", "buyer", "seller"],  # fmt: skip
+    auction_columns=dict(
+        id="sa.id",
+        end_time="sa.end_time",
+        is_complete="sa.is_complete",
+        title="sa.title",
+    ),
+    sort_keys=dict(
+        price="IFNULL(se.price, 0)",
+        time="sa.end_time",
+        level="IFNULL(se.level, 0)",
+    ),
+    row_keys=["se.rowid"],
+    column_types={
+        "se.name": "text",
+        "se.price": "number",
+        "se.buyer": "text",
+        "se.seller": "text",
+        "sa.id": "text",
+        "sa.end_time": "number",
+        "sa.is_complete": "number",
+    },
+)
+
+KEDAMA_EQUIPS = _EquipSource(
+    tables="kedama_equips as equip INNER JOIN kedama_auctions as list ON list.id = equip.id_auction",
+    alias="equip",
+    fts_table="kedama_equips_fts",
+    columns=["id", "id_auction", "name", "eid", "key", "is_isekai", "level", "stats", "price", "start_bid", "post_index", "buyer", "seller"],  # fmt: skip
+    auction_columns=dict(
+        start_time="list.start_time",
+        title="list.title",
+        title_short="list.title_short",
+        id="list.id",
+    ),
+    sort_keys=dict(
+        price="IFNULL(equip.price, 0)",
+        time="list.start_time",
+        level="IFNULL(equip.level, 0)",
+    ),
+    row_keys=["equip.rowid"],
+    column_types={
+        "equip.name": "text",
+        "equip.price": "number",
+        "equip.buyer": "text",
+        "equip.seller": "text",
+        "list.id": "text",
+        "list.start_time": "number",
+    },
+)
+
+AUCTION_EQUIPS = _EquipSource(
+    tables="auction_equips as ae",
+    alias="ae",
+    fts_table=dict(super="super_equips_fts", kedama="kedama_equips_fts"),
+    columns=["source", "id", "id_auction", "name", "eid", "key", "is_isekai", "level", "stats", "price", "min_bid", "buyer", "seller"],  # fmt: skip
+    auction_columns=dict(
+        id="ae.auction_id",
+        time="ae.auction_time",
+        is_complete="ae.auction_is_complete",
+        title="ae.auction_title",
+        title_short="ae.auction_title_short",
+    ),
+    sort_keys=dict(
+        price="IFNULL(ae.price, 0)",
+        time="ae.auction_time",
+        level="IFNULL(ae.level, 0)",
+    ),
+    row_keys=["ae.source", "ae.equip_rowid"],
+    column_types={
+        "ae.name": "text",
+        "ae.price": "number",
+        "ae.buyer": "text",
+        "ae.seller": "text",
+        "ae.auction_id": "text",
+        "ae.auction_time": "number",
+        "ae.auction_is_complete": "number",
+    },
+)
+
+
+def _search_equips(
+    db: Db,
+    source: _EquipSource,
+    where_builder: WhereBuilder,
+    name: str | None,
+    sort: EquipSort | None,
+    order: SortOrder,
+    limit: int | None,
+    cursor: str | None,
+    fields: str | None,
+) -> list[dict] | dict:
+    """Run an equip search
+
+    If limit or cursor is set, a page of results is returned along with the total number of matches and a cursor for the next page.
+    Otherwise all results are returned as a list.
+    """
+
+    is_paged = limit is not None or cursor is not None
+    page_size = check_page_size(limit)
+
+    # Pages need a stable order
+    if is_paged and sort is None:
+        sort = "time"
+
+    prev_page = Cursor.decode(cursor, sort, order) if cursor and sort else None
+
+    # Sort by row id too so that keys are unique
+    sort_keys = [source.sort_keys[sort], *source.row_keys] if sort else []
+
+    # Only select requested columns (plus the sort key to build the next cursor from)
+    projection = parse_fields(fields, source.columns + ["auction"])
+    select = [f"{source.alias}.{col}" for col in projection if col != "auction"]
+    if "auction" in projection:
+        select += [f"{v} as auction_{k}" for k, v in source.auction_columns.items()]
+    select += [f"{k} as sort_key_{idx}" for idx, k in enumerate(sort_keys)]
+
+    def search(use_fts: bool) -> list[sqlite3.Row]:
+        wb = replace(where_builder, fragments=where_builder.fragments.copy())
+        fts_join, order_by = _add_name_filter(wb, name, source, use_fts)
+        where, data = wb.print()
+
+        if sort:
+            order_by = order_by_clause(sort_keys, order)
+        if prev_page:
+            condition, after = keyset_condition(sort_keys, order, prev_page.after)
+            where = and_where(where, condition)
+            data += after
+
+        limit_clause = ""
+        if is_paged:
+            # One extra row to check if there is a next page
+            limit_clause = "LIMIT ?"
+            data.append(page_size + 1)
+
+        with db:
+            query = f"""
+                SELECT {", ".join(select)}
+                FROM {source.tables}
+                {fts_join}
+                {where}
+                {order_by}
+                {limit_clause}
+                """
+            logger.trace(f"Search {source.alias} {query} {data}")
+            with timed("sql"):
+                return db.execute(query, data).fetchall()
+
+    def count(use_fts: bool) -> int:
+        wb = replace(where_builder, fragments=where_builder.fragments.copy())
+        fts_join, _ = _add_name_filter(wb, name, source, use_fts)
+        where, data = wb.print()
+
+        # The LIMIT keeps sqlite from merging the subquery into the COUNT,
+        # which for a view would prevent the filters from being applied to (and using the indices of) each table in it
+        with db:
+            query = f"""
+                SELECT COUNT(*) FROM (
+                    SELECT 1
+                    FROM {source.tables}
+                    {fts_join}
+                    {where}
+                    LIMIT -1
+                )
+                """
+            with timed("sql"):
+                return db.execute(query, data).fetchone()[0]
+
+    if prev_page:
+        use_fts = prev_page.use_fts
+        rows = search(use_fts)
+    else:
+        rows, use_fts = _search_with_fallback(search, name)
 
     # Massage data structure
-    result = [dict(row) for row in rows]
-    for r in result:
+    result = []
+    for row in rows[:page_size] if is_paged else rows:
+        r = dict(row)
+
         # Move joined cols into dict
-        r["auction"] = dict()
-        for k in list(r.keys()):
-            if k.startswith("list_"):
-                r["auction"][k.replace("list_", "")] = r[k]
-                del r[k]
+        if "auction" in projection:
+            r["auction"] = {k: r.pop(f"auction_{k}") for k in source.auction_columns}
+        for idx in range(len(sort_keys)):
+            del r[f"sort_key_{idx}"]
 
         # Stats col contains json
-        r["stats"] = json.loads(r["stats"])
+        if "stats" in r:
+            r["stats"] = json.loads(r["stats"])
+
+        result.append(r)
+
+    if not is_paged:
+        return result
+
+    assert sort
+    total = prev_page.total if prev_page else count(use_fts)
 
-    # Return
-    return result
+    next_cursor = None
+    if len(rows) > page_size:
+        last = rows[page_size - 1]
+        next_cursor = Cursor(
+            sort=sort,
+            order=order,
+            after=[last[f"sort_key_{idx}"] for idx in range(len(sort_keys))],
+            total=total,
+            use_fts=use_fts,
+        ).encode()
+
+    return dict(items=result, total=total, next_cursor=next_cursor)
+
+
+def _add_name_filter(
+    where_builder: WhereBuilder,
+    name: str | None,
+    source: _EquipSource,
+    use_fts: bool,
+) -> tuple[str, str]:
+    """Add equip name filters to a search query
+
+    Each comma-separated fragment must be contained in the name
+    (eg "name=peer,waki" should match "Peerless * Wakizashi of the *")
+
+    When use_fts is set, fragments are matched via the (trigram) full-text index
+    and the results are ranked by relevance. Fragments too short for the index, or all of them if use_fts isn't set, are matched via LIKE.
+
+    Returns:
+        (join clause, order by clause)
+    """
+
+    fragments = [x.strip() for x in (name or "").split(",")]
+    fragments = [x for x in fragments if x]
+    if not fragments:
+        return "", ""
+
+    alias = source.alias
+    fts_table = source.fts_table
+
+    fts_fragments = []
+    if use_fts:
+        fts_fragments = [x for x in fragments if len(x) >= FTS_MIN_TERM_LENGTH]
+    for fragment in fragments:
+        if fragment not in fts_fragments:
+            where_builder.like(f"{alias}.name", f"%{fragment}%")
+
+    if not fts_fragments:
+        return "", ""
+    elif isinstance(fts_table, dict):
+        # Rows of a view can't be joined to the indices, so look up matching rows per source instead
+        # (rank isn't comparable across indices so there's no relevance order)
+        wb = where_builder.child("OR")
+        for tag, tbl in fts_table.items():
+            wb_source = wb.child("AND")
+            wb_source.add(f"{alias}.source = ?", tag)
+            wb_source.add(
+                f"{alias}.equip_rowid IN (SELECT rowid FROM {tbl} WHERE {tbl} MATCH ?)",
+                to_fts_query(fts_fragments),
+            )
+            wb.add_builder(wb_source)
+        where_builder.add_builder(wb)
+        return "", ""
+    else:
+        where_builder.add(f"{fts_table} MATCH ?", to_fts_query(fts_fragments))
+        join = f"INNER JOIN {fts_table} ON {fts_table}.rowid = {alias}.rowid"
+        order_by = f"ORDER BY {fts_table}.rank"
+        return join, order_by
+
+
+def _search_with_fallback(
+    search: Callable[[bool], list[sqlite3.Row]], name: str | None
+) -> tuple[list[sqlite3.Row], bool]:
+    """Run search via the full-text index, or via LIKE if the index can't handle the query
+
+    Returns:
+        (rows, whether the full-text index was used)
+    """
+
+    try:
+        return search(True), True
+    except sqlite3.OperationalError:
+        logger.exception(f"Full-text search failed for {name}")
+        return search(False), False
 
 
 @server.get("/lottery/search")
@@ -291,19 +770,27 @@ def get_lottery(
     user_partial: Optional[str] = None,
     min_date: Optional[float] = None,
     max_date: Optional[float] = None,
-    db: Connection = Depends(init_db),
+    sort: Optional[Literal["time"]] = None,
+    order: SortOrder = "desc",
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    db: Connection = Depends(get_ro_db),
 ):
     """Search lottery data
 
     The equip name and user name can be a comma separated list (eg "peerl,oak,heimd" instead of "Peerless Oak Staff of Heimdall")
+
+    Pass a limit to get results a page at a time and the cursor from each page to get the next one.
+    fields is a comma separated list of keys to include for each lottery (eg "date,prizes")
     """
-    where_builder = WhereBuilder("AND")
+    where_builder = WhereBuilder("AND", columns=LOTTERY_COLUMN_TYPES)
 
     # Filter by item name
     if equip is not None:
         fragments = [x.strip() for x in equip.split(",")]
         for fragment in fragments:
-            where_builder.add('"1_prize" LIKE ?', f"%{fragment}%")
+            where_builder.like('"1_prize"', f"%{fragment}%")
 
     # Create date filters (utc)
     if min_date is not None and max_date is not None and max_date < min_date:
@@ -311,141 +798,546 @@ def get_lottery(
             400, detail=f"min_date > max_date ({min_date} > {max_date})"
         )
     if min_date is not None:
-        where_builder.add("date >= ?", min_date)
+        where_builder.compare("date", ">=", min_date)
     if max_date is not None:
-        where_builder.add("date <= ?", max_date)
+        where_builder.compare("date", "<=", max_date)
 
-    # Filter by winner name
-    user_cols = ["1_user", "1b_user", "2_user", "3_user", "4_user", "5_user"]
+    # Filter by winner name (via lottery_winners, which has a row per winner instead of a column per place)
+    wb_user = where_builder.child("AND")
     if user is not None:
-        wb = WhereBuilder("OR")
-        for col in user_cols:
-            wb.add(f'"{col}" = ?', user)
-        where_builder.add_builder(wb)
+        wb_user.compare("user", "=", user)
     elif user_partial is not None:
-        wb = WhereBuilder("OR")
-        for col in user_cols:
-            wb2 = WhereBuilder("AND")
-            fragments = [x.strip() for x in user_partial.split(",")]
-            for fragment in fragments:
-                wb2.add(f'"{col}" LIKE ?', f"%{fragment}%")
-            wb.add_builder(wb2)
-        where_builder.add_builder(wb)
+        fragments = [x.strip() for x in user_partial.split(",")]
+        for fragment in fragments:
+            wb_user.like("user", f"%{fragment}%")
+
+    is_paged = limit is not None or cursor is not None
+    page_size = check_page_size(limit)
+
+    # Pages need a stable order
+    if is_paged and sort is None:
+        sort = "time"
+
+    prev_page = Cursor.decode(cursor, sort, order) if cursor and sort else None
+
+    # Weapon / armor lotteries with the same id are drawn at the same time, so include type in the key
+    sort_keys = ["date", "type", "id"]
+
+    # Only select requested columns (plus the sort key to build the next cursor from)
+    projection = parse_fields(fields, ["date", "tickets", "lottery", "prizes"])
+    select = ["id", "date"]
+    if "tickets" in projection:
+        select.append("tickets")
+    if "prizes" in projection:
+        # As a json list of [item, winner], so that it's parsed in one go
+        prizes = []
+        for rank in PRIZE_RANKS:
+            # The prizes after the equip and core are stored as json
+            prize = (
+                f'"{rank}_prize"' if rank in ["1", "1b"] else f'json("{rank}_prize")'
+            )
+            prizes.append(f'json_array({prize}, "{rank}_user")')
+        select.append(f"json_array({', '.join(prizes)}) as prizes")
+
+    def filter_lotteries(type: str) -> WhereBuilder:
+        wb = replace(where_builder, fragments=where_builder.fragments.copy())
+        if wb_user.fragments:
+            user_where, user_data = wb_user.print(root=False)
+            wb.add(
+                f"id IN (SELECT lottery_id FROM lottery_winners WHERE lottery_type = '{type}' AND {user_where})",
+                *user_data,
+            )
+        return wb
+
+    # Each lottery table is filtered, sorted and limited separately (so that each can stop at the end of the page)
+    # then merged
+    subqueries = []
+    query_data = []
+    for type in ["weapon", "armor"]:
+        where, data = filter_lotteries(type).print()
+
+        branch_keys = ["date", f"'{type}'", "id"]
+        branch_order_by = ""
+        branch_limit = ""
+        if sort:
+            branch_order_by = order_by_clause(branch_keys, order)
+        if prev_page:
+            condition, after = keyset_condition(branch_keys, order, prev_page.after)
+            where = and_where(where, condition)
+            data += after
+        if is_paged:
+            # One extra row to check if there is a next page
+            branch_limit = "LIMIT ?"
+            data.append(page_size + 1)
+
+        subqueries.append(
+            f"""
+            SELECT * FROM (
+                SELECT {', '.join(select)}, '{type}' as type FROM lottery_{type}
+                {where}
+                {branch_order_by}
+                {branch_limit}
+            )
+            """
+        )
+        query_data += data
+
+    order_by = ""
+    limit_clause = ""
+    if sort:
+        order_by = order_by_clause(sort_keys, order)
+    if is_paged:
+        limit_clause = "LIMIT ?"
+        query_data.append(page_size + 1)
 
-    # Run query
-    rows = []
     with db:
+        query = f"""
+            {" UNION ALL ".join(subqueries)}
+            {order_by}
+            {limit_clause}
+            """
+        logger.trace(f"Search lottery {query} {query_data}")
+        with timed("sql"):
+            rows = db.execute(query, query_data).fetchall()
+
+    result = []
+    for r in rows[:page_size] if is_paged else rows:
+        data = dict()
+        if "date" in projection:
+            data["date"] = r["date"]
+        if "tickets" in projection:
+            data["tickets"] = r["tickets"]
+        if "lottery" in projection:
+            data["lottery"] = dict(id=r["id"], type=r["type"])
+        if "prizes" in projection:
+            data["prizes"] = json.loads(r["prizes"])
+
+        result.append(data)
+
+    if not is_paged:
+        return result
+
+    assert sort
+    if prev_page:
+        total = prev_page.total
+    else:
+        counts = []
+        count_data = []
         for type in ["weapon", "armor"]:
-            where, query_data = where_builder.print()
-            query = f"""
-                SELECT * FROM lottery_{type}
-                {where}
+            where, data = filter_lotteries(type).print()
+            counts.append(f"(SELECT COUNT(*) FROM lottery_{type} {where})")
+            count_data += data
+
+        with db, timed("sql"):
+            total = db.execute(f"SELECT {' + '.join(counts)}", count_data).fetchone()[0]
+
+    next_cursor = None
+    if len(rows) > page_size:
+        last = rows[page_size - 1]
+        next_cursor = Cursor(
+            sort=sort,
+            order=order,
+            after=[last[k] for k in sort_keys],
+            total=total,
+        ).encode()
+
+    return dict(items=result, total=total, next_cursor=next_cursor)
+
+
+@server.get("/lottery/user_stats")
+def get_lottery_user_stats(
+    user: str,
+    min_date: Optional[float] = None,
+    db: Connection = Depends(get_ro_db),
+):
+    """Number of wins and prizes (eg 30 Chaos Tokens over 3 wins) of a user, per place
+
+    The user name is matched case-insensitively and returned as it was recorded.
+    Without min_date this is read from a rollup, so it takes the same time regardless of how many lotteries the user won.
+    """
+
+    with db, timed("sql"):
+        if min_date is None:
+            rows = db.execute(
+                """
+                SELECT user, place, wins, quantity FROM lottery_user_stats
+                WHERE user = ?
+                ORDER BY place
+                """,
+                [user],
+            ).fetchall()
+        else:
+            rows = db.execute(
                 """
-            logger.trace(f"Search lottery {query} {query_data}")
-            rs = db.execute(query, query_data).fetchall()
-            for r in rs:
-                data = dict(r)
-                data["type"] = type
-                rows.append(data)
+                SELECT user, place, COUNT(*) as wins, SUM(prize_qty) as quantity FROM lottery_winners
+                WHERE user = ? COLLATE NOCASE AND date >= ?
+                GROUP BY place
+                ORDER BY place
+                """,
+                [user, min_date],
+            ).fetchall()
 
-    # Recombine columns into list of (item, winner)
-    parse = json.loads
+    places = [
+        dict(place=r["place"], wins=r["wins"], quantity=r["quantity"]) for r in rows
+    ]
+    return dict(user=rows[0]["user"] if rows else None, places=places)
 
-    result = []
-    for r in rows:
-        result.append(
-            dict(
-                date=r["date"],
-                tickets=r["tickets"],
-                lottery=dict(id=r["id"], type=r["type"]),
-                prizes=[
-                    [r["1_prize"], r["1_user"]],
-                    [r["1b_prize"], r["1b_user"]],
-                    [parse(r["2_prize"]), r["2_user"]],
-                    [parse(r["3_prize"]), r["3_user"]],
-                    [parse(r["4_prize"]), r["4_user"]],
-                    [parse(r["5_prize"]), r["5_user"]],
-                ],
-            ),
+
+@server.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Per-route latency, response sizes, etc in the Prometheus text format"""
+
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@server.get("/admin/sql", dependencies=[Depends(require_admin)])
+def get_sql_stats(limit: int = 20):
+    """Query shapes with the highest total time, and the most recent slow queries (requires SQL_TRACE)"""
+
+    shapes = [
+        dict(
+            sql=shape.sql,
+            count=shape.count,
+            total_ms=shape.total_seconds * 1000,
+            mean_ms=shape.total_seconds / shape.count * 1000,
+            max_ms=shape.max_seconds * 1000,
+            rows=shape.rows,
+            param_types=dict(shape.param_types),
         )
+        for shape in sql_trace.select_top_shapes(limit)
+    ]
+
+    slow_queries = [
+        dict(
+            sql=q.sql,
+            param_types=q.param_types,
+            ms=q.seconds * 1000,
+            rows=q.rows,
+            plan=q.plan,
+        )
+        for q in sql_trace.select_slow_queries()
+    ]
 
-    return result
+    return dict(enabled=SQL_TRACE, shapes=shapes, slow_queries=slow_queries)
 
 
 @server.get("/export/sqlite", response_class=PlainTextResponse)
-def export_sqlite(db: Connection = Depends(init_db)):
-    """Equivalent to .dump in sqlite3"""
+def export_sqlite(request: Request):
+    """Equivalent to .dump in sqlite3
+
+    Served from a snapshot that's rebuilt in the background after the data changes
+    (so it may be up to EXPORT_REBUILD_DELAY seconds behind)
+    """
+
+    snapshot = exports.latest_sqlite_export()
+    if snapshot is None:
+        raise HTTPException(
+            503, detail="Export not built yet", headers={"Retry-After": "60"}
+        )
+
+    # Snapshot is stored gzip'd, so clients that accept gzip get the file as-is (with range support)
+    accepts_gzip = "gzip" in request.headers.get("accept-encoding", "")
+    etag = f'"sqlite-{snapshot.version}{"-gzip" if accepts_gzip else ""}"'
+    headers = {
+        "ETag": etag,
+        "Vary": "Accept-Encoding",
+        "X-Export-Version": str(snapshot.version),
+    }
+
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    if accepts_gzip:
+        return FileResponse(
+            snapshot.path,
+            media_type="text/plain",
+            headers={**headers, "Content-Encoding": "gzip"},
+        )
+    else:
+        return StreamingResponse(
+            exports.iter_decompressed(snapshot.path),
+            media_type="text/plain",
+            headers=headers,
+        )
 
-    db_copy = sqlite3.connect(":memory:")
-    db.backup(db_copy)
 
-    with db_copy:
-        # Delete unnecessary tables
-        tables = db_copy.execute(
-            'SELECT name FROM sqlite_master WHERE type = "table"'
-        ).fetchall()
-        tables = [x[0] for x in tables]
+@server.get("/export/{format}/{table}")
+def export_columnar(format: exports.ColumnarFormat, table: str, request: Request):
+    """Table as a Parquet or Arrow IPC (Feather) file
 
-        for tbl in tables:
-            if tbl not in EXPORTED_TABLES:
-                db_copy.execute(f"DROP TABLE {tbl}")
+    Json columns are also expanded into typed columns (eg stats.ADB, 2_prize.quantity).
+    The file is cached until the table changes.
+    eg pandas.read_parquet("https://hvdata.gisadan.dev/export/parquet/super_equips")
+    """
 
-    # Export
-    resp = "\n".join(db_copy.iterdump())
-    return resp
+    if table not in EXPORTED_TABLES:
+        raise HTTPException(
+            404, detail=f"Unknown table {table}. Choose from {EXPORTED_TABLES}"
+        )
+
+    snapshot = exports.get_columnar_export(export_db_pool, table, format)
+
+    etag = f'"{table}-{snapshot.version}-{format}"'
+    headers = {"ETag": etag, "X-Export-Version": str(snapshot.version)}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(
+        snapshot.path,
+        media_type=(
+            "application/vnd.apache.parquet"
+            if format == "parquet"
+            else "application/vnd.apache.arrow.file"
+        ),
+        filename=snapshot.path.name,
+        headers=headers,
+    )
 
 
 @server.get("/export/json")
-def export_json(db: Connection = Depends(init_db)):
-    """Dump DB as JSON"""
-    resp = dict()
+def export_json(
+    tables: Optional[str] = None,
+    since: Optional[int] = None,
+    format: Literal["json", "ndjson"] = "json",
+):
+    """Dump DB as JSON
+
+    Rows are streamed a table at a time. Use format=ndjson to get one row per line instead of a single object.
+
+    Args:
+        tables: Comma separated list of tables (default all exported tables)
+        since: Only include rows inserted / updated since this version (from the X-Export-Version header of a previous export)
+    """
+
+    if tables is None:
+        table_list = EXPORTED_TABLES
+    else:
+        table_list = [x.strip() for x in tables.split(",") if x.strip()]
+        unknown = [x for x in table_list if x not in EXPORTED_TABLES]
+        if unknown:
+            raise HTTPException(
+                400, detail=f"Unknown tables {unknown}. Choose from {EXPORTED_TABLES}"
+            )
+
+    # Changes made while the export is being read may be included too, so this is a lower bound
+    with ro_db_pool.connection() as db:
+        version = select_export_version(db)
+
+    return StreamingResponse(
+        exports.iter_json_export(export_db_pool, table_list, since, format),
+        media_type="application/json" if format == "json" else "application/x-ndjson",
+        headers={"X-Export-Version": str(version)},
+    )
 
-    with db:
-        for tbl in EXPORTED_TABLES:
-            resp[tbl] = [dict(x) for x in db.execute(f"SELECT * FROM {tbl}").fetchall()]
 
-    return resp
+@server.get("/export/changes")
+def export_changes(since: int, format: Literal["ndjson", "sql"] = "ndjson"):
+    """Rows inserted / updated / deleted since an export version
 
+    Start from /export/sqlite (or version 0) and pass the X-Export-Version of the last response to get the next delta.
+    See tools/apply_export_changes.py
+    """
+
+    with ro_db_pool.connection() as db:
+        version = select_export_version(db)
+
+    if since < 0 or since > version:
+        raise HTTPException(400, detail=f"since must be in [0, {version}]")
+
+    return StreamingResponse(
+        exports.iter_changes(export_db_pool, since, version, format),
+        media_type="application/x-ndjson" if format == "ndjson" else "application/sql",
+        headers={"X-Export-Version": str(version)},
+    )
 
-db_lock = asyncio.Lock()
+
+# In-progress HV fetches, so that concurrent requests for the same equip share one fetch
+_equip_fetches: dict[tuple[int, str, bool], asyncio.Task[dict]] = dict()
+
+
+def _collect_hv_queue_depths() -> dict:
+    with ro_db_pool.connection() as db:
+        depths = hv_bucket.select_queue_depths(db)
+    return {(("priority", p.name.lower()),): n for p, n in depths.items()}
+
+
+metrics.register_gauge(
+    "hv_queue_depth",
+    "Callers waiting for an HV fetch slot (in all processes, incl. scrapers / bot), by priority",
+    _collect_hv_queue_depths,
+)
 
 
 @server.get("/equip")
 async def get_equip(
     eid: int,
     key: str,
+    background_tasks: BackgroundTasks,
     is_isekai: bool = False,
+    refresh: bool = False,
 ):
-    async with db_lock:
-        db = init_db()
-        with db:
-            last_fetch = select_metadata(db, "last_hv_fetch")
-            now = datetime.datetime.now()
+    """Fetch equip page from HV and parse it
 
-            if last_fetch:
-                last_fetch = datetime.datetime.fromisoformat(last_fetch)
-                next_fetch = last_fetch + datetime.timedelta(
-                    seconds=HV_FETCH_DELAY_SECONDS
-                )
+    Parsed data is stored and returned as-is for EQUIP_CACHE_TTL_SECONDS.
+    After that, the stored data is still returned immediately but a refetch is queued in the background.
+    Set refresh=true to always refetch.
+    """
 
-                if now < next_fetch:
-                    insert_metadata(db, "last_hv_fetch", next_fetch.isoformat())
+    # The connection is returned before waiting on HV, so that slow fetches don't starve the searches of connections
+    [cached] = await asyncio.to_thread(_select_equips, [(eid, key, is_isekai)])
 
-                    delay = (next_fetch - now).seconds
-                    await asyncio.sleep(delay)
-                else:
-                    insert_metadata(db, "last_hv_fetch", now.isoformat())
-            else:
-                insert_metadata(db, "last_hv_fetch", now.isoformat())
-
-            resp = fetch_equip_html(eid, key, is_isekai)
-            if resp.status_code != 200:
-                raise HTTPException(resp.status_code)
-            elif "No such equip" in resp.text:
-                raise HTTPException(404)
-            elif "Nope" in resp.text:
-                raise HTTPException(404)
+    if cached and not refresh:
+        _refresh_if_stale(cached, eid, key, is_isekai, background_tasks)
+
+        # Already serialized
+        return Response(cached["data"], media_type="application/json")
+
+    return await fetch_equip(eid, key, is_isekai)
+
+
+class EquipRef(BaseModel):
+    eid: int
+    key: str
+    is_isekai: bool = False
+
+
+@server.post("/equips/batch")
+async def get_equips_batch(
+    equips: list[EquipRef],
+    background_tasks: BackgroundTasks,
+):
+    """Same as /equip but for multiple equips at once
+
+    Stored equips are returned without waiting on HV, and the rest are fetched concurrently (still subject to the HV delay).
+    Results are in the same order as the request, with a status code per equip.
+    """
 
+    if len(equips) > EQUIP_BATCH_LIMIT:
+        raise HTTPException(
+            400, detail=f"Too many equips ({len(equips)} > {EQUIP_BATCH_LIMIT})"
+        )
+
+    # Looked up up front, so that the connection is returned before waiting on HV
+    refs = [(ref.eid, ref.key, ref.is_isekai) for ref in equips]
+    cached_equips = await asyncio.to_thread(_select_equips, refs)
+
+    async def lookup(ref: EquipRef, cached: sqlite3.Row | None) -> dict:
+        result = dict(eid=ref.eid, key=ref.key, is_isekai=ref.is_isekai)
+
+        if cached:
+            _refresh_if_stale(cached, ref.eid, ref.key, ref.is_isekai, background_tasks)
+            return dict(**result, status=200, data=json.loads(cached["data"]))
+
+        try:
+            data = await fetch_equip(ref.eid, ref.key, ref.is_isekai)
+            return dict(**result, status=200, data=data)
+        except HTTPException as e:
+            return dict(**result, status=e.status_code, data=None)
+        except Exception:
+            LOGGER.exception(f"Batch fetch failed for {ref}")
+            return dict(**result, status=500, data=None)
+
+    return await asyncio.gather(
+        *[lookup(ref, cached) for ref, cached in zip(equips, cached_equips)]
+    )
+
+
+async def fetch_equip(
+    eid: int, key: str, is_isekai: bool, priority: Priority = Priority.INTERACTIVE
+) -> dict:
+    """Fetch, parse, and store equip, or wait on the in-progress fetch for the same equip"""
+
+    fetch_key = (eid, key, is_isekai)
+
+    task = _equip_fetches.get(fetch_key)
+    if task is None:
+        task = asyncio.create_task(_fetch_equip(eid, key, is_isekai, priority))
+        _equip_fetches[fetch_key] = task
+        task.add_done_callback(lambda _: _equip_fetches.pop(fetch_key, None))
+
+    # Shielded so one client disconnecting doesn't cancel the fetch for everyone else
+    with timed("hv_fetch"):
+        return await asyncio.shield(task)
+
+
+def _refresh_if_stale(
+    cached: sqlite3.Row,
+    eid: int,
+    key: str,
+    is_isekai: bool,
+    background_tasks: BackgroundTasks,
+):
+    """Queue a refetch if the stored data is older than EQUIP_CACHE_TTL_SECONDS"""
+
+    updated_at = datetime.datetime.fromisoformat(cached["updated_at"])
+    age = datetime.datetime.now() - updated_at
+
+    if (
+        age.total_seconds() > EQUIP_CACHE_TTL_SECONDS
+        and (eid, key, is_isekai) not in _equip_fetches
+    ):
+        background_tasks.add_task(_refresh_equip, eid, key, is_isekai)
+
+
+async def _refresh_equip(eid: int, key: str, is_isekai: bool):
+    try:
+        await fetch_equip(eid, key, is_isekai, Priority.BACKGROUND)
+    except Exception:
+        LOGGER.exception(f"Background refresh failed for {eid} {key}")
+
+
+def _select_equips(refs: list[tuple[int, str, bool]]) -> list[sqlite3.Row | None]:
+    """Stored data for each (eid, key, is_isekai), via a connection that's only held for the lookups"""
+
+    with ro_db_pool.connection() as db:
+        return [_select_equip(db, *ref) for ref in refs]
+
+
+def _select_equip(db: Db, eid: int, key: str, is_isekai: bool) -> sqlite3.Row | None:
+    with timed("sql"):
+        return db.execute(
+            """
+            SELECT updated_at, data, html_hash FROM equips
+            WHERE id = ? AND key = ? AND is_isekai = ? AND data IS NOT NULL
+            """,
+            [eid, key, int(is_isekai)],
+        ).fetchone()
+
+
+async def _fetch_equip(eid: int, key: str, is_isekai: bool, priority: Priority) -> dict:
+    await hv_bucket.acquire(priority)
+
+    status, html = await equip_parser.fetch_equip_html(eid, key, is_isekai)
+    if status != 200:
+        raise HTTPException(status)
+    elif "No such equip" in html:
+        raise HTTPException(404)
+    elif "Nope" in html:
+        raise HTTPException(404)
+
+    # Parsing is cpu-bound and the db is blocking, so keep them off the event loop
+    return await asyncio.to_thread(_parse_and_store_equip, eid, key, is_isekai, html)
+
+
+def _parse_and_store_equip(eid: int, key: str, is_isekai: bool, html: str) -> dict:
+    now = datetime.datetime.now()
+
+    with db_pool.connection() as db:
+        # Skip parsing if page is unchanged since the last fetch
+        html_hash = hashlib.sha256(html.encode()).hexdigest()
+        cached = _select_equip(db, eid, key, is_isekai)
+        if cached and cached["html_hash"] == html_hash:
+            with db:
+                db.execute(
+                    """
+                    UPDATE equips SET updated_at = ?
+                    WHERE id = ? AND key = ? AND is_isekai = ?
+                    """,
+                    [now.isoformat(), eid, key, int(is_isekai)],
+                )
+            return json.loads(cached["data"])
+
+        with db:
             db.execute(
                 """
                 INSERT INTO equips_html (
@@ -454,42 +1346,44 @@ async def get_equip(
                     ?, ?, ? ,?, ?
                 )
                 """,
-                [eid, key, int(is_isekai), now.isoformat(), resp.text],
+                [eid, key, int(is_isekai), now.isoformat(), html],
             )
 
-            if resp.text in ["Nope", "No such item"]:
-                raise HTTPException(404)
+        if html in ["Nope", "No such item"]:
+            raise HTTPException(404)
 
-            if not is_isekai:
-                data = equip_parser.parse_equip_html(resp.text)
-                data["calculations"] = infer_equip_stats.infer_equip_stats(data)
-            else:
-                data = equip_parser_beta.parse_equip_html(resp.text)
-                data["calculations"] = data["calculations"] = (
-                    infer_equip_stats_beta.infer_equip_stats(data)
-                )
-                LOGGER.info(json.dumps(data, indent=2))
+        if not is_isekai:
+            data = equip_parser.parse_equip_html(html)
+            data["calculations"] = infer_equip_stats.infer_equip_stats(data)
+        else:
+            data = equip_parser_beta.parse_equip_html(html)
+            data["calculations"] = infer_equip_stats_beta.infer_equip_stats(data)
 
+        with db:
             db.execute(
                 """
                 INSERT OR REPLACE INTO equips (
-                    id, key, is_isekai, updated_at, data
+                    id, key, is_isekai, updated_at, data, html_hash
                 ) VALUES (
-                    ?, ?, ?, ?, ?
+                    ?, ?, ?, ?, ?, ?
                 )
                 """,
-                [eid, key, int(is_isekai), now.isoformat(), json.dumps(data)],
+                [
+                    eid,
+                    key,
+                    int(is_isekai),
+                    now.isoformat(),
+                    json.dumps(data),
+                    html_hash,
+                ],
             )
 
-            return data
+    return data
 
 
 @server.get("/spellcheck_equip")
-async def spellcheck_equip(name: str):
-    db = init_db()
-    name_dict = {
-        r["word"]: r["count"] for r in db.execute("SELECT word, count FROM equip_words")
-    }
+def spellcheck_equip(name: str, db: Connection = Depends(get_ro_db)):
+    index = spellcheck.get_index(db)
 
     words = name.split()
     correction = []
@@ -498,7 +1392,9 @@ async def spellcheck_equip(name: str):
         # prefer title-cased variants
         w = w[0].upper() + w[1:]
 
-        closest = min(name_dict.keys(), key=lambda k: distance(w, k))
+        closest = index.correct(w)
+        if closest is None:
+            raise HTTPException(503, detail="Name dictionary is empty")
 
         correction.append(closest)
 
@@ -527,8 +1423,8 @@ def create_range_update_task():
                 now = datetime.datetime.now()
 
                 if now < next_fetch:
-                    delay = (next_fetch - now).seconds
-                    LOGGER.info(f"Sleeping for {delay}s before range fetch...")
+                    delay = (next_fetch - now).total_seconds()
+                    LOGGER.info(f"Sleeping for {delay:.0f}s before range fetch...")
                     await asyncio.sleep(delay)
 
             now = datetime.datetime.now()
@@ -547,7 +1443,11 @@ def create_range_update_task():
             script_el = select_one_or_raise(soup, "[data-itemranges]")
 
             data = json.loads(script_el["data-itemranges"])  # type: ignore
-            RANGES_FILE.write_text(json.dumps(data))
+
+            # Swap the file in whole, since the api workers may be reading it
+            tmp_fp = RANGES_FILE.with_suffix(".tmp")
+            tmp_fp.write_text(json.dumps(data))
+            tmp_fp.replace(RANGES_FILE)
             LOGGER.info("Range update complete")
 
     return poll_ranges()
@@ -568,8 +1468,8 @@ def create_name_dictionary_task():
                 now = datetime.datetime.now()
 
                 if now < next_fetch:
-                    delay = (next_fetch - now).seconds
-                    LOGGER.info(f"Sleeping for {delay}s before name update...")
+                    delay = (next_fetch - now).total_seconds()
+                    LOGGER.info(f"Sleeping for {delay:.0f}s before name update...")
                     await asyncio.sleep(delay)
 
             # Log update time
@@ -579,38 +1479,77 @@ def create_name_dictionary_task():
 
             # Run update
             LOGGER.info("Updating equip name dictionary...")
-            words = tally_words(db)
+            with db:
+                num_changes = apply_name_log(db)
+            db.close()
+            # (Each api worker rebuilds its spellcheck index when it sees the new DICTIONARY_VERSION_KEY)
+            LOGGER.info(f"Dictionary update complete ({num_changes} name changes)")
 
-            db.execute("DELETE FROM equip_words")
-            for word, count in words.items():
-                db.execute(
-                    """
-                    INSERT INTO equip_words (
-                        word, count
-                    ) VALUES (
-                        ?, ?
-                    )
-                    """,
-                    [word, count],
-                )
+    return poll_ranges()
+
+
+def create_db_analyze_task():
+    async def poll_analyze():
+        while True:
+            db = init_db()
+
+            last_update = select_metadata(db, "last_db_analyze")
+
+            # Calculate next update
+            if last_update:
+                last_update = datetime.datetime.fromisoformat(last_update)
+                next_update = last_update + datetime.timedelta(seconds=DB_ANALYZE_DELAY)
+                now = datetime.datetime.now()
+
+                if now < next_update:
+                    delay = (next_update - now).total_seconds()
+                    LOGGER.info(f"Sleeping for {delay:.0f}s before db analyze...")
+                    await asyncio.sleep(delay)
+
+            # Log update time
+            now = datetime.datetime.now()
+            insert_metadata(db, "last_db_analyze", now.isoformat())
             db.commit()
-            LOGGER.info("Dictionary update complete")
 
-    def tally_words(db: Db):
-        rs: list[dict[str, str]] = db.execute(
-            """
-            SELECT json_extract(data, '$.name') name
-            FROM equips
-            """
-        ).fetchall()
+            # Run update
+            LOGGER.info("Analyzing db...")
+            analyze_db(db)
+            db.close()
+            LOGGER.info("Db analyze complete")
 
-        all_words = dict()
-        for r in rs:
-            words = r["name"].split()
-            for w in words:
-                all_words.setdefault(w, 0)
-                all_words[w] += 1
+    return poll_analyze()
 
-        return all_words
 
-    return poll_ranges()
+def create_export_task():
+    async def poll_exports():
+        last_build = None
+
+        while True:
+            # Rebuild if the data changed (but not too often, since /equip writes to an exported table)
+            snapshot = exports.latest_sqlite_export()
+
+            with ro_db_pool.connection() as db:
+                version = select_export_version(db)
+
+            is_stale = snapshot is None or snapshot.version != version
+            is_due = (
+                last_build is None
+                or (datetime.datetime.now() - last_build).total_seconds()
+                >= EXPORT_REBUILD_DELAY
+            )
+
+            if is_stale and is_due:
+                LOGGER.info(f"Building exports for version {version}...")
+                last_build = datetime.datetime.now()
+                try:
+                    await asyncio.to_thread(exports.build_sqlite_export)
+                except Exception:
+                    LOGGER.exception("Export build failed")
+
+                with db_pool.connection() as db:
+                    num_compacted = compact_change_log(db)
+                LOGGER.info(f"Compacted {num_compacted} export changes")
+
+            await asyncio.sleep(EXPORT_POLL_DELAY)
+
+    return poll_exports()
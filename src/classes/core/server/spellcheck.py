@@ -0,0 +1,120 @@
+import threading
+from functools import lru_cache
+
+from Levenshtein import distance
+
+from classes.db import DICTIONARY_VERSION_KEY, Db, select_metadata
+
+# Number of corrections cached per index
+CORRECTION_CACHE_SIZE = 4096
+
+
+class BkTree:
+    """Nearest-word lookup by Levenshtein distance
+
+    Each child of a node is keyed by its distance to that node,
+    so by the triangle inequality only children within (d - best, d + best) can contain a closer word.
+    """
+
+    def __init__(self, words: dict[str, int]):
+        # Nodes are [word, count, children]
+        self.root: list | None = None
+        self.size = 0
+
+        # Insert common words first so they end up near the root
+        for word, count in sorted(words.items(), key=lambda x: -x[1]):
+            self._insert(word, count)
+
+    def nearest(self, word: str) -> str | None:
+        """Closest word, with ties going to the more common one"""
+
+        if self.root is None:
+            return None
+
+        best_word = None
+        best_dist = float("inf")
+        best_count = -1
+
+        stack = [self.root]
+        while stack:
+            node_word, node_count, children = stack.pop()
+
+            d = distance(word, node_word)
+            if d < best_dist or (d == best_dist and node_count > best_count):
+                best_word, best_dist, best_count = node_word, d, node_count
+
+            for edge, child in children.items():
+                if abs(edge - d) <= best_dist:
+                    stack.append(child)
+
+        return best_word
+
+    def _insert(self, word: str, count: int) -> None:
+        if self.root is None:
+            self.root = [word, count, dict()]
+            self.size += 1
+            return
+
+        node = self.root
+        while True:
+            d = distance(word, node[0])
+            if d == 0:
+                return
+
+            children = node[2]
+            if d not in children:
+                children[d] = [word, count, dict()]
+                self.size += 1
+                return
+            node = children[d]
+
+
+class SpellcheckIndex:
+    def __init__(self, words: dict[str, int], version: str | None):
+        self.tree = BkTree(words)
+        self.version = version
+
+        # Per-instance so a rebuild also discards stale corrections
+        self.correct = lru_cache(maxsize=CORRECTION_CACHE_SIZE)(self.tree.nearest)
+
+
+_index: SpellcheckIndex | None = None
+_build_lock = threading.Lock()
+
+
+def build_index(db: Db) -> SpellcheckIndex:
+    """Build an index from the current equip_words and make it the active one
+
+    The old index keeps serving requests until the new one is swapped in.
+    """
+
+    global _index
+
+    # Read version first so a concurrent dictionary update causes a rebuild on the next request rather than being missed
+    version = select_metadata(db, DICTIONARY_VERSION_KEY)
+    words = {
+        r["word"]: r["count"] for r in db.execute("SELECT word, count FROM equip_words")
+    }
+
+    index = SpellcheckIndex(words, version)
+    _index = index
+    return index
+
+
+def get_index(db: Db) -> SpellcheckIndex:
+    """Get the active index, (re)building it if equip_words changed since it was built
+
+    The change check is a single metadata lookup, so that processes that didn't run the dictionary update still pick it up.
+    """
+
+    index = _index
+    version = select_metadata(db, DICTIONARY_VERSION_KEY)
+    if index is not None and index.version == version:
+        return index
+
+    with _build_lock:
+        # Another request may have rebuilt while we waited
+        index = _index
+        if index is not None and index.version == version:
+            return index
+        return build_index(db)
@@ -1,17 +1,38 @@
+import datetime
+import queue
 import sqlite3
-from typing import TypeAlias
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Literal, TypeAlias
 
 from config import paths
+from utils.sql_trace import TracedConnection
 
 Db: TypeAlias = sqlite3.Connection
 
 
 def init_db() -> Db:
     db = sqlite3.connect(paths.DB_FILE)
+    return init_schema(db)
 
-    # db.execute("PRAGMA journal_mode=WAL")
 
-    db.row_factory = sqlite3.Row
+def bootstrap_db(fp: Path | str = paths.DB_FILE) -> None:
+    """Create the schema and switch to WAL mode
+
+    Meant to be run once at startup, before any DbPool connections are opened.
+    (WAL lets readers and a writer work concurrently and is persisted in the db file.)
+    """
+
+    db = init_schema(sqlite3.connect(fp))
+    db.execute("PRAGMA journal_mode = WAL")
+    db.close()
+
+
+def init_schema(db: Db) -> Db:
+    """Configure connection and create any missing tables / indices"""
+
+    _configure(db)
 
     # Super
     with db:
@@ -55,6 +76,8 @@ def init_db() -> Db:
             """
         )
 
+        _create_fts_index(db, "super_equips")
+
         db.execute(
             """
             CREATE TABLE IF NOT EXISTS super_mats (
@@ -135,6 +158,8 @@ def init_db() -> Db:
             """
         )
 
+        _create_fts_index(db, "kedama_equips")
+
         db.execute(
             """
             CREATE TABLE IF NOT EXISTS kedama_mats (
@@ -171,6 +196,44 @@ def init_db() -> Db:
             """
         )
 
+    # Super + Kedama
+    with db:
+        # Same shape for both auction types so they can be searched / sorted / paginated together
+        _create_view(
+            db,
+            "auction_equips",
+            """
+            CREATE VIEW auction_equips AS
+                SELECT
+                    'super' as source,
+                    se.rowid as equip_rowid,
+                    se.id, se.id_auction, se.name, se.eid, se.key, se.is_isekai, se.level, se.stats, se.price,
+                    se.next_bid as min_bid,
+                    se.buyer, se.seller,
+                    sa.id as auction_id,
+                    sa.end_time as auction_time,
+                    sa.is_complete as auction_is_complete,
+                    sa.title as auction_title,
+                    'S' || substr('000' || sa.title, -max(length(sa.title), 3)) as auction_title_short
+                FROM super_equips as se INNER JOIN super_auctions as sa
+                ON sa.id = se.id_auction
+            UNION ALL
+                SELECT
+                    'kedama' as source,
+                    ke.rowid as equip_rowid,
+                    ke.id, ke.id_auction, ke.name, ke.eid, ke.key, ke.is_isekai, ke.level, ke.stats, ke.price,
+                    ke.start_bid as min_bid,
+                    ke.buyer, ke.seller,
+                    ka.id as auction_id,
+                    ka.start_time as auction_time,
+                    ka.is_complete as auction_is_complete,
+                    ka.title as auction_title,
+                    'K' || substr('000' || ka.title_short, -max(length(ka.title_short), 3)) as auction_title_short
+                FROM kedama_equips as ke INNER JOIN kedama_auctions as ka
+                ON ka.id = ke.id_auction
+            """
+        )
+
     # Discord
     with db:
         db.execute(
@@ -296,26 +359,34 @@ def init_db() -> Db:
                 """
         )
 
+        _create_lottery_winners(db)
+        _create_lottery_user_stats(db)
+
         db.execute(
             """
             CREATE TABLE IF NOT EXISTS equips (
                 id              INTEGER         NOT NULL,
                 key             TEXT            NOT NULL,
+                is_isekai       INTEGER         NOT NULL    DEFAULT 0,
 
                 updated_at      TEXT            NOT NULL,
 
                 data            TEXT,           --json
+                html_hash       TEXT,           --sha256 of the html that data was parsed from
 
                 PRIMARY KEY (id, key)
             ) STRICT;
             """
         )
+        _add_column(db, "equips", "is_isekai INTEGER NOT NULL DEFAULT 0")
+        _add_column(db, "equips", "html_hash TEXT")
 
         db.execute(
             """
             CREATE TABLE IF NOT EXISTS equips_html (
                 id              INTEGER,
                 key             TEXT            NOT NULL,
+                is_isekai       INTEGER         NOT NULL    DEFAULT 0,
 
                 created_at      TEXT            NOT NULL,
 
@@ -323,6 +394,16 @@ def init_db() -> Db:
             ) STRICT;
             """
         )
+        _add_column(db, "equips_html", "is_isekai INTEGER NOT NULL DEFAULT 0")
+
+        db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS metadata (
+                key         TEXT        PRIMARY KEY,
+                value       TEXT        NOT NULL
+            ) STRICT;
+            """
+        )
 
         db.execute(
             """
@@ -332,17 +413,709 @@ def init_db() -> Db:
             ) STRICT;
             """
         )
+        _create_name_log(db)
+
+        create_token_bucket_tables(db)
+
+    with db:
+        _create_indexes(db)
+        _create_change_log(db)
+
+    return db
+
+
+# Tables included in the /export endpoints
+EXPORTED_TABLES = ['super_auctions', 'super_equips', 'super_mats', 'super_fails', 'kedama_auctions' ,'kedama_equips', 'kedama_mats', 'kedama_fails_item', 'lottery_weapon', 'lottery_armor', 'equips']  # fmt: skip
+
+
+def _create_change_log(db: Db) -> None:
+    """Create a log of the rows inserted / updated / deleted in EXPORTED_TABLES
+
+    Each change is numbered, so the latest number serves as a version for the exported data.
+    Rows are identified by their primary key (as a json array) since rowids differ between copies of the db.
+    """
+
+    is_new = (
+        db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'export_changes'"
+        ).fetchone()
+        is None
+    )
+
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS export_changes (
+            version         INTEGER     PRIMARY KEY AUTOINCREMENT,
+            table_name      TEXT        NOT NULL,
+            row_key         TEXT        NOT NULL,       --json
+            is_delete       INTEGER     NOT NULL
+        ) STRICT;
+        """
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_export_changes_row_key ON export_changes (table_name, row_key)"
+    )
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_export_changes_table_version ON export_changes (table_name, version)"
+    )
+
+    for table in EXPORTED_TABLES:
+        pk_cols = select_primary_key(db, table)
+        old_key = "json_array(" + ", ".join(f'old."{c}"' for c in pk_cols) + ")"
+        new_key = "json_array(" + ", ".join(f'new."{c}"' for c in pk_cols) + ")"
 
         db.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_changes_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO export_changes (table_name, row_key, is_delete) VALUES ('{table}', {new_key}, 0);
+            END;
             """
-            CREATE TABLE IF NOT EXISTS metadata (
-                key         TEXT        PRIMARY KEY,
-                value       TEXT        NOT NULL
-            ) STRICT;
+        )
+
+        db.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_changes_delete AFTER DELETE ON {table} BEGIN
+                INSERT INTO export_changes (table_name, row_key, is_delete) VALUES ('{table}', {old_key}, 1);
+            END;
             """
         )
 
-    return db
+        db.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_changes_update AFTER UPDATE ON {table} BEGIN
+                INSERT INTO export_changes (table_name, row_key, is_delete) SELECT '{table}', {old_key}, 1 WHERE {old_key} != {new_key};
+                INSERT INTO export_changes (table_name, row_key, is_delete) VALUES ('{table}', {new_key}, 0);
+            END;
+            """
+        )
+
+    # Log existing rows as inserts (once) so that syncing from version 0 gives a full copy
+    if is_new:
+        for table in EXPORTED_TABLES:
+            pk_cols = select_primary_key(db, table)
+            key = "json_array(" + ", ".join(f'"{c}"' for c in pk_cols) + ")"
+            db.execute(
+                f"""
+                INSERT INTO export_changes (table_name, row_key, is_delete)
+                SELECT '{table}', {key}, 0 FROM {table}
+                """
+            )
+
+
+def compact_change_log(db: Db) -> int:
+    """Delete changes that were superseded by a later change to the same row
+
+    Deltas only contain the latest state of each row, so this doesn't affect /export/changes for any version.
+    Returns the number of deleted changes.
+    """
+
+    with db:
+        cursor = db.execute(
+            """
+            DELETE FROM export_changes
+            WHERE version NOT IN (
+                SELECT MAX(version) FROM export_changes
+                GROUP BY table_name, row_key
+            )
+            """
+        )
+
+    return cursor.rowcount
+
+
+def select_primary_key(db: Db, table: str) -> list[str]:
+    columns = db.execute(f"PRAGMA table_info({table})").fetchall()
+    columns = sorted([c for c in columns if c["pk"] > 0], key=lambda c: c["pk"])
+    return [c["name"] for c in columns]
+
+
+def select_table_version(db: Db, table: str) -> int:
+    """Number of the latest change to one of EXPORTED_TABLES"""
+
+    r = db.execute(
+        "SELECT MAX(version) FROM export_changes WHERE table_name = ?", [table]
+    ).fetchone()
+    return r[0] or 0
+
+
+def select_export_version(db: Db) -> int:
+    """Number of the latest change to EXPORTED_TABLES (see _create_change_log)"""
+
+    r = db.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'export_changes'"
+    ).fetchone()
+    return r[0] if r else 0
+
+
+# Secondary indices for the search endpoints
+# Text columns are COLLATE NOCASE because WhereBuilder compares text case-insensitively
+# and sqlite only uses an index whose collation matches the comparison.
+# Number columns are compared as numbers, so their indices use the default (binary) collation.
+#
+# Bump INDEX_VERSION after editing this so existing dbs drop and rebuild their indices
+INDEX_VERSION = 3
+INDEXES = {
+    # Super
+    "idx_super_auctions_id": "super_auctions (id COLLATE NOCASE)",
+    "idx_super_auctions_end_time": "super_auctions (end_time)",
+    "idx_super_equips_id_auction": "super_equips (id_auction)",
+    "idx_super_equips_price": "super_equips (price)",
+    "idx_super_equips_buyer": "super_equips (buyer COLLATE NOCASE)",
+    "idx_super_equips_seller": "super_equips (seller COLLATE NOCASE)",
+    # Kedama
+    "idx_kedama_auctions_id": "kedama_auctions (id COLLATE NOCASE)",
+    "idx_kedama_auctions_start_time": "kedama_auctions (start_time)",
+    "idx_kedama_equips_id_auction": "kedama_equips (id_auction)",
+    "idx_kedama_equips_price": "kedama_equips (price)",
+    "idx_kedama_equips_buyer": "kedama_equips (buyer COLLATE NOCASE)",
+    "idx_kedama_equips_seller": "kedama_equips (seller COLLATE NOCASE)",
+    # Lottery
+    **{
+        f"idx_lottery_{type}_date": f"lottery_{type} (date)"
+        for type in ["weapon", "armor"]
+    },
+    "idx_lottery_winners_user": "lottery_winners (user COLLATE NOCASE, date)",
+    "idx_lottery_winners_date": "lottery_winners (date)",
+}
+
+
+def _create_indexes(db: Db) -> None:
+    version = select_metadata(db, "index_version")
+    if version == str(INDEX_VERSION):
+        return
+
+    # Drop everything from the previous version in case a definition changed
+    old_indexes = db.execute(
+        r"SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx\_%' ESCAPE '\'"
+    ).fetchall()
+    for (name,) in old_indexes:
+        db.execute(f'DROP INDEX "{name}"')
+
+    for name, definition in INDEXES.items():
+        db.execute(f'CREATE INDEX "{name}" ON {definition}')
+
+    insert_metadata(db, "index_version", str(INDEX_VERSION))
+
+
+def analyze_db(db: Db) -> None:
+    """Refresh the statistics the query planner uses to pick indices
+
+    Also merges the b-trees of the full-text indices, which fragment as rows are added.
+    """
+
+    with db:
+        # Sample at most ~1000 rows per index so this stays cheap as the db grows
+        db.execute("PRAGMA analysis_limit = 1000")
+        db.execute("ANALYZE")
+
+        for fts_table in ["super_equips_fts", "kedama_equips_fts"]:
+            db.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('optimize')")
+
+    db.execute("PRAGMA optimize")
+
+
+def _add_column(db: Db, table: str, definition: str) -> None:
+    """Add column to a table created by an older version of init_schema"""
+
+    name = definition.split()[0]
+    columns = [r[1] for r in db.execute(f"PRAGMA table_info({table})").fetchall()]
+    if name not in columns:
+        db.execute(f"ALTER TABLE {table} ADD COLUMN {definition}")
+
+
+def _configure(db: Db) -> None:
+    # Otherwise the REPLACE in "INSERT OR REPLACE" won't fire delete triggers (see _create_fts_index)
+    db.execute("PRAGMA recursive_triggers = ON")
+
+    db.row_factory = sqlite3.Row
+
+
+class DbPool:
+    """Bounded pool of reusable connections
+
+    Connections are opened lazily, up to size. When all of them are in use, callers block until one is returned.
+    Assumes the schema already exists (see bootstrap_db).
+
+    Args:
+        fp: Path to db
+        size: Max number of open connections
+        read_only: Open connections with mode=ro (writes will raise)
+        mmap_size: Bytes of the db file to memory-map (0 to disable)
+        cache_size: Page cache size per connection, in KiB
+        synchronous: How often to fsync. NORMAL is safe from corruption in WAL mode but may lose the last commits on power loss.
+        trace: Record the duration / rows / etc of each statement (see utils/sql_trace.py)
+    """
+
+    def __init__(
+        self,
+        fp: Path | str = paths.DB_FILE,
+        size: int = 8,
+        read_only: bool = False,
+        mmap_size: int = 256 * 1024**2,
+        cache_size: int = 16 * 1024,
+        synchronous: Literal["OFF", "NORMAL", "FULL"] = "NORMAL",
+        trace: bool = False,
+    ):
+        self.fp = fp
+        self.size = size
+        self.read_only = read_only
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+        self.synchronous = synchronous
+        self.trace = trace
+
+        self._idle: queue.LifoQueue[Db] = queue.LifoQueue()
+        self._open_count = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator[Db]:
+        db = self._acquire()
+        try:
+            yield db
+        finally:
+            self._release(db)
+
+    def close(self) -> None:
+        with self._lock:
+            while not self._idle.empty():
+                self._idle.get_nowait().close()
+                self._open_count -= 1
+
+    def _acquire(self) -> Db:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._open_count < self.size
+            if can_open:
+                self._open_count += 1
+
+        if can_open:
+            try:
+                return self._connect()
+            except:
+                with self._lock:
+                    self._open_count -= 1
+                raise
+        else:
+            return self._idle.get()
+
+    def _release(self, db: Db) -> None:
+        # Don't leak a half-finished transaction to the next user
+        if db.in_transaction:
+            db.rollback()
+
+        self._idle.put(db)
+
+    def _connect(self) -> Db:
+        factory = TracedConnection if self.trace else sqlite3.Connection
+
+        if self.read_only:
+            uri = f"{Path(self.fp).resolve().as_uri()}?mode=ro"
+            db = sqlite3.connect(
+                uri, uri=True, check_same_thread=False, factory=factory
+            )
+            db.execute("PRAGMA query_only = ON")
+        else:
+            db = sqlite3.connect(self.fp, check_same_thread=False, factory=factory)
+
+        _configure(db)
+        db.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        db.execute(f"PRAGMA cache_size = {-int(self.cache_size)}")
+        db.execute(f"PRAGMA synchronous = {self.synchronous}")
+
+        return db
+
+
+def _create_fts_index(db: Db, table: str) -> None:
+    """Create a full-text index (named {table}_fts) over the name column of an equips table
+
+    The index is external-content, meaning it stores no copy of the names and is kept in sync with the source table by triggers.
+    """
+    fts_table = f"{table}_fts"
+
+    existing = db.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+        [fts_table],
+    ).fetchone()
+
+    # Older dbs index whole words, which can't match fragments from the middle of a word
+    if existing and "trigram" not in existing[0]:
+        db.execute(f"DROP TABLE {fts_table}")
+        existing = None
+
+    is_new = existing is None
+
+    # Trigrams so that any fragment of 3+ chars can be matched, not just word prefixes (eg "staff" in "Quarterstaff")
+    db.execute(
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5 (
+            name,
+            content = '{table}',
+            content_rowid = 'rowid',
+            tokenize = 'trigram'
+        );
+        """
+    )
+
+    db.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_insert AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts_table} (rowid, name) VALUES (new.rowid, new.name);
+        END;
+        """
+    )
+
+    db.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_delete AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts_table} ({fts_table}, rowid, name) VALUES ('delete', old.rowid, old.name);
+        END;
+        """
+    )
+
+    db.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts_table}_update AFTER UPDATE OF name ON {table} BEGIN
+            INSERT INTO {fts_table} ({fts_table}, rowid, name) VALUES ('delete', old.rowid, old.name);
+            INSERT INTO {fts_table} (rowid, name) VALUES (new.rowid, new.name);
+        END;
+        """
+    )
+
+    # Backfill pre-existing rows
+    if is_new:
+        db.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+
+
+# Prizes of a lottery, as (place, expression for the quantity, expression for the item name)
+LOTTERY_PLACES = [
+    ("1", "1", '{row}."1_prize"'),
+    ("1b", "1", '{row}."1b_prize"'),
+    *[
+        (place, f"json_extract({{row}}.\"{place}_prize\", '$[0]')", f"json_extract({{row}}.\"{place}_prize\", '$[1]')")
+        for place in ["2", "3", "4", "5"]
+    ],
+]  # fmt: skip
+
+
+def _create_lottery_winners(db: Db) -> None:
+    """Create a table with a row per lottery winner, kept in sync with lottery_weapon / lottery_armor by triggers
+
+    (The lottery tables have a column per place, so finding a user's wins would otherwise mean checking six columns of every lottery)
+    """
+
+    is_new = (
+        db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'lottery_winners'"
+        ).fetchone()
+        is None
+    )
+
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS lottery_winners (
+            lottery_type    TEXT        NOT NULL,       --weapon / armor
+            lottery_id      INTEGER     NOT NULL,
+            place           TEXT        NOT NULL,       --1 / 1b / 2 / 3 / 4 / 5
+
+            user            TEXT        NOT NULL,
+            prize_qty       INTEGER     NOT NULL,
+            prize_name      TEXT,                       --null if the equip is no longer available
+            date            REAL        NOT NULL,
+
+            PRIMARY KEY (lottery_type, lottery_id, place)
+        ) STRICT;
+        """
+    )
+
+    def select_winners(type: str, row: str, from_clause: str) -> str:
+        selects = []
+        for place, qty, name in LOTTERY_PLACES:
+            user = f'{row}."{place}_user"'
+            selects.append(
+                f"""
+                SELECT '{type}', {row}.id, '{place}', {user}, {qty.format(row=row)}, {name.format(row=row)}, {row}.date
+                {from_clause} WHERE {user} IS NOT NULL
+                """
+            )
+        return " UNION ALL ".join(selects)
+
+    columns = "lottery_type, lottery_id, place, user, prize_qty, prize_name, date"
+    for type in ["weapon", "armor"]:
+        table = f"lottery_{type}"
+
+        db.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_winners_insert AFTER INSERT ON {table} BEGIN
+                INSERT INTO lottery_winners ({columns}) {select_winners(type, "new", "")};
+            END;
+            """
+        )
+
+        db.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_winners_delete AFTER DELETE ON {table} BEGIN
+                DELETE FROM lottery_winners WHERE lottery_type = '{type}' AND lottery_id = old.id;
+            END;
+            """
+        )
+
+        db.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_winners_update AFTER UPDATE ON {table} BEGIN
+                DELETE FROM lottery_winners WHERE lottery_type = '{type}' AND lottery_id = old.id;
+                INSERT INTO lottery_winners ({columns}) {select_winners(type, "new", "")};
+            END;
+            """
+        )
+
+    # Backfill pre-existing rows
+    if is_new:
+        for type in ["weapon", "armor"]:
+            table = f"lottery_{type}"
+            db.execute(
+                f"INSERT INTO lottery_winners ({columns}) {select_winners(type, table, f'FROM {table}')}"
+            )
+
+
+def _create_lottery_user_stats(db: Db) -> None:
+    """Create a rollup of lottery_winners with the number of wins and prizes per (user, place), kept up to date by triggers
+
+    Users are matched case-insensitively.
+    """
+
+    is_new = (
+        db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'lottery_user_stats'"
+        ).fetchone()
+        is None
+    )
+
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS lottery_user_stats (
+            user        TEXT        NOT NULL    COLLATE NOCASE,
+            place       TEXT        NOT NULL,
+
+            wins        INTEGER     NOT NULL,
+            quantity    INTEGER     NOT NULL,
+
+            PRIMARY KEY (user, place)
+        ) STRICT;
+        """
+    )
+
+    # (lottery_winners rows are only ever inserted / deleted)
+    db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS lottery_winners_stats_insert AFTER INSERT ON lottery_winners BEGIN
+            INSERT INTO lottery_user_stats (user, place, wins, quantity) VALUES (new.user, new.place, 1, new.prize_qty)
+            ON CONFLICT DO UPDATE SET wins = wins + 1, quantity = quantity + excluded.quantity;
+        END;
+        """
+    )
+
+    db.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS lottery_winners_stats_delete AFTER DELETE ON lottery_winners BEGIN
+            UPDATE lottery_user_stats SET wins = wins - 1, quantity = quantity - old.prize_qty
+            WHERE user = old.user AND place = old.place;
+
+            DELETE FROM lottery_user_stats WHERE user = old.user AND place = old.place AND wins <= 0;
+        END;
+        """
+    )
+
+    # Backfill pre-existing rows
+    if is_new:
+        db.execute(
+            """
+            INSERT INTO lottery_user_stats (user, place, wins, quantity)
+            SELECT user, place, COUNT(*), SUM(prize_qty) FROM lottery_winners
+            GROUP BY user COLLATE NOCASE, place
+            """
+        )
+
+
+# Sources for equip_words, as (table, expression for the equip name)
+NAME_SOURCES = [
+    ("super_equips", "{row}.name"),
+    ("kedama_equips", "{row}.name"),
+    ("equips", "json_extract({row}.data, '$.name')"),
+]
+
+
+# Bumped whenever equip_words changes (see spellcheck.get_index)
+DICTIONARY_VERSION_KEY = "name_dictionary_version"
+
+
+def _create_name_log(db: Db) -> None:
+    """Create a log of equip names added to / removed from the NAME_SOURCES tables
+
+    Each row is a name and a delta of +1 or -1, so equip_words can be updated from just the rows added since the last update.
+    """
+
+    is_new = (
+        db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'equip_name_log'"
+        ).fetchone()
+        is None
+    )
+
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS equip_name_log (
+            id          INTEGER     PRIMARY KEY AUTOINCREMENT,
+            name        TEXT        NOT NULL,
+            delta       INTEGER     NOT NULL
+        ) STRICT;
+        """
+    )
+
+    for table, expr in NAME_SOURCES:
+        old_name = expr.format(row="old")
+        new_name = expr.format(row="new")
+
+        db.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_name_log_insert AFTER INSERT ON {table}
+            WHEN {new_name} IS NOT NULL BEGIN
+                INSERT INTO equip_name_log (name, delta) VALUES ({new_name}, 1);
+            END;
+            """
+        )
+
+        db.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_name_log_delete AFTER DELETE ON {table}
+            WHEN {old_name} IS NOT NULL BEGIN
+                INSERT INTO equip_name_log (name, delta) VALUES ({old_name}, -1);
+            END;
+            """
+        )
+
+        db.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_name_log_update AFTER UPDATE ON {table}
+            WHEN {old_name} IS NOT {new_name} BEGIN
+                INSERT INTO equip_name_log (name, delta) SELECT {old_name}, -1 WHERE {old_name} IS NOT NULL;
+                INSERT INTO equip_name_log (name, delta) SELECT {new_name}, 1 WHERE {new_name} IS NOT NULL;
+            END;
+            """
+        )
+
+    # Recount from scratch (once) since equip_words may have been built from a different set of tables
+    if is_new:
+        db.execute("DELETE FROM equip_words")
+        for table, expr in NAME_SOURCES:
+            name = expr.format(row=table)
+            db.execute(
+                f"""
+                INSERT INTO equip_name_log (name, delta)
+                SELECT {name}, 1 FROM {table}
+                WHERE {name} IS NOT NULL
+                """
+            )
+        # Refill now rather than at the next name update, so spellcheck isn't left empty until then
+        apply_name_log(db)
+
+
+def apply_name_log(db: Db) -> int:
+    """Apply the name changes logged since the last update to equip_words
+
+    Doesn't commit, so that the caller can make this part of a larger transaction.
+
+    Returns:
+        Number of log entries applied
+    """
+
+    position = int(select_metadata(db, "name_log_position") or 0)
+    rs = db.execute(
+        """
+        SELECT id, name, delta FROM equip_name_log
+        WHERE id > ?
+        """,
+        [position],
+    )
+
+    deltas: dict[str, int] = dict()
+    num_changes = 0
+    for r in rs:
+        for w in r["name"].split():
+            deltas.setdefault(w, 0)
+            deltas[w] += r["delta"]
+
+        position = max(position, r["id"])
+        num_changes += 1
+
+    if not num_changes:
+        return 0
+
+    db.executemany(
+        """
+        INSERT INTO equip_words (
+            word, count
+        ) VALUES (
+            ?, ?
+        ) ON CONFLICT (word) DO UPDATE SET count = count + excluded.count
+        """,
+        [(w, d) for w, d in deltas.items() if d != 0],
+    )
+    db.execute("DELETE FROM equip_words WHERE count <= 0")
+
+    # Entries logged after the select above are left for the next update
+    db.execute("DELETE FROM equip_name_log WHERE id <= ?", [position])
+    insert_metadata(db, "name_log_position", str(position))
+    insert_metadata(db, DICTIONARY_VERSION_KEY, datetime.datetime.now().isoformat())
+
+    return num_changes
+
+
+def create_token_bucket_tables(db: Db) -> None:
+    """Create the tables for classes/hv_limiter.py
+
+    (Separate from init_schema() since the limiter only needs these)
+    """
+
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS token_buckets (
+            name        TEXT        PRIMARY KEY,
+            tokens      REAL        NOT NULL,
+            updated_at  REAL        NOT NULL
+        ) STRICT;
+        """
+    )
+    # (Only holds callers currently waiting, so it's small enough to scan)
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS token_bucket_waiters (
+            -- (AUTOINCREMENT so that ids, which set the order of the queue, are never reused)
+            id          INTEGER     PRIMARY KEY AUTOINCREMENT,
+            bucket      TEXT        NOT NULL,
+            priority    INTEGER     NOT NULL,
+            heartbeat   REAL        NOT NULL
+        ) STRICT;
+        """
+    )
+
+
+def _create_view(db: Db, name: str, sql: str) -> None:
+    """Create a view, or recreate it if its definition changed (eg in an older version of this file)"""
+
+    existing = db.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'view' AND name = ?", [name]
+    ).fetchone()
+    # (sqlite stores the statement without the surrounding whitespace)
+    if existing is not None and existing[0] == sql.strip():
+        return
+
+    db.execute(f"DROP VIEW IF EXISTS {name}")
+    db.execute(sql)
 
 
 def select_metadata(db: Db, key: str, default: str | None = None) -> str | None:
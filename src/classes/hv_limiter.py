@@ -0,0 +1,203 @@
+"""Token bucket for requests to HV / e-hentai, shared by the api workers, scrapers, and discord bot
+
+The bucket and the queue of waiting callers live in the db, and every change to them is made in a
+BEGIN IMMEDIATE transaction, so the limit holds across processes without two callers taking the same token.
+
+Waiting callers are served by priority, then in the order they arrived.
+A caller that stops polling (eg its process was killed) is dropped from the queue after STALE_WAITER_SECONDS.
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from enum import IntEnum
+from pathlib import Path
+
+from classes.db import Db, create_token_bucket_tables
+from config import paths
+
+# One request per HV_FETCH_DELAY_SECONDS, without bursts (see hv_bucket)
+HV_FETCH_DELAY_SECONDS = 0.5
+
+# How often a queued caller re-checks the bucket, at most / at least
+MIN_POLL_SECONDS = 0.05
+MAX_POLL_SECONDS = 1
+STALE_WAITER_SECONDS = 10
+
+# Seconds to wait for another process's transaction before raising "database is locked"
+LOCK_TIMEOUT_SECONDS = 30
+
+
+class Priority(IntEnum):
+    # Someone is waiting on the result (eg /equip, bounty previews)
+    INTERACTIVE = 0
+    # Refreshes, scrapers
+    BACKGROUND = 1
+
+
+class TokenBucket:
+    """
+    Args:
+        name: Buckets with the same name (in any process) share tokens
+        rate: Tokens added per second
+        capacity: Max tokens (ie the largest burst)
+        fp: Path to db
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        capacity: float = 1,
+        fp: Path | str = paths.DB_FILE,
+    ):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.fp = fp
+
+        # Opened lazily, and shared by the threads of this process
+        self._db: Db | None = None
+        self._lock = threading.Lock()
+
+    async def acquire(self, priority: Priority = Priority.BACKGROUND) -> float:
+        """Wait for a token
+
+        Returns:
+            Seconds waited
+        """
+
+        start = time.time()
+        waiter_id = await asyncio.to_thread(self._enqueue, priority)
+
+        try:
+            while True:
+                delay = await asyncio.to_thread(self._try_take, waiter_id, priority)
+                if delay is None:
+                    # Dropped as stale (eg the event loop was blocked), so rejoin at the back
+                    waiter_id = await asyncio.to_thread(self._enqueue, priority)
+                elif delay == 0:
+                    return time.time() - start
+                else:
+                    await asyncio.sleep(delay)
+        except BaseException:
+            # Shielded so that the waiter is still removed if this task is cancelled again
+            await asyncio.shield(asyncio.to_thread(self._dequeue, waiter_id))
+            raise
+
+    def select_queue_depths(self, db: Db) -> dict[Priority, int]:
+        """Number of callers waiting for a token (in all processes), by priority"""
+
+        rows = db.execute(
+            """
+            SELECT priority, COUNT(*) FROM token_bucket_waiters
+            WHERE bucket = ? AND heartbeat >= ?
+            GROUP BY priority
+            """,
+            [self.name, time.time() - STALE_WAITER_SECONDS],
+        ).fetchall()
+
+        depths = {priority: 0 for priority in Priority}
+        depths.update({Priority(r[0]): r[1] for r in rows})
+        return depths
+
+    def _enqueue(self, priority: Priority) -> int:
+        with self._lock:
+            db = self._connect()
+            with db:
+                cursor = db.execute(
+                    """
+                    INSERT INTO token_bucket_waiters (bucket, priority, heartbeat)
+                    VALUES (?, ?, ?)
+                    """,
+                    [self.name, int(priority), time.time()],
+                )
+                return cursor.lastrowid  # type: ignore
+
+    def _dequeue(self, waiter_id: int) -> None:
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute("DELETE FROM token_bucket_waiters WHERE id = ?", [waiter_id])
+
+    def _try_take(self, waiter_id: int, priority: Priority) -> float | None:
+        """Take a token if it's this waiter's turn
+
+        Returns:
+            0 if a token was taken, None if the waiter is no longer queued,
+            otherwise the seconds to wait before trying again
+        """
+
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.execute("BEGIN IMMEDIATE")
+                now = time.time()
+
+                cursor = db.execute(
+                    "UPDATE token_bucket_waiters SET heartbeat = ? WHERE id = ?",
+                    [now, waiter_id],
+                )
+                if cursor.rowcount == 0:
+                    return None
+
+                db.execute(
+                    "DELETE FROM token_bucket_waiters WHERE bucket = ? AND heartbeat < ?",
+                    [self.name, now - STALE_WAITER_SECONDS],
+                )
+
+                # Waiters ahead of this one
+                (num_ahead,) = db.execute(
+                    """
+                    SELECT COUNT(*) FROM token_bucket_waiters
+                    WHERE bucket = ? AND (priority, id) < (?, ?)
+                    """,
+                    [self.name, int(priority), waiter_id],
+                ).fetchone()
+
+                tokens = self._refill(db, now)
+                if num_ahead == 0 and tokens >= 1:
+                    self._update(db, tokens - 1, now)
+                    db.execute(
+                        "DELETE FROM token_bucket_waiters WHERE id = ?", [waiter_id]
+                    )
+                    return 0
+
+                self._update(db, tokens, now)
+
+            # Roughly when the waiters ahead will have been served
+            delay = (num_ahead + 1 - tokens) / self.rate
+            return min(max(delay, MIN_POLL_SECONDS), MAX_POLL_SECONDS)
+
+    def _refill(self, db: Db, now: float) -> float:
+        row = db.execute(
+            "SELECT tokens, updated_at FROM token_buckets WHERE name = ?",
+            [self.name],
+        ).fetchone()
+        if row is None:
+            return self.capacity
+
+        tokens, updated_at = row
+        # (max() in case the clock went backwards)
+        elapsed = max(now - updated_at, 0)
+        return min(tokens + elapsed * self.rate, self.capacity)
+
+    def _update(self, db: Db, tokens: float, now: float) -> None:
+        db.execute(
+            "INSERT OR REPLACE INTO token_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+            [self.name, tokens, now],
+        )
+
+    def _connect(self) -> Db:
+        if self._db is None:
+            db = sqlite3.connect(
+                self.fp, timeout=LOCK_TIMEOUT_SECONDS, check_same_thread=False
+            )
+            with db:
+                create_token_bucket_tables(db)
+            self._db = db
+        return self._db
+
+
+hv_bucket = TokenBucket("hv", rate=1 / HV_FETCH_DELAY_SECONDS)
@@ -8,6 +8,7 @@ from bs4 import BeautifulSoup
 from yarl import URL
 
 from classes.db import init_db
+from classes.hv_limiter import Priority, hv_bucket
 from config import logger, paths
 from utils.http import create_session, do_get
 from utils.json_cache import JsonCache
@@ -78,7 +79,7 @@ class LotteryScraper:
                         # assert start_date.day == data["day"]
                         data["date"] = start_date.timestamp()
 
-                        # Insert into DB
+                        # Insert into DB (which also adds a row per winner to lottery_winners)
                         db = init_db()
                         with db:
                             db.execute(
@@ -123,6 +124,7 @@ class LotteryScraper:
                 url = URL("http://alt.hentaiverse.org") % dict(
                     s="Bazaar", ss=ss, lottery=id
                 )
+                await hv_bucket.acquire(Priority.BACKGROUND)
                 html: str = await do_get(url, session=session, content_type="text")
 
                 # If fetch not successful, we're probably in-battle
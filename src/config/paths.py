@@ -8,6 +8,8 @@ DATA_DIR = SRC_DIR / "data"
 CACHE_DIR = DATA_DIR / "cache"
 LOG_DIR = DATA_DIR / "logs"
 PERMS_DIR = DATA_DIR / "perms"
+# Per-worker metrics of the running server (see metrics.share)
+METRICS_DIR = DATA_DIR / "metrics"
 
 DB_FILE = DATA_DIR / "db.sqlite"
 RANGES_FILE = DATA_DIR / "ranges.json"
@@ -1,27 +1,34 @@
-import asyncio
+import os
+import shutil
 
-from uvicorn import Config, Server
+import uvicorn
 
-from classes.core.server.server import (
-    create_name_dictionary_task,
-    create_range_update_task,
-)
+from classes.core.server import metrics
+from classes.core.server.scheduler import Scheduler
+from classes.db import bootstrap_db
+from config import paths
+
+# Api processes (the periodic jobs run in one more, see scheduler.py)
+NUM_WORKERS = os.cpu_count() or 1
 
 if __name__ == "__main__":
 
-    loop = asyncio.new_event_loop()
+    # Once, before the workers start, so that they don't race to create / backfill tables
+    bootstrap_db()
+
+    # Each worker writes its metrics here, so that /metrics can add them up (the old run's are discarded)
+    shutil.rmtree(paths.METRICS_DIR, ignore_errors=True)
+    os.environ[metrics.SHARED_DIR_ENV_VAR] = str(paths.METRICS_DIR)
 
-    loop.create_task(create_range_update_task())
-    loop.create_task(create_name_dictionary_task())
+    scheduler = Scheduler()
+    scheduler.start()
 
-    server = Server(
-        config=Config(
-            app="classes.core.server.server:server",
-            loop=loop,  # type: ignore
+    try:
+        uvicorn.run(
+            "classes.core.server.server:server",
             host="0.0.0.0",
             port=4545,
-            workers=1,
+            workers=NUM_WORKERS,
         )
-    )
-
-    loop.run_until_complete(server.serve())
+    finally:
+        scheduler.stop()
@@ -0,0 +1,137 @@
+import asyncio
+import datetime
+import json
+import sqlite3
+
+import pytest
+from fastapi import BackgroundTasks, HTTPException, Response
+
+from classes.core.server import equip_parser, infer_equip_stats
+from classes.core.server import server as server_module
+from classes.core.server.server import (
+    EQUIP_BATCH_LIMIT,
+    EQUIP_CACHE_TTL_SECONDS,
+    EquipRef,
+    get_equip,
+    get_equips_batch,
+)
+from classes.db import DbPool, init_schema
+
+
+@pytest.fixture
+def hv(tmp_path, monkeypatch):
+    """Fake HV, which counts the fetches / parses"""
+
+    fp = tmp_path / "db.sqlite"
+    init_schema(sqlite3.connect(fp)).close()
+    monkeypatch.setattr(server_module, "db_pool", DbPool(fp))
+    monkeypatch.setattr(server_module, "ro_db_pool", DbPool(fp, read_only=True))
+
+    state = dict(html="<html>1</html>", fetches=0, parses=0, missing={3})
+
+    async def acquire(priority):
+        return 0
+
+    async def fetch_equip_html(eid, key, is_isekai):
+        # No search connections are held while waiting on HV
+        pool = server_module.ro_db_pool
+        assert pool._open_count == pool._idle.qsize()
+
+        state["fetches"] += 1
+        if eid in state["missing"]:
+            return 200, "No such equip"
+        return 200, state["html"]
+
+    def parse_equip_html(html):
+        state["parses"] += 1
+        return dict(html=html)
+
+    monkeypatch.setattr(server_module.hv_bucket, "acquire", acquire)
+    monkeypatch.setattr(equip_parser, "fetch_equip_html", fetch_equip_html)
+    monkeypatch.setattr(equip_parser, "parse_equip_html", parse_equip_html)
+    monkeypatch.setattr(infer_equip_stats, "infer_equip_stats", lambda data: dict())
+
+    state["db"] = init_schema(sqlite3.connect(fp))
+    return state
+
+
+def _get(hv: dict, refresh: bool = False) -> tuple[dict, BackgroundTasks]:
+    background_tasks = BackgroundTasks()
+    resp = asyncio.run(get_equip(1, "abcdefghij", background_tasks, refresh=refresh))
+    if isinstance(resp, Response):
+        resp = json.loads(resp.body)
+    return resp, background_tasks
+
+
+def _set_age(hv: dict, seconds: float):
+    updated_at = datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+    with hv["db"]:
+        hv["db"].execute("UPDATE equips SET updated_at = ?", [updated_at.isoformat()])
+
+
+def test_ttl(hv):
+    data, _ = _get(hv)
+    assert data["html"] == "<html>1</html>"
+    assert hv["fetches"] == 1
+
+    # Within the TTL, the stored data is returned without a fetch
+    data, background_tasks = _get(hv)
+    assert data["html"] == "<html>1</html>"
+    assert hv["fetches"] == 1
+    assert not background_tasks.tasks
+
+    # Unless a refresh is requested
+    hv["html"] = "<html>2</html>"
+    data, _ = _get(hv, refresh=True)
+    assert data["html"] == "<html>2</html>"
+    assert hv["fetches"] == 2
+
+
+def test_stale_while_revalidate(hv):
+    _get(hv)
+    hv["html"] = "<html>2</html>"
+    _set_age(hv, EQUIP_CACHE_TTL_SECONDS + 1)
+
+    # Stale data is returned immediately, with a refetch queued
+    data, background_tasks = _get(hv)
+    assert data["html"] == "<html>1</html>"
+    assert hv["fetches"] == 1
+    assert len(background_tasks.tasks) == 1
+
+    asyncio.run(background_tasks())
+    assert hv["fetches"] == 2
+
+    data, _ = _get(hv)
+    assert data["html"] == "<html>2</html>"
+
+
+def test_unchanged_html(hv):
+    _get(hv)
+    _set_age(hv, EQUIP_CACHE_TTL_SECONDS + 1)
+
+    # Same page, so it isn't parsed again, but it counts as fresh
+    _get(hv, refresh=True)
+    assert (hv["fetches"], hv["parses"]) == (2, 1)
+
+    _, background_tasks = _get(hv)
+    assert not background_tasks.tasks
+
+
+def test_batch(hv):
+    _get(hv)
+    hv["html"] = "<html>2</html>"
+
+    refs = [EquipRef(eid=eid, key="abcdefghij") for eid in [1, 2, 3]]
+    results = asyncio.run(get_equips_batch(refs, BackgroundTasks()))
+
+    # Stored, fetched, missing
+    assert [(r["eid"], r["status"]) for r in results] == [(1, 200), (2, 200), (3, 404)]
+    assert results[0]["data"]["html"] == "<html>1</html>"
+    assert results[1]["data"]["html"] == "<html>2</html>"
+    assert results[2]["data"] is None
+    assert hv["fetches"] == 3
+
+    refs = [EquipRef(eid=eid, key="abcdefghij") for eid in range(EQUIP_BATCH_LIMIT + 1)]
+    with pytest.raises(HTTPException) as e:
+        asyncio.run(get_equips_batch(refs, BackgroundTasks()))
+    assert e.value.status_code == 400
@@ -1,8 +1,12 @@
+import json
+import os
 from test.stubs import equip_html
 from test.stubs.equip_html.ranges import TEST_RANGES
 
+from classes.core.server import infer_equip_stats as ies
 from classes.core.server.equip_parser import parse_equip_html
 from classes.core.server.infer_equip_stats import infer_equip_stats
+from config import paths
 
 
 def test_equip_parsing():
@@ -47,3 +51,52 @@ def test_equip_inference():
                     assert (
                         diff_percent <= 0.05
                     ), f"{cat} {stat} {base_value} {actual_percent:.1%} {expected_percent:.1%}"
+
+
+def test_range_index():
+    index = ies.RangeIndex(
+        {
+            "AXE": {
+                "Legendary": {
+                    "lastUpdate": 0,
+                    "Attack Damage": {"all | not!Slaughter": dict(min=1, max=2)},
+                }
+            },
+            "Axe": {"Peerless": {"Attack Damage": {"all | all": dict(min=3, max=4)}}},
+            "Cotton": {
+                "Cap": {
+                    "Legendary": {
+                        "Attack Damage": {"all | Slaughter": dict(min=5, max=6)}
+                    }
+                }
+            },
+        }
+    )
+
+    def find(category, slot, suffix):
+        path = dict(
+            quality="legendary",
+            prefix=None,
+            category=category,
+            slot=slot,
+            suffix=suffix,
+        )
+        return index.find_min_max(path, "Attack Damage")
+
+    assert find(None, "axe", None) == (1, 2)
+    assert find(None, "axe", "slaughter") is None
+    assert find("cotton", "cap", "slaughter") == (5, 6)
+    assert find("cotton", "cap", None) is None
+
+
+def test_range_index_reload(tmp_path, monkeypatch):
+    monkeypatch.setattr(paths, "RANGES_FILE", tmp_path / "ranges.json")
+    monkeypatch.setattr(ies, "_range_index", None)
+
+    paths.RANGES_FILE.write_text(json.dumps(TEST_RANGES))
+    index = ies.load_range_index()
+    assert ies.load_range_index() is index
+
+    paths.RANGES_FILE.write_text(json.dumps(dict()))
+    os.utime(paths.RANGES_FILE, ns=(0, index.mtime + 10**9))  # type: ignore
+    assert ies.load_range_index().tree == dict()
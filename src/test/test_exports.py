@@ -0,0 +1,197 @@
+import asyncio
+import json
+import sqlite3
+
+import pyarrow.ipc
+import pyarrow.parquet
+
+from classes.core.server import exports
+from classes.core.server import server as server_module
+from classes.db import (
+    EXPORTED_TABLES,
+    DbPool,
+    compact_change_log,
+    init_schema,
+    select_export_version,
+)
+
+
+def _insert_auction(db, id: str, title: str):
+    db.execute(
+        "INSERT OR REPLACE INTO super_auctions (id, title, end_time, is_complete, last_fetch_time) VALUES (?, ?, 0, 1, 0)",
+        [id, title],
+    )
+
+
+def _read_changes(pool: DbPool, since: int, until: int) -> list[dict]:
+    text = b"".join(exports.iter_changes(pool, since, until)).decode()
+    return [json.loads(line) for line in text.splitlines()]
+
+
+def test_changes_contain_latest_state(tmp_path):
+    fp = tmp_path / "db.sqlite"
+    db = init_schema(sqlite3.connect(fp))
+    pool = DbPool(fp, read_only=True)
+
+    with db:
+        _insert_auction(db, "1", "first")
+        _insert_auction(db, "2", "second")
+    since = select_export_version(db)
+
+    with db:
+        _insert_auction(db, "1", "first (edited)")
+        _insert_auction(db, "3", "third")
+        db.execute("DELETE FROM super_auctions WHERE id = '2'")
+        _insert_auction(db, "4", "fourth")
+        db.execute("DELETE FROM super_auctions WHERE id = '4'")
+    until = select_export_version(db)
+
+    def summarize(changes):
+        return sorted(
+            (
+                (c["op"], c["row"]["id"], c["row"]["title"])
+                if c["op"] == "upsert"
+                else (c["op"], c["key"]["id"], None)
+            )
+            for c in changes
+        )
+
+    expected = [
+        ("delete", "2", None),
+        ("delete", "4", None),
+        ("upsert", "1", "first (edited)"),
+        ("upsert", "3", "third"),
+    ]
+    assert summarize(_read_changes(pool, since, until)) == expected
+
+    # Compaction only drops superseded changes
+    assert compact_change_log(db) > 0
+    assert summarize(_read_changes(pool, since, until)) == expected
+    assert select_export_version(db) == until
+
+    pool.close()
+
+
+def test_sql_changes_replay(tmp_path):
+    fp = tmp_path / "db.sqlite"
+    db = init_schema(sqlite3.connect(fp))
+    pool = DbPool(fp, read_only=True)
+
+    with db:
+        _insert_auction(db, "1", "it's quoted")
+        _insert_auction(db, "2", "second")
+        db.execute("DELETE FROM super_auctions WHERE id = '2'")
+
+    copy = init_schema(sqlite3.connect(":memory:"))
+    with copy:
+        _insert_auction(copy, "2", "second")
+
+    script = b"".join(
+        exports.iter_changes(pool, 0, select_export_version(db), "sql")
+    ).decode()
+    copy.executescript(script)
+
+    for table in EXPORTED_TABLES:
+        original = [tuple(r) for r in db.execute(f"SELECT * FROM {table}")]
+        replayed = [tuple(r) for r in copy.execute(f"SELECT * FROM {table}")]
+        assert original == replayed
+
+    pool.close()
+
+
+def test_columnar_export_expands_json(tmp_path, monkeypatch):
+    monkeypatch.setattr(exports, "EXPORT_DIR", tmp_path / "exports")
+
+    fp = tmp_path / "db.sqlite"
+    db = init_schema(sqlite3.connect(fp))
+    pool = DbPool(fp, read_only=True)
+
+    with db:
+        _insert_auction(db, "1", "first")
+        db.executemany(
+            """
+            INSERT INTO super_equips (id, id_auction, name, eid, key, is_isekai, level, stats, price, bid_link, next_bid, buyer, seller)
+            VALUES (?, '1', 'Legendary Oak Staff', 1, 'abc', 0, 500, ?, 100, NULL, 0, NULL, 'seller')
+            """,
+            [
+                ["Eq1", json.dumps(["MDB 36%", "Holy EDB 73%"])],
+                ["Eq2", json.dumps(["MDB 40%"])],
+            ],
+        )
+
+    snapshot = exports.get_columnar_export(pool, "super_equips", "parquet")
+    data = pyarrow.parquet.read_table(snapshot.path).to_pydict()
+    assert data["stats.MDB"] == [36.0, 40.0]
+    assert data["stats.Holy EDB"] == [73.0, None]
+
+    # Cached until the table changes
+    assert exports.get_columnar_export(pool, "super_equips", "parquet") == snapshot
+    with db:
+        db.execute("UPDATE super_equips SET price = 200 WHERE id = 'Eq1'")
+    assert exports.get_columnar_export(pool, "super_equips", "parquet") != snapshot
+
+    pool.close()
+
+
+def test_columnar_export_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(exports, "EXPORT_DIR", tmp_path / "exports")
+    monkeypatch.setattr(exports, "BATCH_ROWS", 2)
+
+    fp = tmp_path / "db.sqlite"
+    db = init_schema(sqlite3.connect(fp))
+    pool = DbPool(fp, read_only=True)
+
+    # Keys that only show up in later batches, and a key with mixed types
+    levels = [1, 2, None, "Unassigned", 5]
+    with db:
+        db.executemany(
+            "INSERT INTO equips (id, key, updated_at, data) VALUES (?, 'abc', '', ?)",
+            [
+                [i, json.dumps(dict(level=level, extra=i if i >= 3 else None))]
+                for i, level in enumerate(levels)
+            ],
+        )
+
+    snapshot = exports.get_columnar_export(pool, "equips", "arrow")
+    with pyarrow.ipc.open_file(snapshot.path) as reader:
+        assert reader.num_record_batches == 3
+        data = reader.read_all().to_pydict()
+
+    assert data["id"] == [0, 1, 2, 3, 4]
+    assert data["data.level"] == ["1", "2", None, "Unassigned", "5"]
+    assert data["data.extra"] == [None, None, None, 3, 4]
+
+    pool.close()
+
+
+def test_streams_use_export_pool(tmp_path, monkeypatch):
+    fp = tmp_path / "db.sqlite"
+    db = init_schema(sqlite3.connect(fp))
+    with db:
+        _insert_auction(db, "1", "first")
+        _insert_auction(db, "2", "second")
+
+    ro_pool = DbPool(fp, read_only=True)
+    export_pool = DbPool(fp, read_only=True)
+    monkeypatch.setattr(server_module, "ro_db_pool", ro_pool)
+    monkeypatch.setattr(server_module, "export_db_pool", export_pool)
+    # Yield after every row, so that the stream is paused mid-read
+    monkeypatch.setattr(exports, "CHUNK_SIZE", 1)
+
+    async def read_first_chunk(response):
+        chunks = response.body_iterator
+        await chunks.__anext__()
+
+        # Search connections are all free while the export is being downloaded
+        assert ro_pool._open_count == ro_pool._idle.qsize()
+        assert export_pool._idle.qsize() == export_pool._open_count - 1
+
+        async for _ in chunks:
+            pass
+        assert export_pool._idle.qsize() == export_pool._open_count
+
+    asyncio.run(read_first_chunk(server_module.export_json(format="ndjson")))
+    asyncio.run(read_first_chunk(server_module.export_changes(since=0)))
+
+    ro_pool.close()
+    export_pool.close()
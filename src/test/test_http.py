@@ -0,0 +1,42 @@
+import asyncio
+
+from aiohttp import web
+
+from utils import http
+
+
+def test_conditional_get(monkeypatch):
+    monkeypatch.setattr(http, "_validator_cache", type(http._validator_cache)())
+    validators: list[str | None] = []
+
+    async def handler(request: web.Request) -> web.Response:
+        validators.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+        return web.Response(text="body", headers={"ETag": '"v1"'})
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # type: ignore
+        url = f"http://127.0.0.1:{port}/"
+
+        try:
+            # Not cached unless asked for
+            assert await http.do_get(url, content_type="text") == "body"
+            assert await http.do_get(url, content_type="text") == "body"
+
+            for _ in range(2):
+                assert (
+                    await http.do_get(url, content_type="text", conditional=True)
+                    == "body"
+                )
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+    assert validators == [None, None, None, '"v1"']
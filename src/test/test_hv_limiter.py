@@ -0,0 +1,85 @@
+import asyncio
+import sqlite3
+import time
+
+from classes.db import init_schema
+from classes.hv_limiter import Priority, TokenBucket
+
+
+def test_rate(tmp_path):
+    fp = tmp_path / "db.sqlite"
+    # Separate instances share the bucket like separate processes would
+    buckets = [TokenBucket("test", rate=20, fp=fp) for _ in range(2)]
+
+    async def run():
+        start = time.time()
+        await asyncio.gather(*[buckets[i % 2].acquire() for i in range(6)])
+        return time.time() - start
+
+    # First token is available immediately
+    assert asyncio.run(run()) >= 5 / 20
+
+
+def test_priority(tmp_path):
+    fp = tmp_path / "db.sqlite"
+    bucket = TokenBucket("test", rate=20, fp=fp)
+    other = TokenBucket("test", rate=20, fp=fp)
+    order = []
+
+    async def acquire(label: str, priority: Priority):
+        await other.acquire(priority)
+        order.append(label)
+
+    async def run():
+        await bucket.acquire()
+
+        background = [
+            asyncio.create_task(acquire(f"background_{i}", Priority.BACKGROUND))
+            for i in range(3)
+        ]
+        await asyncio.sleep(0.01)
+
+        db = init_schema(sqlite3.connect(fp))
+        assert bucket.select_queue_depths(db) == {
+            Priority.INTERACTIVE: 0,
+            Priority.BACKGROUND: 3,
+        }
+
+        await acquire("interactive", Priority.INTERACTIVE)
+        await asyncio.gather(*background)
+
+        assert bucket.select_queue_depths(db)[Priority.BACKGROUND] == 0
+
+    asyncio.run(run())
+    assert order.index("interactive") < 2
+
+
+def test_cancel(tmp_path):
+    fp = tmp_path / "db.sqlite"
+    bucket = TokenBucket("test", rate=1, fp=fp)
+
+    async def run():
+        await bucket.acquire()
+
+        task = asyncio.create_task(bucket.acquire())
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+    asyncio.run(run())
+
+    db = init_schema(sqlite3.connect(fp))
+    assert db.execute("SELECT COUNT(*) FROM token_bucket_waiters").fetchone()[0] == 0
+
+
+def test_creates_only_bucket_tables(tmp_path):
+    fp = tmp_path / "db.sqlite"
+    asyncio.run(TokenBucket("test", rate=1, fp=fp).acquire())
+
+    db = sqlite3.connect(fp)
+    tables = db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    assert {r[0] for r in tables} == {
+        "token_buckets",
+        "token_bucket_waiters",
+        "sqlite_sequence",
+    }
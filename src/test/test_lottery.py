@@ -0,0 +1,98 @@
+import sqlite3
+
+from classes.core.server.server import get_lottery_user_stats
+from classes.db import init_schema
+
+
+def _insert_lottery(db, type: str, id: int, user_2: str, core_user: str | None):
+    db.execute(
+        f"""
+        INSERT OR REPLACE INTO lottery_{type} (id, date, tickets, "1_prize", "1_user", "1b_prize", "1b_user", "2_prize", "2_user", "3_prize", "3_user", "4_prize", "4_user", "5_prize", "5_user")
+        VALUES (?, ?, 1000, 'Peerless Oak Staff of Heimdall', 'a', 'Equip Core', ?, '[20, "Chaos Token"]', ?, '[3, "Golden Lottery Ticket"]', 'c', '[1, "x"]', 'd', '[1, "x"]', 'e')
+        """,
+        [id, id * 100, core_user, user_2],
+    )
+
+
+def _select_winners(db) -> list[tuple]:
+    rows = db.execute(
+        """
+        SELECT lottery_type, lottery_id, place, user, prize_qty, prize_name, date
+        FROM lottery_winners
+        WHERE place IN ('1b', '2')
+        ORDER BY lottery_type, lottery_id, place
+        """
+    ).fetchall()
+    return [tuple(r) for r in rows]
+
+
+def test_winners_sync():
+    db = init_schema(sqlite3.connect(":memory:"))
+
+    with db:
+        _insert_lottery(db, "weapon", 1, "b", None)
+        _insert_lottery(db, "armor", 1, "b", "core")
+    assert _select_winners(db) == [
+        ("armor", 1, "1b", "core", 1, "Equip Core", 100),
+        ("armor", 1, "2", "b", 20, "Chaos Token", 100),
+        ("weapon", 1, "2", "b", 20, "Chaos Token", 100),
+    ]
+
+    with db:
+        _insert_lottery(db, "weapon", 1, "new", "core")
+        db.execute("DELETE FROM lottery_armor")
+    assert _select_winners(db) == [
+        ("weapon", 1, "1b", "core", 1, "Equip Core", 100),
+        ("weapon", 1, "2", "new", 20, "Chaos Token", 100),
+    ]
+    assert db.execute("SELECT COUNT(*) FROM lottery_winners").fetchone()[0] == 6
+
+
+def test_winners_backfill():
+    db = init_schema(sqlite3.connect(":memory:"))
+
+    # Db from before lottery_winners existed
+    with db:
+        _insert_lottery(db, "armor", 2, "b", None)
+        db.execute("DROP TABLE lottery_winners")
+        for type in ["weapon", "armor"]:
+            for op in ["insert", "delete", "update"]:
+                db.execute(f"DROP TRIGGER lottery_{type}_winners_{op}")
+
+    init_schema(db)
+    assert _select_winners(db) == [("armor", 2, "2", "b", 20, "Chaos Token", 200)]
+
+
+def test_user_stats():
+    db = init_schema(sqlite3.connect(":memory:"))
+
+    with db:
+        _insert_lottery(db, "weapon", 1, "User", None)
+        _insert_lottery(db, "armor", 1, "user", "User")
+        _insert_lottery(db, "armor", 2, "b", None)
+
+    # Rollup
+    assert get_lottery_user_stats("uSeR", db=db) == dict(
+        user="User",
+        places=[
+            dict(place="1b", wins=1, quantity=1),
+            dict(place="2", wins=2, quantity=40),
+        ],
+    )
+
+    # Aggregate over a date range
+    stats = get_lottery_user_stats("user", min_date=150, db=db)
+    assert stats["places"] == []
+    stats = get_lottery_user_stats("user", min_date=100, db=db)
+    assert stats["places"] == [
+        dict(place="1b", wins=1, quantity=1),
+        dict(place="2", wins=2, quantity=40),
+    ]
+
+    # Rollup is updated when a lottery is replaced
+    with db:
+        _insert_lottery(db, "weapon", 1, "b", None)
+    assert get_lottery_user_stats("user", db=db)["places"] == [
+        dict(place="1b", wins=1, quantity=1),
+        dict(place="2", wins=1, quantity=20),
+    ]
@@ -0,0 +1,92 @@
+import json
+import os
+import time
+
+from classes.core.server import metrics
+
+
+def test_histogram_quantiles():
+    hist = metrics.Histogram(metrics.LATENCY_BUCKETS, window=100)
+    for i in range(1, 101):
+        hist.observe(i / 1000)
+
+    assert hist.quantile(0.5) == 0.051
+    assert hist.quantile(0.99) == 0.1
+    assert hist.count == 100
+
+    # Bucket counts are per bucket, not cumulative
+    assert hist.counts[0] == 5
+    assert sum(hist.counts) == 100
+
+
+def test_render_phases():
+    metrics.reset()
+
+    phases = metrics.request_started("GET", "/test")
+    with metrics.timed("sql"):
+        pass
+    phases["handler"] = 0.5
+    phases["endpoint"] = 0.2
+    metrics.request_finished("GET", "/test", 200, 1.0, 123, phases)
+
+    text = metrics.render()
+    assert 'http_responses_total{method="GET",route="/test",status="200"} 1' in text
+    assert 'http_requests_in_flight{method="GET",route="/test"} 0' in text
+    assert (
+        'http_request_duration_seconds_bucket{method="GET",route="/test",le="+Inf"} 1'
+        in text
+    )
+    assert (
+        'http_request_phase_seconds_sum{method="GET",route="/test",phase="serialization"} 0.3'
+        in text
+    )
+    assert 'http_response_size_bytes_sum{method="GET",route="/test"} 123' in text
+
+    metrics.reset()
+
+
+def test_render_gauges(monkeypatch):
+    monkeypatch.setattr(metrics, "_gauges", dict())
+
+    def broken():
+        raise ValueError()
+
+    metrics.register_gauge("test_depth", "Test", lambda: {(("priority", "a"),): 2})
+    metrics.register_gauge("test_broken", "Test", broken)
+
+    text = metrics.render()
+    assert "# TYPE test_depth gauge" in text
+    assert 'test_depth{priority="a"} 2' in text
+    assert "# TYPE test_broken gauge" in text
+
+
+def test_render_shared(tmp_path, monkeypatch):
+    metrics.reset()
+    monkeypatch.setattr(metrics, "_shared_dir", tmp_path)
+
+    # Another worker, with a request still in flight
+    metrics.request_started("GET", "/test")
+    phases = metrics.request_started("GET", "/test")
+    metrics.request_finished("GET", "/test", 200, 1.0, 100, phases)
+    metrics.increment("test_total", result="hit")
+    (tmp_path / "1.json").write_text(json.dumps(metrics._snapshot()))
+
+    # One that exited
+    metrics._flush(tmp_path)
+    os.replace(tmp_path / f"{os.getpid()}.json", tmp_path / "2.json")
+    old = time.time() - metrics.STALE_WORKER_SECONDS - 1
+    os.utime(tmp_path / "2.json", (old, old))
+
+    # This one
+    metrics.reset()
+    phases = metrics.request_started("GET", "/test")
+    metrics.request_finished("GET", "/test", 200, 2.0, 50, phases)
+
+    text = metrics.render()
+    assert 'http_responses_total{method="GET",route="/test",status="200"} 3' in text
+    assert 'http_requests_in_flight{method="GET",route="/test"} 1' in text
+    assert 'http_request_duration_seconds_sum{method="GET",route="/test"} 4.0' in text
+    assert 'http_response_size_bytes_sum{method="GET",route="/test"} 250' in text
+    assert 'test_total{result="hit"} 2' in text
+
+    metrics.reset()
@@ -0,0 +1,80 @@
+import sqlite3
+
+from classes.core.server.server import get_super_equips, search_auction_equips
+from classes.db import init_schema
+
+NAMES = [
+    "Peerless Oak Staff of Heimdall",
+    "Legendary Ebony Quarterstaff of Destruction",
+    "Magnificent Shade Cap of the Fleet",
+]
+
+
+def _create_db() -> sqlite3.Connection:
+    db = init_schema(sqlite3.connect(":memory:"))
+
+    with db:
+        db.execute("INSERT INTO super_auctions VALUES ('1', '1', 100, 1, 0)")
+        for idx, name in enumerate(NAMES):
+            db.execute(
+                """
+                INSERT INTO super_equips (id, id_auction, name, eid, key, is_isekai, level, stats, price, bid_link, next_bid, buyer, seller)
+                VALUES (?, '1', ?, 1, 'abcdefghij', 0, 500, '[]', 1000, NULL, 0, 'buyer', 'seller')
+                """,
+                [f"Eq{idx}", name],
+            )
+
+    return db
+
+
+def _search(db, name: str) -> list[str]:
+    return sorted(r["name"] for r in get_super_equips(db=db, name=name))
+
+
+def test_substring():
+    db = _create_db()
+
+    # Start of one name's word, middle of another's
+    assert _search(db, "staff") == sorted(NAMES[:2])
+    assert _search(db, "dall") == [NAMES[0]]
+    assert _search(db, "ebon,QUARTER") == [NAMES[1]]
+    # Too short for the trigram index
+    assert _search(db, "ca,fl") == [NAMES[2]]
+    assert _search(db, "staff,xyz") == []
+
+    page = search_auction_equips(db=db, name="arterst")
+    assert [r["name"] for r in page["items"]] == [NAMES[1]]
+
+
+def test_old_index_upgrade():
+    db = _create_db()
+
+    # Word-based index from before trigrams
+    with db:
+        db.execute("DROP TABLE super_equips_fts")
+        db.execute("""
+            CREATE VIRTUAL TABLE super_equips_fts USING fts5 (
+                name, content = 'super_equips', content_rowid = 'rowid', prefix = '2 3 4'
+            )
+            """)
+        db.execute("INSERT INTO super_equips_fts (super_equips_fts) VALUES ('rebuild')")
+
+    init_schema(db)
+    assert _search(db, "dall") == [NAMES[0]]
+
+
+def test_outdated_view_is_recreated():
+    db = init_schema(sqlite3.connect(":memory:"))
+
+    def select_view_sql() -> str:
+        return db.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'view' AND name = 'auction_equips'"
+        ).fetchone()[0]
+
+    current = select_view_sql()
+    with db:
+        db.execute("DROP VIEW auction_equips")
+        db.execute("CREATE VIEW auction_equips AS SELECT 'super' as source")
+
+    init_schema(db)
+    assert select_view_sql() == current
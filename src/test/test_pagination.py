@@ -0,0 +1,98 @@
+import sqlite3
+
+import pytest
+from fastapi import HTTPException
+
+from classes.core.server.server import get_lottery, get_super_equips
+from classes.db import init_schema
+
+
+@pytest.fixture
+def db():
+    db = init_schema(sqlite3.connect(":memory:"))
+
+    with db:
+        for a in range(5):
+            db.execute(
+                "INSERT INTO super_auctions VALUES (?, ?, ?, 1, 0)",
+                [str(a), str(a), 100 + a],
+            )
+            for e in range(20):
+                # Repeated prices so that pages break in the middle of ties
+                db.execute(
+                    """
+                    INSERT INTO super_equips (id, id_auction, name, eid, key, is_isekai, level, stats, price, bid_link, next_bid, buyer, seller)
+                    VALUES (?, ?, 'Peerless Oak Staff of Heimdall', 1, 'abcdefghij', 0, ?, '["ADB 90%"]', ?, NULL, 0, 'buyer', 'seller')
+                    """,
+                    [f"Eq{e}", str(a), e % 3 or None, (e % 4) * 1000 or None],
+                )
+
+        for type in ["weapon", "armor"]:
+            for id in range(1, 31):
+                db.execute(
+                    f"""
+                    INSERT INTO lottery_{type} (id, date, tickets, "1_prize", "1_user", "1b_prize", "1b_user", "2_prize", "2_user", "3_prize", "3_user", "4_prize", "4_user", "5_prize", "5_user")
+                    VALUES (?, ?, 1000, 'Peerless Oak Staff of Heimdall', 'buyer', 'Equip Core', 'a', '[1, "x"]', 'b', '[1, "x"]', 'c', '[1, "x"]', 'd', '[1, "x"]', 'e')
+                    """,
+                    [id, 100 + id],
+                )
+
+    return db
+
+
+def read_pages(endpoint, **params) -> tuple[list[dict], set[int]]:
+    items = []
+    totals = set()
+
+    cursor = None
+    while True:
+        page = endpoint(**params, cursor=cursor)
+        items.extend(page["items"])
+        totals.add(page["total"])
+
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items, totals
+
+
+@pytest.mark.parametrize("sort", ["price", "time", "level"])
+@pytest.mark.parametrize("order", ["asc", "desc"])
+def test_super_pages(db, sort, order):
+    items, totals = read_pages(
+        get_super_equips, db=db, name="oak", sort=sort, order=order, limit=7
+    )
+
+    assert totals == {100}
+    assert len({(x["id"], x["id_auction"]) for x in items}) == 100
+
+    key = dict(
+        price=lambda x: x["price"] or 0,
+        time=lambda x: x["auction"]["end_time"],
+        level=lambda x: x["level"] or 0,
+    )[sort]
+    assert items == sorted(items, key=key, reverse=order == "desc")
+
+
+def test_lottery_pages(db):
+    items, totals = read_pages(get_lottery, db=db, limit=7, fields="lottery")
+
+    assert totals == {60}
+    assert len({(x["lottery"]["id"], x["lottery"]["type"]) for x in items}) == 60
+    assert all(list(x.keys()) == ["lottery"] for x in items)
+
+
+def test_projection(db):
+    page = get_super_equips(db=db, limit=1, fields="name,stats")
+    assert page["items"] == [
+        dict(name="Peerless Oak Staff of Heimdall", stats=["ADB 90%"])
+    ]
+
+    with pytest.raises(HTTPException):
+        get_super_equips(db=db, limit=1, fields="name,html")
+
+
+def test_cursor_sort_mismatch(db):
+    page = get_super_equips(db=db, sort="price", limit=1)
+
+    with pytest.raises(HTTPException):
+        get_super_equips(db=db, sort="level", cursor=page["next_cursor"])
@@ -0,0 +1,238 @@
+import itertools
+import re
+import sqlite3
+
+import pytest
+
+from classes.core.server.server import (
+    get_kedama_equips,
+    get_lottery,
+    get_super_equips,
+    search_auction_equips,
+)
+from classes.db import init_schema
+from utils.sql import WhereBuilder
+
+# Filters with a supporting index, and values that match the rows inserted by seed()
+# Every non-empty combination of these should be answerable without a table scan
+INDEXED_PARAMS = dict(
+    name=dict(name="oak,heimd"),
+    date=dict(min_date=50, max_date=150),
+    price=dict(min_price=500, max_price=1500),
+    buyer=dict(buyer="buyer"),
+    seller=dict(seller="seller"),
+    id_auction=dict(id_auction="1"),
+)
+
+# Filters that can't use an index on their own but may be combined with the above
+EXTRA_PARAMS = [
+    dict(),
+    dict(buyer_partial="buy", seller_partial="sell"),
+    dict(sort="price", limit=10, fields="name,price,auction"),
+]
+
+LOTTERY_INDEXED_PARAMS = dict(
+    date=dict(min_date=50, max_date=150),
+    user=dict(user="buyer"),
+)
+
+LOTTERY_EXTRA_PARAMS = [
+    dict(),
+    dict(equip="oak,heimd"),
+    dict(limit=10, fields="date,prizes"),
+]
+
+
+@pytest.fixture
+def db():
+    db = init_schema(sqlite3.connect(":memory:"))
+    seed(db)
+    return db
+
+
+def seed(db: sqlite3.Connection):
+    with db:
+        db.execute("""
+            INSERT INTO super_auctions (id, title, end_time, is_complete, last_fetch_time)
+            VALUES ('1', '1', 100, 1, 0)
+            """)
+        db.execute("""
+            INSERT INTO super_equips (id, id_auction, name, eid, key, is_isekai, level, stats, price, bid_link, next_bid, buyer, seller)
+            VALUES ('Eq01', '1', 'Peerless Oak Staff of Heimdall', 1, 'abcdefghij', 0, 500, '[]', 1000, NULL, 1100, 'buyer', 'seller')
+            """)
+        db.execute("""
+            INSERT INTO kedama_auctions (id, title_short, title, start_time, is_complete, last_fetch_time)
+            VALUES ('1', '1', '1', 100, 1, 0)
+            """)
+        db.execute("""
+            INSERT INTO kedama_equips (id, id_auction, name, eid, key, is_isekai, level, stats, price, start_bid, post_index, buyer, seller)
+            VALUES ('Eq01', '1', 'Peerless Oak Staff of Heimdall', 1, 'abcdefghij', 0, 500, '[]', 1000, 100, 1, 'buyer', 'seller')
+            """)
+        for type in ["weapon", "armor"]:
+            db.execute(f"""
+                INSERT INTO lottery_{type} (id, date, tickets, "1_prize", "1_user", "1b_prize", "1b_user", "2_prize", "2_user", "3_prize", "3_user", "4_prize", "4_user", "5_prize", "5_user")
+                VALUES (1, 100, 1000, 'Peerless Oak Staff of Heimdall', 'buyer', 'Equip Core', 'a', '[1, "x"]', 'b', '[1, "x"]', 'c', '[1, "x"]', 'd', '[1, "x"]', 'e')
+                """)
+
+
+def combinations(indexed: dict[str, dict], extras: list[dict]) -> list[dict]:
+    combos = []
+    for n in range(1, len(indexed) + 1):
+        for keys in itertools.combinations(indexed, n):
+            for extra in extras:
+                params = dict(extra)
+                for k in keys:
+                    params.update(indexed[k])
+                combos.append(params)
+    return combos
+
+
+def find_plans(db: sqlite3.Connection, endpoint, params: dict) -> dict[str, list[str]]:
+    """Call endpoint and return the query plan of each SELECT it ran"""
+
+    statements: list[str] = []
+    db.set_trace_callback(statements.append)
+    try:
+        result = endpoint(db=db, **params)
+    finally:
+        db.set_trace_callback(None)
+
+    # Sanity check that the filters are realistic, ie the full-text search didn't fall back to LIKE
+    assert len(result) > 0, params
+
+    plans = dict()
+    for stmt in statements:
+        if not stmt.lstrip().upper().startswith("SELECT"):
+            continue
+
+        plan = db.execute(f"EXPLAIN QUERY PLAN {stmt}").fetchall()
+        plans[stmt] = [row[3] for row in plan]
+
+    return plans
+
+
+def find_table_scans(db: sqlite3.Connection, endpoint, params: dict) -> list[str]:
+    """Call endpoint and return the table scans in the query plan of each statement it ran"""
+
+    scans = []
+    for stmt, plan in find_plans(db, endpoint, params).items():
+        for detail in plan:
+            # Full-text indices are virtual tables so their searches look like scans
+            # and scanning a view / subquery means reading its already-filtered rows
+            # (a CONSTANT ROW is a SELECT without a FROM, eg one that adds up subqueries)
+            if (
+                re.match(r"SCAN ", detail)
+                and "VIRTUAL TABLE" not in detail
+                and detail != "SCAN ae"
+                and detail != "SCAN CONSTANT ROW"
+                and not detail.startswith("SCAN (subquery")
+            ):
+                scans.append(f"{detail} -- {' '.join(stmt.split())}")
+
+    return scans
+
+
+@pytest.mark.parametrize(
+    "params",
+    combinations(INDEXED_PARAMS, [dict(complete=True), *EXTRA_PARAMS]),
+    ids=str,
+)
+def test_super_equips_plan(db, params):
+    assert find_table_scans(db, get_super_equips, params) == []
+
+
+@pytest.mark.parametrize("params", combinations(INDEXED_PARAMS, EXTRA_PARAMS), ids=str)
+def test_kedama_equips_plan(db, params):
+    assert find_table_scans(db, get_kedama_equips, params) == []
+
+
+@pytest.mark.parametrize(
+    "params",
+    combinations(INDEXED_PARAMS, [dict(complete=True), *EXTRA_PARAMS]),
+    ids=str,
+)
+def test_auction_equips_plan(db, params):
+    assert find_table_scans(db, search_auction_equips, params) == []
+
+
+@pytest.mark.parametrize(
+    "params",
+    combinations(LOTTERY_INDEXED_PARAMS, LOTTERY_EXTRA_PARAMS),
+    ids=str,
+)
+def test_lottery_plan(db, params):
+    assert find_table_scans(db, get_lottery, params) == []
+
+
+@pytest.mark.parametrize(
+    "endpoint,params,expected",
+    [
+        # Numbers are bound as numbers, so the (binary) numeric indices are searched by range
+        (
+            get_super_equips,
+            dict(min_date=50, max_date=150),
+            "SEARCH sa USING INDEX idx_super_auctions_end_time (end_time>? AND end_time<?)",
+        ),
+        (
+            get_kedama_equips,
+            dict(min_price=500),
+            "SEARCH equip USING INDEX idx_kedama_equips_price (price>?)",
+        ),
+        (
+            get_lottery,
+            dict(min_date=50),
+            "SEARCH lottery_armor USING INDEX idx_lottery_armor_date (date>?)",
+        ),
+        # Text is compared case-insensitively, via the NOCASE indices
+        (
+            get_super_equips,
+            dict(buyer="BUYER"),
+            "SEARCH se USING INDEX idx_super_equips_buyer (buyer=?)",
+        ),
+    ],
+    ids=str,
+)
+def test_index_used(db, endpoint, params, expected):
+    plans = find_plans(db, endpoint, params)
+    assert any(expected in plan for plan in plans.values()), plans
+
+
+def test_where_builder_types():
+    wb = WhereBuilder("AND", columns=dict(price="number", buyer="text"))
+    wb.compare("price", ">=", 1000)
+    wb.compare("buyer", "=", 123)
+
+    assert wb.print() == (
+        "WHERE price >= ? AND buyer = ? COLLATE NOCASE",
+        [1000, "123"],
+    )
+
+
+@pytest.mark.parametrize(
+    "pattern,expected_where,expected_plan",
+    [
+        ("Buyer", "buyer = ? COLLATE NOCASE", "(buyer=?)"),
+        ("BUY%", "(buyer >= ? COLLATE NOCASE AND buyer < ? COLLATE NOCASE)", "(buyer>? AND buyer<?)"),
+        ("%uye%", "buyer LIKE ?", None),
+        ("b_yer%", "buyer LIKE ?", None),
+    ],
+)  # fmt: skip
+def test_like_rewrite(db, pattern, expected_where, expected_plan):
+    wb = WhereBuilder("AND", columns={"buyer": "text"})
+    wb.like("buyer", pattern)
+    where, data = wb.print()
+    assert where == f"WHERE {expected_where}"
+
+    # Same matches as the LIKE it replaces
+    query = f"SELECT id FROM super_equips {where}"
+    expected_rows = db.execute(
+        "SELECT id FROM super_equips WHERE buyer LIKE ?", [pattern]
+    ).fetchall()
+    assert db.execute(query, data).fetchall() == expected_rows
+    assert len(expected_rows) == 1
+
+    if expected_plan:
+        plan = [row[3] for row in db.execute(f"EXPLAIN QUERY PLAN {query}", data)]
+        assert plan == [
+            f"SEARCH super_equips USING INDEX idx_super_equips_buyer {expected_plan}"
+        ]
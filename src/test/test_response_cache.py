@@ -0,0 +1,157 @@
+import asyncio
+import sqlite3
+
+from classes.core.server import metrics
+from classes.core.server import server as server_module
+from classes.core.server.response_cache import ResponseCache, normalize_query
+from classes.db import DbPool, init_schema
+
+
+def _insert_auction(db, id: str):
+    db.execute(
+        "INSERT OR REPLACE INTO super_auctions (id, title, end_time, is_complete, last_fetch_time) VALUES (?, '', 0, 1, 0)",
+        [id],
+    )
+
+
+def test_normalize_query():
+    assert normalize_query(b"seller=&name=Peerless%20Heimd+&min_price=5") == [
+        ("min_price", "5"),
+        ("name", "peerless heimd"),
+    ]
+    assert normalize_query(b"cursor=AbC&name=AbC") == [
+        ("cursor", "AbC"),
+        ("name", "abc"),
+    ]
+
+
+def test_cache(tmp_path, monkeypatch):
+    fp = tmp_path / "db.sqlite"
+    db = init_schema(sqlite3.connect(fp))
+
+    monkeypatch.setattr(ResponseCache, "endpoints", {"/search": ["super_auctions"]})
+    monkeypatch.setattr(ResponseCache, "pool", DbPool(fp, read_only=True))
+    metrics.reset()
+
+    num_calls = 0
+
+    async def app(scope, receive, send):
+        nonlocal num_calls
+        num_calls += 1
+        await asyncio.sleep(0.01)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": str(num_calls).encode()})
+
+    cache = ResponseCache(app)
+
+    async def request(query: bytes, etag: str | None = None) -> tuple[int, str, bytes]:
+        headers = [(b"if-none-match", etag.encode())] if etag else []
+        scope = dict(
+            type="http",
+            method="GET",
+            path="/search",
+            query_string=query,
+            headers=headers,
+        )
+        status = 0
+        response_etag = ""
+        body = b""
+
+        async def send(message):
+            nonlocal status, response_etag, body
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_etag = dict(message["headers"])[b"etag"].decode()
+            else:
+                body += message.get("body", b"")
+
+        await cache(scope, None, send)  # type: ignore
+        return status, response_etag, body
+
+    async def get(query: bytes) -> bytes:
+        return (await request(query))[2]
+
+    async def run():
+        # Concurrent misses are collapsed into one call
+        bodies = await asyncio.gather(*[get(b"name=a") for _ in range(5)])
+        assert bodies == [b"1"] * 5
+
+        # Same params, differently written
+        assert await get(b"name=A&seller=") == b"1"
+        assert await get(b"name=b") == b"2"
+
+        # Conditional request for an unchanged result
+        _, etag, _ = await request(b"name=b")
+        assert await request(b"name=B", etag) == (304, etag, b"")
+
+        # Changing the table invalidates the entries
+        with db:
+            _insert_auction(db, "1")
+        assert await get(b"name=a") == b"3"
+        assert await get(b"name=a") == b"3"
+        status, new_etag, _ = await request(b"name=b", etag)
+        assert status == 200 and new_etag != etag
+
+    asyncio.run(run())
+    assert num_calls == 4
+
+    text = metrics.render()
+    labels = 'endpoint="/search",result='
+    assert f'response_cache_requests_total{{{labels}"miss"}} 4' in text
+    assert f'response_cache_requests_total{{{labels}"hit"}} 3' in text
+    assert f'response_cache_requests_total{{{labels}"collapsed"}} 4' in text
+    assert f'response_cache_requests_total{{{labels}"not_modified"}} 1' in text
+
+    metrics.reset()
+
+
+def test_cors_headers_per_origin(tmp_path, monkeypatch):
+    fp = tmp_path / "db.sqlite"
+    init_schema(sqlite3.connect(fp)).close()
+    monkeypatch.setattr(server_module, "ro_db_pool", DbPool(fp, read_only=True))
+    monkeypatch.setattr(ResponseCache, "pool", DbPool(fp, read_only=True))
+
+    async def request(origin: str, etag: str | None = None) -> tuple[int, dict]:
+        headers = [(b"origin", origin.encode())]
+        if etag:
+            headers.append((b"if-none-match", etag.encode()))
+        scope = dict(
+            type="http",
+            http_version="1.1",
+            method="GET",
+            scheme="http",
+            path="/lottery/search",
+            raw_path=b"/lottery/search",
+            root_path="",
+            query_string=b"",
+            headers=headers,
+            client=("127.0.0.1", 0),
+            server=("127.0.0.1", 4545),
+        )
+        start = dict()
+
+        async def receive():
+            return dict(type="http.request", body=b"", more_body=False)
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+
+        await server_module.server(scope, receive, send)
+        return start["status"], {k.decode(): v.decode() for k, v in start["headers"]}
+
+    async def run():
+        status, headers = await request("https://a.example")
+        assert status == 200
+        assert headers["access-control-allow-origin"] == "https://a.example"
+
+        # Replayed from the cache
+        status, headers = await request("https://b.example")
+        assert status == 200
+        assert headers["access-control-allow-origin"] == "https://b.example"
+
+        status, headers = await request("https://c.example", headers["etag"])
+        assert status == 304
+        assert headers["access-control-allow-origin"] == "https://c.example"
+
+    asyncio.run(run())
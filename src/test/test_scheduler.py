@@ -0,0 +1,24 @@
+import asyncio
+
+from classes.core.server import scheduler
+
+
+def test_job_restart(monkeypatch):
+    monkeypatch.setattr(scheduler, "MIN_BACKOFF_SECONDS", 0.01)
+    monkeypatch.setattr(scheduler, "MAX_BACKOFF_SECONDS", 0.04)
+
+    num_calls = 0
+
+    async def job():
+        nonlocal num_calls
+        num_calls += 1
+        raise ValueError()
+
+    async def run():
+        task = asyncio.create_task(scheduler.run_job("test", job))
+        # Backoff of 0.01 + 0.02 + 0.04 + 0.04 + ...
+        await asyncio.sleep(0.2)
+        task.cancel()
+
+    asyncio.run(run())
+    assert num_calls >= 4
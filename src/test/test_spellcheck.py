@@ -0,0 +1,138 @@
+import random
+import sqlite3
+import string
+
+from Levenshtein import distance
+
+from classes.core.server import spellcheck
+from classes.core.server.spellcheck import BkTree
+from classes.db import NAME_SOURCES, apply_name_log, init_schema, insert_metadata
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(0)
+    words = {
+        "".join(rng.choices(string.ascii_letters, k=rng.randint(2, 10))): rng.randint(
+            1, 50
+        )
+        for _ in range(2000)
+    }
+    tree = BkTree(words)
+    assert tree.size == len(words)
+
+    for _ in range(300):
+        query = "".join(rng.choices(string.ascii_letters, k=rng.randint(1, 12)))
+        best = min(distance(query, w) for w in words)
+
+        # Closest distance, with ties broken by count
+        expected = max(
+            (w for w in words if distance(query, w) == best), key=lambda w: words[w]
+        )
+        assert words[tree.nearest(query)] == words[expected]
+        assert distance(query, tree.nearest(query)) == best
+
+
+def test_index_rebuilds_on_version_change():
+    db = init_schema(sqlite3.connect(":memory:"))
+    with db:
+        db.execute("INSERT INTO equip_words (word, count) VALUES ('Wakizashi', 5)")
+        insert_metadata(db, spellcheck.DICTIONARY_VERSION_KEY, "1")
+
+    index = spellcheck.get_index(db)
+    assert index.correct("Wakizasi") == "Wakizashi"
+    assert spellcheck.get_index(db) is index
+
+    with db:
+        db.execute("INSERT INTO equip_words (word, count) VALUES ('Wakizashl', 10)")
+        insert_metadata(db, spellcheck.DICTIONARY_VERSION_KEY, "2")
+
+    rebuilt = spellcheck.get_index(db)
+    assert rebuilt is not index
+    assert rebuilt.correct("Wakizashi") == "Wakizashi"
+    assert rebuilt.correct("Wakizashx") == "Wakizashl"
+
+
+def _insert_names(db, names: list[tuple[int, str]]) -> None:
+    db.execute(
+        "INSERT OR IGNORE INTO super_auctions (id, title, end_time) VALUES ('1', '', 0)"
+    )
+    db.execute(
+        "INSERT OR IGNORE INTO kedama_auctions (id, title_short, title, start_time) VALUES ('1', '', '', 0)"
+    )
+
+    for id, name in names:
+        db.execute(
+            """
+            INSERT OR REPLACE INTO super_equips (id, id_auction, name, eid, key, is_isekai, stats, next_bid, seller)
+            VALUES (?, '1', ?, 1, 'key', 0, '{}', 0, '')
+            """,
+            [id, name],
+        )
+        db.execute(
+            """
+            INSERT OR REPLACE INTO kedama_equips (id, id_auction, name, eid, key, is_isekai, stats)
+            VALUES (?, '1', ?, 1, 'key', 0, '{}')
+            """,
+            [id, name],
+        )
+        db.execute(
+            """
+            INSERT OR REPLACE INTO equips (id, key, updated_at, data)
+            VALUES (?, 'key', '', json_object('name', ?))
+            """,
+            [id, name],
+        )
+
+
+def _select_words(db) -> dict[str, int]:
+    return dict(db.execute("SELECT word, count FROM equip_words").fetchall())
+
+
+def test_name_log():
+    db = init_schema(sqlite3.connect(":memory:"))
+
+    with db:
+        _insert_names(
+            db, [(1, "Legendary Ethereal Wakizashi"), (2, "Legendary Shade Helmet")]
+        )
+        apply_name_log(db)
+    assert _select_words(db) == {
+        "Legendary": 6,
+        "Ethereal": 3,
+        "Wakizashi": 3,
+        "Shade": 3,
+        "Helmet": 3,
+    }
+
+    # Replace, delete
+    with db:
+        _insert_names(db, [(1, "Peerless Ethereal Wakizashi")])
+        for table, _ in NAME_SOURCES:
+            db.execute(f"DELETE FROM {table} WHERE id = 2")
+        apply_name_log(db)
+    assert _select_words(db) == {
+        "Peerless": 3,
+        "Ethereal": 3,
+        "Wakizashi": 3,
+    }
+
+
+def test_name_log_migration():
+    db = init_schema(sqlite3.connect(":memory:"))
+
+    # Db from before equip_name_log, with an out-of-date dictionary
+    with db:
+        db.execute("DROP TABLE equip_name_log")
+        for table, _ in NAME_SOURCES:
+            for event in ["insert", "delete", "update"]:
+                db.execute(f"DROP TRIGGER {table}_name_log_{event}")
+        _insert_names(db, [(1, "Legendary Ethereal Wakizashi")])
+        db.execute("INSERT INTO equip_words (word, count) VALUES ('Helmet', 1)")
+
+    init_schema(db)
+    assert _select_words(db) == {
+        "Legendary": 3,
+        "Ethereal": 3,
+        "Wakizashi": 3,
+    }
+    assert spellcheck.get_index(db).correct("Wakizasi") == "Wakizashi"
@@ -0,0 +1,41 @@
+import sqlite3
+
+from utils import sql_trace
+from utils.sql_trace import TracedConnection, normalize_sql
+
+
+def test_normalize_sql():
+    assert (
+        normalize_sql(
+            "SELECT * FROM t\n  WHERE a IN (1, 2, 3) AND b = 'it''s' AND \"1_user\" = -1.5"
+        )
+        == 'SELECT * FROM t WHERE a IN (?) AND b = ? AND "1_user" = ?'
+    )
+
+
+def test_traces_statements(monkeypatch):
+    sql_trace.reset()
+    monkeypatch.setattr(sql_trace, "SLOW_QUERY_SECONDS", 0)
+
+    db = sqlite3.connect(":memory:", factory=TracedConnection)
+    db.execute("CREATE TABLE t (a INTEGER, b TEXT)")
+    db.executemany("INSERT INTO t VALUES (?, ?)", [(i, str(i)) for i in range(10)])
+
+    assert len(db.execute("SELECT * FROM t WHERE a > ?", [2]).fetchall()) == 7
+    assert len(list(db.execute("SELECT * FROM t WHERE a > ?", ["5"]))) == 4
+    assert db.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 10
+
+    shapes = {s.sql: s for s in sql_trace.select_top_shapes(100)}
+
+    select = shapes["SELECT * FROM t WHERE a > ?"]
+    assert select.count == 2
+    assert select.rows == 11
+    assert select.param_types == {"int": 1, "str": 1}
+
+    # Cursor left unexhausted is recorded once it's garbage collected
+    assert shapes["SELECT COUNT(*) FROM t"].rows == 1
+
+    slow = sql_trace.select_slow_queries()
+    assert any("SCAN t" in line for q in slow for line in q.plan)
+
+    sql_trace.reset()
@@ -0,0 +1,146 @@
+"""Keep a local mirror of a server's db in sync
+
+Usage: python3 tools/apply_export_changes.py [db_file] [--url https://hvdata.gisadan.dev] [--replace]
+
+The first run downloads /export/sqlite, later runs only download the rows changed since then (/export/changes).
+The export version of the mirror is kept in PRAGMA user_version.
+
+A db with data but without a version (eg the server's own db, or one made by piping /export/sqlite into sqlite3)
+is only replaced with a fresh snapshot if --replace is passed, since it may hold tables that aren't exported.
+"""
+
+import argparse
+import gzip
+import io
+import json
+import os
+import sqlite3
+import urllib.request
+from pathlib import Path
+
+DEFAULT_URL = "https://hvdata.gisadan.dev"
+DEFAULT_DB_FILE = "./data/mirror.sqlite"
+
+
+def sync(db_file: Path, url: str, replace: bool = False) -> None:
+    db = sqlite3.connect(db_file, isolation_level=None)
+    since = db.execute("PRAGMA user_version").fetchone()[0]
+    is_empty = (
+        db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table'").fetchone()
+        is None
+    )
+
+    # Empty, or its version is unknown (and a delta from version 0 would be the whole change log)
+    if since == 0:
+        db.close()
+        if not is_empty and not replace:
+            raise SystemExit(
+                f"{db_file} has data but no export version, so it isn't a mirror made by this tool. "
+                "Pass --replace to overwrite it with a fresh snapshot."
+            )
+
+        version = download_snapshot(db_file, url)
+        print(f"Downloaded snapshot (version {version})")
+    else:
+        version, counts = apply_changes(db, url, since)
+        print(f"Updated from version {since} to {version}: {counts}")
+        db.close()
+
+
+def download_snapshot(db_file: Path, url: str) -> int:
+    """Replace db_file with the server's latest snapshot
+
+    The dump is decompressed and applied a statement at a time, so memory use doesn't depend on its size.
+    """
+
+    # Built separately so that the old copy is kept if this fails
+    tmp_file = db_file.with_name(db_file.name + ".tmp")
+    tmp_file.unlink(missing_ok=True)
+
+    req = urllib.request.Request(
+        f"{url}/export/sqlite", headers={"Accept-Encoding": "gzip"}
+    )
+    with urllib.request.urlopen(req) as resp:
+        version = int(resp.headers["X-Export-Version"])
+
+        if resp.headers.get("Content-Encoding") == "gzip":
+            lines = gzip.open(resp, "rt", encoding="utf-8")
+        else:
+            lines = io.TextIOWrapper(resp, encoding="utf-8")
+
+        db = sqlite3.connect(tmp_file, isolation_level=None)
+        try:
+            with lines:
+                # (Statements may span several lines, eg text containing newlines)
+                statement = ""
+                for line in lines:
+                    statement += line
+                    if sqlite3.complete_statement(statement):
+                        db.execute(statement)
+                        statement = ""
+
+            db.execute(f"PRAGMA user_version = {version}")
+        finally:
+            db.close()
+
+    os.replace(tmp_file, db_file)
+    return version
+
+
+def apply_changes(
+    db: sqlite3.Connection, url: str, since: int
+) -> tuple[int, dict[str, int]]:
+    counts = dict(upsert=0, delete=0)
+
+    req = urllib.request.Request(f"{url}/export/changes?since={since}&format=ndjson")
+    with urllib.request.urlopen(req) as resp:
+        version = int(resp.headers["X-Export-Version"])
+
+        # All or nothing, so that user_version always matches the data
+        db.execute("BEGIN")
+        try:
+            for line in resp:
+                if not line.strip():
+                    continue
+
+                change = json.loads(line)
+                table = change["table"]
+
+                if change["op"] == "upsert":
+                    row = change["row"]
+                    cols = ", ".join(f'"{c}"' for c in row)
+                    placeholders = ", ".join("?" for _ in row)
+                    db.execute(
+                        f'INSERT OR REPLACE INTO "{table}" ({cols}) VALUES ({placeholders})',
+                        list(row.values()),
+                    )
+                else:
+                    key = change["key"]
+                    condition = " AND ".join(f'"{c}" = ?' for c in key)
+                    db.execute(
+                        f'DELETE FROM "{table}" WHERE {condition}', list(key.values())
+                    )
+
+                counts[change["op"]] += 1
+
+            db.execute(f"PRAGMA user_version = {version}")
+            db.execute("COMMIT")
+        except:
+            db.execute("ROLLBACK")
+            raise
+
+    return version, counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("db_file", nargs="?", default=DEFAULT_DB_FILE)
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument(
+        "--replace",
+        action="store_true",
+        help="Overwrite a db that wasn't made by this tool",
+    )
+    args = parser.parse_args()
+
+    sync(Path(args.db_file), args.url.rstrip("/"), args.replace)
@@ -0,0 +1,189 @@
+"""
+Compare requests / second for the search endpoints when each request
+(a) opens a new connection and runs init_schema (the old Depends(init_db) behavior), vs
+(b) borrows a connection from a DbPool
+
+Runs against a throwaway db filled with fake auctions, so the real db isn't touched.
+
+Usage:
+    export PYTHONPATH=/path/to/AmyBotV2/src; python3 /path/to/AmyBotV2/src/tools/bench_db_pool.py
+"""
+
+import asyncio
+import itertools
+import json
+import random
+import sqlite3
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import aiohttp
+from loguru import logger
+from uvicorn import Config, Server
+
+from classes.core.server import server as server_module
+from classes.db import DbPool, bootstrap_db, init_schema
+
+PORT = 4546
+CONCURRENCY = 16
+DURATION_SECONDS = 10
+NUM_AUCTIONS = 200
+EQUIPS_PER_AUCTION = 100
+
+# Selective queries (a handful of rows each) so that connection overhead isn't drowned out by serialization
+QUERIES = [
+    "/super/search_equips?name=peerl,oak,heimd&seller=user_7",
+    "/super/search_equips?name=lege,waki&buyer=user_8",
+    "/kedama/search_equips?name=shade,helm&seller=user_9",
+    "/lottery/search?user=user_7&min_date=1600000000",
+]
+
+
+def seed(fp: Path):
+    bootstrap_db(fp)
+    db = init_schema(sqlite3.connect(fp))
+
+    tiers = ["Legendary", "Peerless", "Magnificent"]
+    prefixes = ["Hallowed", "Shielding", "Charged", "Savage", ""]
+    slots = ["Oak Staff", "Wakizashi", "Shade Helmet", "Phase Robe", "Rapier"]
+    suffixes = ["of Heimdall", "of Slaughter", "of the Fleet", "of Surtr"]
+    names = [
+        " ".join(x.strip() for x in parts if x)
+        for parts in itertools.product(tiers, prefixes, slots, suffixes)
+    ]
+
+    with db:
+        for a in range(NUM_AUCTIONS):
+            db.execute(
+                "INSERT INTO super_auctions VALUES (?, ?, ?, 1, 0)",
+                [str(a), str(a), 1.5e9 + a * 86400 * 7],
+            )
+            db.execute(
+                "INSERT INTO kedama_auctions VALUES (?, ?, ?, ?, 1, 0)",
+                [str(a), str(a), str(a), 1.5e9 + a * 86400 * 7],
+            )
+
+            equips = []
+            for e in range(EQUIPS_PER_AUCTION):
+                equips.append(
+                    [
+                        f"Eq{e}",
+                        str(a),
+                        random.choice(names),
+                        random.randint(1, 10**9),
+                        "abcdefghij",
+                        0,
+                        500,
+                        json.dumps(["ADB 90%", "EDB 80%"]),
+                        random.randint(1, 10**7),
+                        f"user_{random.randint(0, 500)}",
+                        f"user_{random.randint(0, 500)}",
+                    ]
+                )
+
+            db.executemany(
+                """
+                INSERT INTO super_equips (id, id_auction, name, eid, key, is_isekai, level, stats, price, bid_link, next_bid, buyer, seller)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, 0, ?, ?)
+                """,
+                equips,
+            )
+            db.executemany(
+                """
+                INSERT INTO kedama_equips (id, id_auction, name, eid, key, is_isekai, level, stats, price, start_bid, post_index, buyer, seller)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, 0, ?, ?)
+                """,
+                equips,
+            )
+
+        for type in ["weapon", "armor"]:
+            for id in range(1, 3000):
+                users = [f"user_{random.randint(0, 500)}" for _ in range(6)]
+                db.execute(
+                    f"""
+                    INSERT INTO lottery_{type} (id, date, tickets, "1_prize", "1_user", "1b_prize", "1b_user", "2_prize", "2_user", "3_prize", "3_user", "4_prize", "4_user", "5_prize", "5_user")
+                    VALUES (?, ?, 1000, ?, ?, 'Equip Core', ?, '[1, "x"]', ?, '[1, "x"]', ?, '[1, "x"]', ?, '[1, "x"]', ?)
+                    """,
+                    [id, 1.4e9 + id * 86400, random.choice(names), *users],
+                )
+
+    db.close()
+
+
+async def measure(label: str) -> float:
+    """Hammer the server for DURATION_SECONDS and return requests / second"""
+
+    count = 0
+    deadline = time.time() + DURATION_SECONDS
+
+    async def worker(session: aiohttp.ClientSession):
+        nonlocal count
+        for path in itertools.cycle(QUERIES):
+            if time.time() > deadline:
+                return
+
+            resp = await session.get(f"http://127.0.0.1:{PORT}{path}")
+            await resp.read()
+            assert resp.status == 200, resp.status
+            count += 1
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*[worker(session) for _ in range(CONCURRENCY)])
+
+    rps = count / DURATION_SECONDS
+    print(f"{label:<24} {rps:>8.1f} req/s")
+    return rps
+
+
+async def main():
+    # Don't let log i/o skew the numbers
+    logger.remove()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fp = Path(tmp_dir) / "bench.sqlite"
+        print("Seeding db...")
+        seed(fp)
+
+        # Old behavior
+        def per_request_db():
+            return init_schema(sqlite3.connect(fp, check_same_thread=False))
+
+        # New behavior
+        pool = DbPool(fp, read_only=True, size=8)
+
+        def pooled_db():
+            with pool.connection() as db:
+                yield db
+
+        app = server_module.server
+        app.router.lifespan_context = _no_lifespan
+
+        server = Server(Config(app=app, port=PORT, log_level="warning"))
+        task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.1)
+
+        try:
+            app.dependency_overrides[server_module.get_ro_db] = per_request_db
+            before = await measure("init_db() per request")
+
+            app.dependency_overrides[server_module.get_ro_db] = pooled_db
+            after = await measure("DbPool")
+
+            print(f"Speedup: {after / before:.2f}x")
+        finally:
+            server.should_exit = True
+            await task
+            pool.close()
+
+
+@asynccontextmanager
+async def _no_lifespan(app):
+    # The real lifespan bootstraps the production db
+    yield
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,163 @@
+"""
+Compare the time per infer_equip_stats() call for the test/stubs/equip_html cases
+(a) with the old lookup, which re-read RANGES_FILE for each of the normal / legendary passes and scanned each level's keys case-insensitively, vs
+(b) with the compiled RangeIndex
+
+Uses data/ranges.json if it exists (for realistic parse times), otherwise the ranges from the test stubs.
+
+Usage:
+    export PYTHONPATH=/path/to/AmyBotV2/src; python3 /path/to/AmyBotV2/src/tools/bench_infer_equip_stats.py
+"""
+
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+from loguru import logger
+
+from classes.core.server import infer_equip_stats as ies
+from classes.core.server.equip_parser import parse_equip_html
+from config import paths
+from test.stubs import equip_html
+from test.stubs.equip_html.ranges import TEST_RANGES
+
+NUM_ROUNDS = 50
+
+
+def measure(label: str, f: Callable[[dict], dict], equips: list[dict]) -> float:
+    # Warm up
+    for equip in equips:
+        f(equip)
+
+    start = time.perf_counter()
+    for _ in range(NUM_ROUNDS):
+        for equip in equips:
+            f(equip)
+    per_equip_us = (time.perf_counter() - start) / (NUM_ROUNDS * len(equips)) * 10**6
+
+    print(f"{label:<16} {per_equip_us:>8.0f}us / equip")
+    return per_equip_us
+
+
+def main():
+    # Don't let log i/o skew the numbers
+    logger.remove()
+
+    equips = [parse_equip_html(case.html) for case in equip_html.ALL_CASES]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if not paths.RANGES_FILE.exists():
+            paths.RANGES_FILE = Path(tmp_dir) / "ranges.json"
+            paths.RANGES_FILE.write_text(json.dumps(TEST_RANGES))
+        print(f"{len(equips)} equips, ranges from {paths.RANGES_FILE}")
+
+        for equip in equips:
+            assert ies.infer_equip_stats(equip) == old_infer_equip_stats(equip)
+
+        before = measure("Old lookup", old_infer_equip_stats, equips)
+        after = measure("RangeIndex", ies.infer_equip_stats, equips)
+        print(f"Speedup: {before / after:.1f}x")
+
+
+# Old behavior
+def old_infer_equip_stats(equip: dict) -> dict:
+    return dict(
+        percentiles=_old_calc_all_percentiles(equip),
+        legendary_percentiles=_old_calc_all_percentiles(
+            equip, tier_override="Legendary"
+        ),
+    )
+
+
+def _old_calc_all_percentiles(equip: dict, tier_override: str | None = None):
+    ranges = json.loads(paths.RANGES_FILE.read_text())
+
+    path_options = ies._enumerate_range_path_options_from_name(equip["name"])
+    if tier_override:
+        for p in path_options:
+            p["quality"] = tier_override
+
+    percentiles = dict()
+
+    if equip["weapon_damage"]:
+        base = equip["weapon_damage"]["Attack Damage"]["base"]
+        real_base = ies._downgrade_stat("", "Attack Damage", base, equip)
+        percentiles["weapon_damage"] = {
+            "Attack Damage": _old_calc_percentile(
+                ranges, path_options, "", "Attack Damage", real_base
+            ),
+        }
+
+    for cat, stats in equip["stats"].items():
+        percentiles[cat] = dict()
+        for st, d in stats.items():
+            real_base = ies._downgrade_stat(cat, st, d["base"], equip)
+            percentiles[cat][st] = _old_calc_percentile(
+                ranges, path_options, cat, st, real_base
+            )
+
+    return percentiles
+
+
+def _old_calc_percentile(
+    ranges: dict, path_options: list[dict], cat: str, stat: str, base_value: float
+) -> float | None:
+    alias = stat
+    if cat == "Damage Mitigations":
+        if stat in ["Holy", "Dark", "Wind", "Elec", "Cold", "Fire"]:
+            alias += " MIT"
+    elif cat == "Spell Damage":
+        alias += " EDB"
+
+    for p in path_options:
+        r = _old_find_min_max(ranges, p, alias)
+        if not r:
+            continue
+
+        mn, mx = r
+        if mn == mx:
+            return None if mn == 0 else 1.0
+        return (base_value - mn) / (mx - mn)
+
+    return None
+
+
+def _old_find_min_max(ranges: dict, path: dict, stat: str):
+    def walk(d: dict, keys: list[str]):
+        v = d
+        for k in keys:
+            for k2 in v:
+                if k2.lower() == k.lower():
+                    v = v[k2]
+                    break
+            else:
+                return None
+        return v
+
+    def is_match(req: str, value: str | None) -> bool:
+        if req == "all":
+            return True
+        is_negative = req.startswith("not!")
+        result = req.replace("not!", "").lower() == (value or "").lower()
+        return not result if is_negative else result
+
+    d = walk(ranges, [path["slot"], path["quality"], stat])
+    if not d and path["category"]:
+        d = walk(ranges, [path["category"], path["slot"], path["quality"], stat])
+    if not d:
+        return None
+
+    for req, min_max in d.items():
+        prefix_req, suffix_req = req.split(" | ")
+        if is_match(prefix_req, path["prefix"]) and is_match(
+            suffix_req, path["suffix"]
+        ):
+            return (min_max["min"], min_max["max"])
+
+    return None
+
+
+if __name__ == "__main__":
+    main()
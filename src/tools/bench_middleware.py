@@ -0,0 +1,184 @@
+"""
+Measure the per-request overhead of the server's middleware stack (ErrorLog, GZipWrapper, PerformanceLog, RequestLog)
+(a) with the old BaseHTTPMiddleware versions, which RequestLog used to buffer the whole response body in, vs
+(b) with the current pure ASGI versions
+
+Requests are sent straight to the ASGI app (no sockets), against a small response and a large streamed one.
+
+Usage:
+    export PYTHONPATH=/path/to/AmyBotV2/src; python3 /path/to/AmyBotV2/src/tools/bench_middleware.py
+"""
+
+import asyncio
+import time
+import tracemalloc
+from typing import Awaitable, Callable
+
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from loguru import logger
+from starlette.concurrency import iterate_in_threadpool
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from classes.core.server.middleware import (
+    ErrorLog,
+    GZipWrapper,
+    PerformanceLog,
+    RequestLog,
+)
+
+NUM_REQUESTS = 5000
+NUM_LARGE_REQUESTS = 20
+
+# Roughly the size of an /export/json response
+LARGE_CHUNK_SIZE = 2**16
+LARGE_CHUNK_COUNT = 160
+
+
+def create_app(middlewares: list) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/small")
+    def small():
+        return PlainTextResponse("ok")
+
+    @app.get("/large")
+    def large():
+        # New bytes per chunk, so that buffering shows up in the peak memory
+        return StreamingResponse(
+            b"x" * LARGE_CHUNK_SIZE for _ in range(LARGE_CHUNK_COUNT)
+        )
+
+    for middleware in middlewares:
+        app.add_middleware(middleware)
+
+    return app
+
+
+async def request(app: FastAPI, path: str) -> int:
+    """Send a GET and return the number of body bytes received"""
+
+    size = 0
+    is_request_sent = False
+    is_response_done = asyncio.Event()
+
+    async def receive():
+        nonlocal is_request_sent
+        if not is_request_sent:
+            is_request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        # StreamingResponse listens for a disconnect while sending
+        await is_response_done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal size
+        if message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                is_response_done.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("localhost", 80),
+    }
+
+    await app(scope, receive, send)
+    return size
+
+
+async def measure(label: str, app: FastAPI, baseline: float | None) -> float:
+    # Warm up
+    await request(app, "/small")
+
+    start = time.perf_counter()
+    for _ in range(NUM_REQUESTS):
+        await request(app, "/small")
+    per_request_us = (time.perf_counter() - start) / NUM_REQUESTS * 10**6
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(NUM_LARGE_REQUESTS):
+        size = await request(app, "/large")
+        assert size == LARGE_CHUNK_SIZE * LARGE_CHUNK_COUNT
+    large_ms = (time.perf_counter() - start) / NUM_LARGE_REQUESTS * 1000
+    peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+
+    overhead = f"(+{per_request_us - baseline:.0f}us)" if baseline is not None else ""
+    print(
+        f"{label:<24} {per_request_us:>6.0f}us / request {overhead:<10}"
+        f" {large_ms:>6.1f}ms / 10MB response, {peak_mb:>5.1f}MB peak"
+    )
+    return per_request_us
+
+
+async def main():
+    # Don't let log i/o skew the numbers
+    logger.remove()
+
+    # Always sample, for the worst case
+    RequestLog.body_sample_rate = 1
+
+    stack = [ErrorLog, GZipWrapper, PerformanceLog, RequestLog]
+    old_stack = [OldErrorLog, GZipWrapper, OldPerformanceLog, OldRequestLog]
+
+    baseline = await measure("No middleware", create_app([]), None)
+    await measure("BaseHTTPMiddleware", create_app(old_stack), baseline)
+    await measure("ASGI middleware", create_app(stack), baseline)
+
+
+# Old behavior
+_CallNext = Callable[[Request], Awaitable[StreamingResponse]]
+
+
+class OldRequestLog(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next: _CallNext):
+        logger.debug(f"{request.method} {request.url}")
+        resp = await call_next(request)
+
+        resp_body = [section async for section in resp.body_iterator]
+        resp.body_iterator = iterate_in_threadpool(iter(resp_body))
+
+        if resp_body:
+            try:
+                resp_data = resp_body[0].decode()  # type: ignore
+                logger.trace(resp_data)
+            except UnicodeDecodeError:
+                size = sum(len(x) for x in resp_body)
+                logger.trace(f"gzip'd response of size {size}")
+
+        return resp
+
+
+class OldErrorLog(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next: _CallNext):
+        try:
+            return await call_next(request)
+        except:
+            logger.exception("")
+            raise
+
+
+class OldPerformanceLog(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next: _CallNext):
+        start = time.time()
+        resp = await call_next(request)
+        elapsed_ms = (time.time() - start) * 1000
+        logger.debug(f"Response took {elapsed_ms:.0f}ms")
+        return resp
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+"""
+Compare requests / second for the search endpoints when the server runs with 1, 2, 4, ... uvicorn workers
+
+Each worker is its own process, so throughput should scale with the worker count up to the number of cores.
+The response cache is disabled so that every request runs its search.
+
+Runs against a throwaway db filled with fake auctions (see bench_db_pool.py), so the real db isn't touched.
+
+Usage:
+    export PYTHONPATH=/path/to/AmyBotV2/src; python3 /path/to/AmyBotV2/src/tools/bench_workers.py
+"""
+
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import time
+from pathlib import Path
+from urllib.error import URLError
+from urllib.request import urlopen
+
+import uvicorn
+from loguru import logger
+
+from classes.core.server import server as server_module
+from classes.core.server.response_cache import ResponseCache
+from classes.db import DbPool
+from tools import bench_db_pool
+from tools.bench_db_pool import PORT, measure, seed
+
+WORKER_COUNTS = [1, 2, 4, 8]
+STARTUP_TIMEOUT_SECONDS = 30
+
+# Tells the worker processes where the seeded db is
+DB_ENV_VAR = "BENCH_WORKERS_DB"
+
+
+def create_app():
+    """App factory for the worker processes, pointed at the seeded db"""
+
+    logger.remove()
+
+    fp = os.environ[DB_ENV_VAR]
+    server_module.ro_db_pool = DbPool(fp, read_only=True)
+    server_module.db_pool = DbPool(fp, size=2)
+
+    ResponseCache.endpoints = dict()
+
+    app = server_module.server
+    app.router.lifespan_context = bench_db_pool._no_lifespan
+    return app
+
+
+def serve(num_workers: int) -> None:
+    uvicorn.run(
+        "tools.bench_workers:create_app",
+        factory=True,
+        port=PORT,
+        workers=num_workers,
+        log_level="warning",
+    )
+
+
+def wait_for_server() -> None:
+    deadline = time.time() + STARTUP_TIMEOUT_SECONDS
+    while True:
+        try:
+            urlopen(f"http://127.0.0.1:{PORT}/docs").close()
+            return
+        except URLError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+async def main():
+    # Don't let log i/o skew the numbers
+    logger.remove()
+
+    num_cores = os.cpu_count() or 1
+    print(f"{num_cores} cores")
+    if num_cores < max(WORKER_COUNTS):
+        print(f"(Expect no speedup past {num_cores} worker(s))")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fp = Path(tmp_dir) / "bench.sqlite"
+        print("Seeding db...")
+        seed(fp)
+        os.environ[DB_ENV_VAR] = str(fp)
+
+        baseline = None
+        for num_workers in WORKER_COUNTS:
+            # Fresh server per run, so that no run starts with warm workers
+            process = multiprocessing.get_context("spawn").Process(
+                target=serve, args=[num_workers]
+            )
+            process.start()
+
+            try:
+                await asyncio.to_thread(wait_for_server)
+                rps = await measure(f"{num_workers} worker(s)")
+            finally:
+                process.terminate()
+                process.join()
+
+            baseline = baseline or rps
+            print(f"Speedup: {rps / baseline:.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,3 +1,5 @@
+import json
+from collections import OrderedDict
 from typing import Any, Literal, TypeAlias
 
 import bs4
@@ -7,11 +9,18 @@ from yarl import URL
 
 from config import logger
 
+# Number of responses kept for conditional requests (only ones that came with an ETag)
+VALIDATOR_CACHE_SIZE = 64
+
+# url --> (etag, body), for requests made with conditional=True
+_validator_cache: OrderedDict[str, tuple[str, str]] = OrderedDict()
+
 
 async def do_get(
     url: str | URL,
     session: ClientSession | None = None,
     content_type: Literal["html", "text", "json"] = "html",
+    conditional: bool = False,
 ) -> Any:
     """Perform a GET
 
@@ -19,6 +28,9 @@ async def do_get(
         url:
         session: For accumulating cookies
         content_type: Whether to return a BeautifulSoup instance, str, or list / dict
+        conditional: If an earlier response for the same url had an ETag, send it as If-None-Match
+                     and reuse the earlier body when the server replies 304.
+                     The cache is shared and keyed only by url, so only use this for responses that don't depend on cookies / headers (eg the api's).
 
     Raises:
         Exception:
@@ -26,19 +38,34 @@ async def do_get(
     """
     session_ = session or create_session()
 
+    key = str(url)
+    cached = _validator_cache.get(key) if conditional else None
+    headers = {"If-None-Match": cached[0]} if cached else {}
+
     logger.info(f"GET {url}")
-    resp = await session_.get(url)
-    if resp.status != 200:
+    resp = await session_.get(url, headers=headers)
+    if resp.status == 304 and cached:
+        _validator_cache.move_to_end(key)
+        text = cached[1]
+    elif resp.status == 200:
+        text = await resp.text(encoding="utf-8")
+
+        etag = resp.headers.get("ETag")
+        if conditional and etag:
+            _validator_cache[key] = (etag, text)
+            _validator_cache.move_to_end(key)
+            if len(_validator_cache) > VALIDATOR_CACHE_SIZE:
+                _validator_cache.popitem(last=False)
+    else:
         raise Exception(resp.status)
 
     match content_type:
         case "html":
-            result = await resp.text(encoding="utf-8")
-            result = BeautifulSoup(result, "lxml")
+            result = BeautifulSoup(text, "lxml")
         case "text":
-            result = await resp.text(encoding="utf-8")
+            result = text
         case "json":
-            result = await resp.json(encoding="utf-8")
+            result = json.loads(text)
         case default:
             raise Exception(content_type)
 
@@ -49,15 +76,25 @@ async def do_get(
 
 
 async def do_post(
-    url: URL,
+    url: URL | str,
     data: Any = None,
     session: ClientSession | None = None,
     content_type: Literal["html", "text", "json"] = "html",
+    json: Any = None,
 ) -> Any:
+    """Perform a POST
+
+    Args:
+        url:
+        data: Form data
+        session: For accumulating cookies
+        content_type: Whether to return a BeautifulSoup instance, str, or list / dict
+        json: Request body to send as json (instead of data)
+    """
     session_ = session or create_session()
 
     logger.info(f"POST {url}")
-    resp = await session_.post(url, data=data)
+    resp = await session_.post(url, data=data, json=json)
     if resp.status != 200:
         raise Exception(resp.status)
 
@@ -1,19 +1,83 @@
 from dataclasses import dataclass, field
 from typing import Any, Literal
 
+# How values compared against a column are bound
+#   text    as a str, compared case-insensitively (if the builder's ignore_case is set)
+#   number  as is, so that sqlite can search a (binary) numeric index instead of converting each row
+ColumnType = Literal["text", "number"]
+
+# Shortest term that a trigram full-text index can match
+FTS_MIN_TERM_LENGTH = 3
+
+# Folds A-Z only, like sqlite's NOCASE collation and LIKE
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
 
 @dataclass
 class WhereBuilder:
     mode: Literal["OR", "AND"] = "AND"
     ignore_case: bool = True
     fragments: list["Condition | WhereBuilder"] = field(default_factory=list)
+    # Column (as written in the conditions, eg "se.price") --> type
+    columns: dict[str, ColumnType] = field(default_factory=dict)
+
+    def add(self, expr: str, *data: Any):
+        """Add a condition as is, with a value for each of its placeholders (eg "se.price IS NULL")"""
 
-    def add(self, expr: str, data: Any = None):
         self.fragments.append(Condition(expr, data))
 
     def add_builder(self, builder: "WhereBuilder"):
         self.fragments.append(builder)
 
+    def child(self, mode: Literal["OR", "AND"]) -> "WhereBuilder":
+        """Empty builder with the same settings, for a nested group of conditions"""
+
+        return WhereBuilder(mode, self.ignore_case, columns=self.columns)
+
+    def compare(self, column: str, op: Literal["=", "<", "<=", ">", ">="], value: Any):
+        """Add a comparison against a column from self.columns
+
+        eg compare("se.price", "<=", 1000) --> "se.price <= ?"
+        """
+
+        match self.columns[column]:
+            case "text":
+                collate = " COLLATE NOCASE" if self.ignore_case else ""
+                self.add(f"{column} {op} ?{collate}", str(value))
+            case "number":
+                self.add(f"{column} {op} ?", value)
+
+    def like(self, column: str, pattern: str):
+        """Add a LIKE against a text column
+
+        Patterns without wildcards become an exact match and patterns ending in the only wildcard become a range,
+        so that an index on the column can be searched instead of every row being checked:
+            "abc"   --> column = 'abc' COLLATE NOCASE
+            "abc%"  --> column >= 'abc' COLLATE NOCASE AND column < 'abd' COLLATE NOCASE
+            "%abc%" --> column LIKE '%abc%'
+        """
+
+        assert self.columns[column] == "text"
+
+        wildcards = [idx for idx, c in enumerate(pattern) if c in "%_"]
+        if not wildcards:
+            self.add(f"{column} = ? COLLATE NOCASE", pattern)
+            return
+
+        prefix = pattern[:-1]
+        if wildcards == [len(prefix)] and pattern[-1] == "%" and prefix:
+            lower = prefix.translate(_ASCII_LOWER)
+            upper = _increment_last_char(lower)
+            if upper is not None:
+                wb = self.child("AND")
+                wb.add(f"{column} >= ? COLLATE NOCASE", lower)
+                wb.add(f"{column} < ? COLLATE NOCASE", upper)
+                self.add_builder(wb)
+                return
+
+        # LIKE is already case-insensitive (for ascii)
+        self.add(f"{column} LIKE ?", pattern)
+
     def print(self, root=True) -> tuple[str, list[Any]]:
         if len(self.fragments) == 0:
             return ("", [])
@@ -23,13 +87,8 @@ class WhereBuilder:
 
             for frag in self.fragments:
                 if isinstance(frag, Condition):
-                    ex = frag.expr
-                    if self.ignore_case:
-                        ex += " COLLATE NOCASE"
-                    exprs.append(ex)
-
-                    if frag.data is not None:
-                        data.append(str(frag.data))
+                    exprs.append(frag.expr)
+                    data.extend(frag.data)
                 elif isinstance(frag, WhereBuilder):
                     e, d = frag.print(root=False)
                     exprs.append(e)
@@ -49,4 +108,39 @@ class WhereBuilder:
 @dataclass
 class Condition:
     expr: str
-    data: Any = None
+    data: tuple[Any, ...] = ()
+
+
+def _increment_last_char(text: str) -> str | None:
+    """Smallest string (under NOCASE) greater than every string that starts with text, or None if there isn't one
+
+    text should already be lowercase
+    """
+
+    code = ord(text[-1]) + 1
+    # Under NOCASE A-Z sort as a-z, so the character after "@" is "["
+    if code == ord("A"):
+        code = ord("[")
+    if code > 0x10FFFF:
+        return None
+    # Skip surrogates, which can't be encoded
+    if 0xD800 <= code <= 0xDFFF:
+        code = 0xE000
+    return text[:-1] + chr(code)
+
+
+def to_fts_query(fragments: list[str]) -> str:
+    """Convert search terms into an FTS5 query (for a trigram index) that requires each term as a substring
+
+    eg ["lege", "oak", "heimd"] --> '"lege" AND "oak" AND "heimd"'
+
+    Terms shorter than FTS_MIN_TERM_LENGTH never match a trigram index, so they should be filtered with LIKE instead.
+    """
+
+    terms = []
+    for frag in fragments:
+        # Quoting prevents FTS operators (AND, NOT, -, etc) from being interpreted
+        escaped = frag.replace('"', '""')
+        terms.append(f'"{escaped}"')
+
+    return " AND ".join(terms)
@@ -0,0 +1,243 @@
+"""Opt-in tracing of the statements run on a connection
+
+Connections opened with factory=TracedConnection record each statement's duration (execute + fetching rows),
+rows returned, and bound parameter types, aggregated by query shape (the sql with literals and whitespace normalized).
+Statements slower than SLOW_QUERY_SECONDS are logged with their query plan.
+
+This adds Python-level overhead to every row fetched, so it's meant to be turned on while investigating.
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Any
+
+from config import logger
+
+logger = logger.bind(tags=["sql"])
+
+SLOW_QUERY_SECONDS = 0.1
+# Number of slow queries kept for select_slow_queries()
+SLOW_QUERY_LOG_SIZE = 100
+
+
+@dataclass
+class QueryShape:
+    sql: str
+    count: int = 0
+    total_seconds: float = 0
+    max_seconds: float = 0
+    rows: int = 0
+    # Counts of each combination of parameter types (eg "str, int")
+    param_types: Counter = field(default_factory=Counter)
+
+
+@dataclass
+class SlowQuery:
+    sql: str
+    param_types: str
+    seconds: float
+    rows: int
+    plan: list[str]
+
+
+_lock = threading.Lock()
+_shapes: dict[str, QueryShape] = dict()
+_slow_queries: deque[SlowQuery] = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+
+
+def select_top_shapes(limit: int = 20) -> list[QueryShape]:
+    """Query shapes with the highest total time"""
+
+    with _lock:
+        shapes = sorted(_shapes.values(), key=lambda s: -s.total_seconds)
+        return shapes[:limit]
+
+
+def select_slow_queries() -> list[SlowQuery]:
+    """Most recent slow queries, newest first"""
+
+    with _lock:
+        return list(reversed(_slow_queries))
+
+
+def reset() -> None:
+    with _lock:
+        _shapes.clear()
+        _slow_queries.clear()
+
+
+def normalize_sql(sql: str) -> str:
+    """Replace literals with ? and collapse whitespace, so that queries that only differ by their values are grouped together
+
+    eg "SELECT * FROM t WHERE a IN (1, 2, 3)  AND b = 'x'" -> "SELECT * FROM t WHERE a IN (?) AND b = ?"
+    """
+
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"(?<![\w\"])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", "?", sql)
+    sql = re.sub(r"\s+", " ", sql).strip()
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)+\s*\)", "(?)", sql)
+    return sql
+
+
+class TracedCursor(sqlite3.Cursor):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._trace: _Trace | None = None
+
+    def execute(self, sql: str, parameters: Any = (), /):
+        self._finish()
+
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        self._trace = _Trace(sql, parameters, time.perf_counter() - start)
+
+        # Eg an INSERT
+        if self.description is None:
+            self._finish()
+
+        return self
+
+    def executemany(self, sql: str, seq_of_parameters: Any, /):
+        self._finish()
+
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._trace = _Trace(sql, (), time.perf_counter() - start)
+        self._finish()
+
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._add_fetch(time.perf_counter() - start, 0 if row is None else 1)
+
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size: int | None = None):
+        size = self.arraysize if size is None else size
+
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._add_fetch(time.perf_counter() - start, len(rows))
+
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._add_fetch(time.perf_counter() - start, len(rows))
+
+        self._finish()
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._finish()
+            raise
+
+        self._add_fetch(time.perf_counter() - start, 1)
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # Eg the cursor from db.execute(...).fetchone()
+        self._finish()
+
+    def _add_fetch(self, seconds: float, rows: int) -> None:
+        if self._trace:
+            self._trace.seconds += seconds
+            self._trace.rows += rows
+
+    def _finish(self) -> None:
+        trace = getattr(self, "_trace", None)
+        if trace is None:
+            return
+        self._trace = None
+
+        shape = normalize_sql(trace.sql)
+        param_types = _describe_params(trace.parameters)
+
+        with _lock:
+            stats = _shapes.get(shape)
+            if stats is None:
+                stats = _shapes[shape] = QueryShape(shape)
+
+            stats.count += 1
+            stats.total_seconds += trace.seconds
+            stats.max_seconds = max(stats.max_seconds, trace.seconds)
+            stats.rows += trace.rows
+            stats.param_types[param_types] += 1
+
+        if trace.seconds >= SLOW_QUERY_SECONDS:
+            plan = self._explain(trace)
+            slow = SlowQuery(shape, param_types, trace.seconds, trace.rows, plan)
+            with _lock:
+                _slow_queries.append(slow)
+
+            plan_text = "\n".join(plan)
+            logger.warning(
+                f"Slow query ({trace.seconds * 1000:.0f}ms, {trace.rows} rows, params {param_types}): {shape}\n{plan_text}"
+            )
+
+    def _explain(self, trace: "_Trace") -> list[str]:
+        try:
+            # Plain Cursor so the EXPLAIN isn't traced
+            cursor = sqlite3.Cursor(self.connection)
+            rows = cursor.execute(
+                f"EXPLAIN QUERY PLAN {trace.sql}", trace.parameters
+            ).fetchall()
+
+            # Indent each step under its parent, like the sqlite3 shell
+            depths = {0: -1}
+            plan = []
+            for id, parent, _, detail in rows:
+                depths[id] = depths.get(parent, -1) + 1
+                plan.append("  " * depths[id] + detail)
+            return plan
+        except sqlite3.Error as e:
+            return [f"(EXPLAIN failed: {e})"]
+
+
+class TracedConnection(sqlite3.Connection):
+    """Connection whose statements are traced (pass as sqlite3.connect(..., factory=TracedConnection))"""
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    # The base versions don't go through the cursor's execute()
+    def execute(self, sql: str, parameters: Any = (), /):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any, /):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+@dataclass
+class _Trace:
+    sql: str
+    parameters: Any
+    seconds: float
+    rows: int = 0
+
+
+def _describe_params(parameters: Any) -> str:
+    if isinstance(parameters, dict):
+        values = parameters.values()
+    else:
+        values = parameters
+    return ", ".join(type(v).__name__ for v in values)